@@ -0,0 +1,285 @@
+# Binary rotation curve catalogs
+# Reading a directory of text files with DataAid or DataImporter
+# parses every file, every time. packCatalog does that once and
+# writes the whole catalog into a single binary file, which
+# openCatalog memory maps. Getting a galaxy out of it is then
+# just a view into the file, nothing is read until it's used.
+#
+# File layout:
+# - 8 byte magic, then the length of the JSON header as a uint64
+# - The JSON header: column names, units, counts, and where each array is
+# - The arrays, each starting on a 64 byte boundary:
+#     data       float64, ncols x nrows, one row per column (columnar)
+#     offsets    int64, ngalaxies + 1, galaxy i is data[:, offsets[i]:offsets[i+1]]
+#     names      fixed width bytes, in catalog order
+#     sorted_names, name_order  the names sorted, and where each one is in
+#                catalog order, used to look galaxies up by binary search
+#     distance   float64, from the "# Distance = ..." header line (NaN if missing)
+#     header_offsets, header_text  the raw header lines of each file
+#     file_hash  20 bytes per galaxy, the SHA-1 of the source file
+
+import json
+import re
+from os.path import join, basename
+
+import numpy as np
+
+import DataAid
+import DataReader
+
+MAGIC = b'RCFMCAT1'
+ALIGNMENT = 64
+
+_distance_re = re.compile(r'distance\s*[=:]?\s*([-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)', re.IGNORECASE)
+
+
+def parseDistance(header):
+    """The distance from a "# Distance = 3.36 Mpc" style header, or NaN"""
+
+    for line in header:
+        match = _distance_re.search(line)
+        if match:
+            return float(match.group(1))
+    return np.nan
+
+
+def packCatalog(dirRelPath, outFilename):
+    """Packs every galaxy file in a directory into a binary catalog
+
+    Files are chosen and galaxies named the same way as DataAid.GetGalaxyData
+    (see DataAid.galaxyName). The galaxies are in the order of their file
+    names, sorted, so the same directory always packs the same way;
+    GetGalaxyData gives them in directory order, which depends on the file system.
+
+    Parameters:
+    :dirRelPath: The directory of galaxy files, e.g. "data/Sparc/Rotmod_LTG/"
+    :outFilename: Where to write the catalog"""
+
+    names, galaxies, headers, hashes = [], [], [], []
+    columns, units = [], []
+    for fileName in sorted(DataAid.getFiles(dirRelPath)):
+        path = join(dirRelPath, fileName)
+        dataFile = DataReader.readDataFile(path)
+        if not columns:
+            columns, units = dataFile.columns, dataFile.units
+        names.append(DataAid.galaxyName(fileName))
+        galaxies.append(dataFile.values)
+        headers.append(dataFile.header)
+        hashes.append(DataAid.hashFile(path))
+
+    writeCatalog(outFilename, names, galaxies, headers=headers, hashes=hashes,
+                 columns=columns, units=units, source=dirRelPath)
+
+
+def writeCatalog(outFilename, names, galaxies, headers=None, hashes=None,
+                 columns=(), units=(), source=''):
+    """Writes galaxies that are already in memory as a binary catalog
+
+    Parameters:
+    :outFilename: Where to write the catalog
+    :names: Galaxy names, must be unique
+    :galaxies: One 2-D array (points x columns) per galaxy. Galaxies
+               with fewer columns than the widest are padded with NaN
+    :headers: Optional list of header lines for each galaxy
+    :hashes: Optional SHA-1 hex digest of each galaxy's source file
+    :columns: Optional column names
+    :units: Optional column units
+    :source: Optional description of where the catalog came from"""
+
+    if len(set(names)) != len(names):
+        raise ValueError("Galaxy names in a catalog must be unique")
+    if headers is None:
+        headers = [[] for _ in names]
+
+    galaxies = [np.atleast_2d(np.asarray(x, dtype=np.float64)) for x in galaxies]
+    lengths = np.array([x.shape[0] for x in galaxies], dtype=np.int64)
+    offsets = np.zeros(len(galaxies) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    ncols = max((x.shape[1] for x in galaxies), default=len(columns))
+
+    data = np.full((ncols, offsets[-1]), np.nan)
+    for galaxy, start, stop in zip(galaxies, offsets[:-1], offsets[1:]):
+        data[:galaxy.shape[1], start:stop] = galaxy.T
+
+    encodedNames = np.array([x.encode('utf-8') for x in names], dtype=bytes)
+    if encodedNames.dtype.itemsize == 0:
+        encodedNames = encodedNames.astype('S1')
+    headerBytes = ['\n'.join(x).encode('utf-8') for x in headers]
+    headerOffsets = np.zeros(len(headerBytes) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in headerBytes], out=headerOffsets[1:])
+    if hashes is None:
+        fileHash = np.zeros((len(names), 20), dtype=np.uint8)
+    else:
+        fileHash = np.frombuffer(b''.join(bytes.fromhex(x) for x in hashes),
+                                 dtype=np.uint8).reshape(len(names), 20)
+
+    nameOrder = np.argsort(encodedNames, kind='stable').astype(np.int64)
+
+    arrays = {
+        'data': data,
+        'offsets': offsets,
+        'names': encodedNames,
+        'sorted_names': encodedNames[nameOrder],
+        'name_order': nameOrder,
+        'distance': np.array([parseDistance(x) for x in headers], dtype=np.float64),
+        'header_offsets': headerOffsets,
+        'header_text': np.frombuffer(b''.join(headerBytes), dtype=np.uint8),
+        'file_hash': fileHash,
+    }
+
+    # Work out where everything goes, the header has to be written first
+    # but its length depends on the offsets, so pad it to a fixed size
+    layout = {}
+    position = 0
+    for key, array in arrays.items():
+        layout[key] = {'offset': position, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        position += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header = {
+        'version': 1,
+        'source': source,
+        'columns': list(columns),
+        'units': list(units),
+        'ngalaxies': len(names),
+        'nrows': int(offsets[-1]),
+        'arrays': layout,
+    }
+    headerJson = json.dumps(header).encode('utf-8')
+    dataStart = -(-(len(MAGIC) + 8 + len(headerJson)) // ALIGNMENT) * ALIGNMENT
+    headerJson = headerJson.ljust(dataStart - len(MAGIC) - 8)
+
+    with open(outFilename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(headerJson)).tobytes())
+        f.write(headerJson)
+        for key, array in arrays.items():
+            f.seek(dataStart + layout[key]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(dataStart + position)
+
+
+def openCatalog(filename):
+    """Opens a catalog written by packCatalog or writeCatalog"""
+    return PackedCatalog(filename)
+
+
+class PackedCatalog:
+    """A memory mapped binary catalog
+
+    This behaves like the dictionary from DataAid.GetGalaxyData:
+    catalog[name] gives that galaxy as a 2-D array of points x columns,
+    and keys(), items(), len() and "in" all work. The arrays are
+    read-only views into the file, no data is copied.
+
+    Column names and units are in catalog.columns and catalog.units.
+    Per-galaxy metadata is available through header(name),
+    distance(name) and file_hash(name)."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError(f"{filename} is not a rotation curve catalog")
+            headerLength = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            header = json.loads(f.read(headerLength).decode('utf-8'))
+
+        self.source = header['source']
+        self.columns = header['columns']
+        self.units = header['units']
+
+        self._map = np.memmap(filename, dtype=np.uint8, mode='r')
+        dataStart = len(MAGIC) + 8 + headerLength
+        for key, info in header['arrays'].items():
+            dtype = np.dtype(info['dtype'])
+            start = dataStart + info['offset']
+            count = int(np.prod(info['shape'], dtype=np.int64)) * dtype.itemsize
+            array = self._map[start:start + count].view(dtype).reshape(info['shape'])
+            setattr(self, '_' + key, array)
+
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+
+    def __contains__(self, name):
+        return self._index(name) is not None
+
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+    def __getitem__(self, name):
+        i = self._index(name)
+        if i is None:
+            raise KeyError(name)
+        return self.galaxy(i)
+
+
+    def _index(self, name):
+        """Position of a galaxy in the catalog, found by binary search"""
+
+        key = np.array(name.encode('utf-8'), dtype=self._names.dtype)
+        if len(key.item()) != len(name.encode('utf-8')):
+            # Longer than any name in the catalog
+            return None
+        pos = np.searchsorted(self._sorted_names, key)
+        if pos < len(self._sorted_names) and self._sorted_names[pos] == key:
+            return int(self._name_order[pos])
+        return None
+
+
+    def galaxy(self, i):
+        """The i-th galaxy, as a points x columns view"""
+        return self._data[:, self._offsets[i]:self._offsets[i + 1]].T
+
+
+    def keys(self):
+        return [x.decode('utf-8') for x in self._names]
+
+
+    def items(self):
+        return ((name, self.galaxy(i)) for i, name in enumerate(self.keys()))
+
+
+    def header(self, name):
+        """The header lines of the galaxy's source file"""
+        i = self._indexOrRaise(name)
+        text = self._header_text[self._header_offsets[i]:self._header_offsets[i + 1]]
+        return text.tobytes().decode('utf-8').split('\n') if len(text) else []
+
+
+    def distance(self, name):
+        """The galaxy distance from its header, NaN if it didn't have one"""
+        return float(self._distance[self._indexOrRaise(name)])
+
+
+    def file_hash(self, name):
+        """SHA-1 hex digest of the galaxy's source file, as from DataAid.hashFile"""
+        return self._file_hash[self._indexOrRaise(name)].tobytes().hex()
+
+
+    def toGalaxyCatalog(self, dtype=np.float64):
+        """The catalog as a GalaxyCatalog.GalaxyCatalog
+
+        For float64 this uses the file's arrays, nothing is copied"""
+
+        import GalaxyCatalog
+        return GalaxyCatalog.GalaxyCatalog(self.keys(), self._data, self._offsets, self.columns, dtype)
+
+
+    def _indexOrRaise(self, name):
+        i = self._index(name)
+        if i is None:
+            raise KeyError(name)
+        return i
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 3:
+        print(f"usage: python {basename(sys.argv[0])} galaxy_directory catalog_file")
+        sys.exit(1)
+    packCatalog(sys.argv[1], sys.argv[2])
@@ -2,6 +2,8 @@ from os import listdir
 from os.path import join
 import hashlib
 
+import DataReader
+
 # Python program to find the SHA-1 message digest of a file
 def hashFile(filename):
    """"This function returns the SHA-1 hash
@@ -16,54 +18,54 @@ def hashFile(filename):
        # loop till the end of the file
        chunk = 0
        while chunk != b'':
-           # read only 1024 bytes at a time
-           chunk = file.read(1024)
+           # read 1 MB at a time
+           chunk = file.read(1 << 20)
            h.update(chunk)
 
    # return the hex representation of digest
    return h.hexdigest()
 
+# The data files in a folder, skipping hidden files, without reading them
+def listFiles(dirRelPath):
+  return [x for x in listdir(dirRelPath) if x[0] != '.']
+
+# The name of the galaxy in a data file: the file name without its
+#  last four characters (the .dat), as GetGalaxyData has always named them
+# Everything that names galaxies after their files (CatalogFile,
+#  GalaxyCatalog, Pipeline) uses this, so a catalog's names don't depend
+#  on how it was read
+def galaxyName(fileName):
+  return fileName[:-4]
+
 # Goes into the specified folder for Galaxies and returns
-#  all unique files in the specified relative folder
-def getFiles(dirRelPath):
-  fileList = [x for x in listdir(dirRelPath) if x[0] != '.']
-  hashList = [hashFile(join(dirRelPath,x)) for x in fileList]
+#  the files in the specified relative folder
+# With unique=True, files with the same contents as one earlier in
+#  the list are left out (DuplicateIndex.py finds duplicates across folders)
+def getFiles(dirRelPath, unique=False):
+  fileList = listFiles(dirRelPath)
+  if not unique:
+    return fileList
 
   filteredFileList = []
-  filteredHashList = []
-  for thisFile, thisHash in zip(fileList, hashList):
-     if thisHash not in filteredHashList:
-        filteredHashList.append(thisHash)
+  seenHashes = set()
+  for thisFile in fileList:
+     thisHash = hashFile(join(dirRelPath,thisFile))
+     if thisHash not in seenHashes:
+        seenHashes.add(thisHash)
         filteredFileList.append(thisFile)
 
-  filteredFileList = fileList
-
   return filteredFileList
 
-# Given a line of data from a file, convert each string value
-#  (which are sepperated by tabs) to floats
-def dataLineToValues(line):
-  stringValues = line.split("\t")
-  floatValues = list(map(lambda x: float(x), stringValues))
-  return floatValues
-
 # Returns all the galaxy data in the given folder
+# Each galaxy is a 2-D NumPy array of points x columns
 def GetGalaxyData(galaxiesDirRelPath):
   files = getFiles(galaxiesDirRelPath)
 
-  # Dictionary "galaxy name"->[list of data points]
+  # Dictionary "galaxy name"->[array of data points]
   data = {}
 
   for fileName in files:
-    file = open(galaxiesDirRelPath + fileName, "r")
-    # Convert the file string to an array of each line
-    lines = file.read().splitlines()
-    # Cut off the first 3 lines which are just comments
-    dataLines = lines[3:]
-    # Convert each line to a list of data points
-    parsedLines = list(map(dataLineToValues, dataLines))
-    
-    data[fileName[:-4]] = parsedLines
-    file.close()
+    # Skips the # header lines and parses the rest in one go
+    data[galaxyName(fileName)] = DataReader.readValues(galaxiesDirRelPath + fileName)
 
   return data
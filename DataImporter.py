@@ -6,12 +6,10 @@
 
 import pandas as pd
 from numpy import sqrt
-import io
 from functools import reduce
 
-# This is admittedly a little convoluted
-# Using StringIO to "preprocess" what we give to Pandas
-# Probably would be clearer to just process directly
+import DataReader
+
 def getGalaxyData(filename):
     """Reads data in either the Little Things or Sparc format
     
@@ -21,27 +19,7 @@ def getGalaxyData(filename):
     - Units (also with a #)
     - tab separated rows of values"""
     
-    def processLine(line):
-        # If it starts with a #, special handling
-        # Check if it contains "rad", meaning it's the column names
-        if line.strip()[0] == '#':
-            if "rad" in line.lower():
-                # Pop off the #
-                return line.strip()[1:].strip() + '\n'
-            else:
-                return "\n"
-        else:
-            return line.strip() + '\n'
-        
-    buffer = io.StringIO()
-    
-    with open(filename) as f:
-        for line in f:
-            buffer.write(processLine(line))
-            
-    buffer.seek(0)
-            
-    return pd.read_csv(buffer, sep='\t')
+    return DataReader.readDataFile(filename, asDataFrame=True)
 
 def getXueSofue(filename):
     """Reads in the XueSofue data format
@@ -51,7 +29,7 @@ def getXueSofue(filename):
     - No column names
     - Tab separated data, two columns, radius and vLum"""
     
-    return pd.read_csv(filename, sep='\t', comment='#', names=['rad', 'vLum'])
+    return pd.DataFrame(DataReader.readValues(filename)[:, :2], columns=['rad', 'vLum'])
 
 def calcVLum(galaxy, cols=['Vgas', 'Vdisk', 'Vbul'], inPlace=True):
     """This computes vLum column for the galaxy DataFrame.
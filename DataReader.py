@@ -0,0 +1,182 @@
+# A single, fast reader for all of the data file formats
+# Replaces the line-by-line parsing in DataAid.py and the
+# StringIO + pandas route in DataImporter.py
+#
+# Handles:
+# - Sparc and Little Things: optional "# Distance" line, a "# Rad ..."
+#   column name line and a "# kpc ..." units line, then tab separated values
+# - XueSofue and McGaugh Milky Ways: a few # comment lines, then radius, vLum
+#
+# The whole file is read and converted to floats in one call, and the
+# result is NumPy arrays. Pandas is only imported if a DataFrame is asked for.
+
+import numpy as np
+
+# Column names to use when a file doesn't have a column name line
+MILKY_WAY_COLUMNS = ['rad', 'vLum']
+
+
+class DataFile:
+    """The contents of one data file
+
+    Attributes:
+    :header: The # lines at the top of the file, as written
+    :columns: Column names, from the header if it has them
+    :units: Column units, from the line after the column names if there is one
+    :values: 2-D NumPy array of points x columns
+
+    Columns can be looked up by name (dataFile['Rad']) or position
+    (dataFile[0]), either way giving a view into values."""
+
+    __slots__ = ['header', 'columns', 'units', 'values']
+
+    def __init__(self, header, columns, units, values):
+        self.header = header
+        self.columns = columns
+        self.units = units
+        self.values = values
+
+
+    def __getitem__(self, column):
+        if isinstance(column, str):
+            column = self.columns.index(column)
+        return self.values[:, column]
+
+
+    def __len__(self):
+        return self.values.shape[0]
+
+
+    def toDataFrame(self):
+        """The values as a Pandas DataFrame with the column names"""
+
+        import pandas as pd
+
+        return pd.DataFrame(self.values, columns=self.columns)
+
+
+def readDataFile(filename, asDataFrame=False):
+    """Reads a galaxy or Milky Way data file
+
+    Data format is:
+    - Any number of header lines starting with #. If one contains "rad"
+      it's the column names, and the line after it is the units
+    - Whitespace separated rows of values
+
+    Parameters:
+    :filename: The file to read
+    :asDataFrame: Return a Pandas DataFrame instead of a DataFile
+
+    Columns without names are named col<N>, except that two column
+    files with no names get MILKY_WAY_COLUMNS"""
+
+    with open(filename) as f:
+        text = f.read()
+    return parseDataFile(text, asDataFrame)
+
+
+def parseDataFile(text, asDataFrame=False):
+    """Parses the text of a data file, as readDataFile does after reading it"""
+
+    # Header lines are the leading lines starting with #
+    header = []
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start)
+        if end == -1:
+            end = len(text)
+        line = text[start:end]
+        if line.strip()[:1] != '#':
+            break
+        header.append(line.rstrip('\r'))
+        start = end + 1
+    body = text[start:]
+
+    values = _parseValues(body)
+
+    columns, units = [], []
+    for i, line in enumerate(header):
+        if 'rad' in line.lower():
+            columns = _splitHeaderLine(line)
+            if i + 1 < len(header):
+                units = _splitHeaderLine(header[i + 1])
+            break
+
+    ncols = values.shape[1]
+    if not columns and ncols == len(MILKY_WAY_COLUMNS):
+        columns = list(MILKY_WAY_COLUMNS)
+    # Some files have notes in the column name line, or fewer names than columns
+    columns = columns[:ncols] + [f"col{i}" for i in range(len(columns), ncols)]
+    units = units[:ncols]
+
+    dataFile = DataFile(header, columns, units, values)
+    if asDataFrame:
+        return dataFile.toDataFrame()
+    return dataFile
+
+
+def _splitHeaderLine(line):
+    """Splits a # line into fields, on tabs if it has them (names can have spaces)"""
+
+    line = line.strip()[1:]
+    if '\t' in line:
+        return [x.strip() for x in line.split('\t') if x.strip()]
+    return line.split()
+
+
+def readValues(filename):
+    """Just the values of a data file, as a 2-D NumPy array of points x columns"""
+    return readDataFile(filename).values
+
+
+def _parseValues(body):
+    """Converts whitespace separated rows of numbers to a 2-D array
+
+    Rows that are shorter than the longest row are padded with NaN"""
+
+    flat = np.array(body.split(), dtype=np.float64)
+    if flat.size == 0:
+        return np.zeros((0, 0))
+
+    # Counting the values on each line is cheap next to converting them,
+    # and only if every (non-blank) line has the same number can the
+    # values be taken as rows of that length
+    lines = body.strip().split('\n')
+    lengths = {len(line.split()) for line in lines}
+    lengths.discard(0)
+    if len(lengths) == 1:
+        ncols = lengths.pop()
+        return flat.reshape(flat.size // ncols, ncols)
+
+    return _parseRagged(lines)
+
+
+def _parseRagged(lines):
+    rows = [line.split() for line in lines if line.strip()]
+    ncols = max(len(x) for x in rows)
+    values = np.full((len(rows), ncols), np.nan)
+    for i, row in enumerate(rows):
+        values[i, :len(row)] = np.array(row, dtype=np.float64)
+    return values
+
+
+def readLuminosityRatios(filename):
+    """Reads the L/Reff table, e.g. data/L_Reff_ratio.txt
+
+    Data format is:
+    - A description line
+    - Column names, Galaxy and L/R sof
+    - Tab separated galaxy name and L/R
+
+    Returns a dictionary of galaxy name -> L/R. The names match the
+    galaxy names from DataAid.GetGalaxyData (e.g. CamB_rotmod)"""
+
+    with open(filename) as f:
+        lines = f.read().splitlines()
+
+    ratios = {}
+    for line in lines[2:]:
+        fields = line.strip().split('\t')
+        if len(fields) >= 2 and fields[1].strip():
+            ratios[fields[0].strip()] = float(fields[1])
+    return ratios
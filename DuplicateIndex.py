@@ -0,0 +1,195 @@
+# Index of duplicate data files
+# utils/checkForDuplicates.py used to hash every file in every data
+# directory on each run. A DuplicateIndex keeps, in one SQLite file,
+# each file's size and modification time with two hashes of it:
+#
+#   sha1     SHA-1 of the file's bytes, as DataAid.hashFile gives
+#   content  hash of the numbers in the file (FitCache.hashArray of the
+#            values DataReader reads), the same for files with the same
+#            data written differently, e.g. spaces instead of tabs, a
+#            different header or 1.50 instead of 1.5
+#
+# On each update, only files whose size or modification time changed
+# (or that are new) are read again, across worker processes, so a run
+# over a directory that hasn't changed only lists it:
+#
+#   with DuplicateIndex.DuplicateIndex("duplicates.sqlite") as index:
+#       index.update(["data/Sparc/Rotmod_LTG/", "data/Sparc/SparcSubset135/"])
+#       index.exactDuplicates()     # lists of files with the same bytes
+#       index.numericDuplicates()   # lists of files with the same numbers
+
+import hashlib
+import os
+import sqlite3
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join, normpath
+
+# Files hashed by a worker at a time
+DEFAULT_CHUNKSIZE = 64
+
+
+def hashContents(path):
+    """(sha1, content hash) of a file, reading it once
+
+    The content hash is None for files that aren't data files DataReader can read"""
+
+    import DataReader
+    import FitCache
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    sha1 = hashlib.sha1(data).hexdigest()
+    try:
+        values = DataReader.parseDataFile(data.decode('utf-8', errors='replace')).values
+        content = FitCache.hashArray(values) if values.size else None
+    except ValueError:
+        content = None
+    return sha1, content
+
+
+def _hashPath(path):
+    return (path,) + hashContents(path)
+
+
+def scanFiles(directories):
+    """Dictionary of path -> (size, modification time in ns) of the data files in the directories
+
+    Files are chosen as DataAid.listFiles does (hidden files are skipped),
+    and only files directly in each directory are included"""
+
+    files = {}
+    for directory in directories:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name[0] != '.' and entry.is_file():
+                    stat = entry.stat()
+                    files[normpath(join(directory, entry.name))] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+class DuplicateIndex:
+    """Hashes of data files, kept up to date between runs
+
+    Create one with DuplicateIndex(filename); the file is created if it
+    doesn't exist. Call update with the directories to index, then
+    exactDuplicates or numericDuplicates."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, "
+                                "mtime INTEGER, sha1 TEXT, content TEXT)")
+        self.connection.commit()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+
+    def close(self):
+        self.connection.close()
+
+
+    def update(self, directories, workers=None, chunksize=DEFAULT_CHUNKSIZE):
+        """Brings the index up to date with the files in these directories
+
+        Parameters:
+        :directories: Directories of data files, or a single one
+        :workers: Number of worker processes hashing files. Defaults to
+                  the number of CPUs, 1 hashes everything in this process
+        :chunksize: Files handed to a worker at a time
+
+        New files and files whose size or modification time has changed
+        are hashed, and files that are no longer in the directories are
+        dropped from the index. Returns the number of files hashed"""
+
+        if isinstance(directories, str):
+            directories = [directories]
+        directories = [normpath(x) for x in directories]
+        files = scanFiles(directories)
+
+        known = {}
+        for directory in directories:
+            query = "SELECT path, size, mtime FROM files WHERE path LIKE ? ESCAPE '\\'"
+            for path, size, mtime in self.connection.execute(query, (_prefixPattern(directory),)):
+                known[path] = (size, mtime)
+        # LIKE also matches files in subdirectories, which aren't scanned
+        known = {path: stat for path, stat in known.items() if os.path.dirname(path) in directories}
+
+        removed = [(path,) for path in known if path not in files]
+        changed = [path for path, stat in files.items() if known.get(path) != stat]
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers == 1 or len(changed) <= chunksize:
+            hashes = map(_hashPath, changed)
+            rows = [(path, *files[path], sha1, content) for path, sha1, content in hashes]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                hashes = executor.map(_hashPath, changed, chunksize=chunksize)
+                rows = [(path, *files[path], sha1, content) for path, sha1, content in hashes]
+
+        with self.connection:
+            self.connection.executemany("DELETE FROM files WHERE path = ?", removed)
+            self.connection.executemany("INSERT OR REPLACE INTO files (path, size, mtime, sha1, content) "
+                                        "VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+
+    def exactDuplicates(self, directories=None):
+        """Lists of files with exactly the same bytes, see duplicates"""
+        return self.duplicates('sha1', directories)
+
+
+    def numericDuplicates(self, directories=None):
+        """Lists of files with the same numbers, however they're written, see duplicates"""
+        return self.duplicates('content', directories)
+
+
+    def duplicates(self, key='sha1', directories=None):
+        """Groups of files in the index with the same hash
+
+        Parameters:
+        :key: 'sha1' for the bytes of the files, or 'content' for their numbers
+        :directories: Only look at files in these directories (default: every file in the index)
+
+        Returns a list of lists of paths, each sorted, with two or more paths each"""
+
+        if key not in ('sha1', 'content'):
+            raise ValueError(f"Unknown duplicate key {key}, must be 'sha1' or 'content'")
+        if isinstance(directories, str):
+            directories = [directories]
+        if directories is not None:
+            directories = {normpath(x) for x in directories}
+
+        groups = defaultdict(list)
+        query = f"SELECT path, {key} FROM files WHERE {key} IS NOT NULL"
+        for path, value in self.connection.execute(query):
+            if directories is None or os.path.dirname(path) in directories:
+                groups[value].append(path)
+        return sorted(sorted(x) for x in groups.values() if len(x) > 1)
+
+
+def _prefixPattern(directory):
+    """LIKE pattern for the paths in a directory"""
+
+    escaped = directory.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return join(escaped, '%')
+
+
+def findDuplicates(directories, filename, workers=None):
+    """Updates the index in filename for these directories and returns
+    (exact duplicates, numeric duplicates) among their files"""
+
+    with DuplicateIndex(filename) as index:
+        index.update(directories, workers)
+        return index.exactDuplicates(directories), index.numericDuplicates(directories)
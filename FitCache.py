@@ -0,0 +1,88 @@
+# Persistent cache of fit results
+# A fit only depends on the galaxy data, the Milky Way data,
+# the version of the model and the fit options, so results are
+# stored under a hash of those four things. Changing a data file
+# changes its hash, so only that galaxy gets refit, and the same
+# galaxy appearing in two catalogs is only ever fit once.
+#
+# The cache is a single SQLite file, which can be shared between
+# runs and MW models. Only the process running fit_catalog
+# reads and writes it, never the worker processes.
+
+import hashlib
+import json
+import sqlite3
+
+import numpy as np
+
+
+def hashArray(data):
+    """SHA-1 of the numbers in an array, as a hex string
+
+    This is a hash of the content rather than the file, so it doesn't
+    change when the same data is stored differently, and works for
+    data that never came from a file"""
+
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    h = hashlib.sha1()
+    h.update(str(data.shape).encode('utf-8'))
+    h.update(data.tobytes())
+    return h.hexdigest()
+
+
+def cacheKey(galaxyHash, milkyWayHash, modelVersion, options=None):
+    """Combines everything a fit depends on into a single key
+
+    Parameters:
+    :galaxyHash: Hash of the galaxy data, e.g. from hashArray
+    :milkyWayHash: Hash of the Milky Way data
+    :modelVersion: The version of the model, e.g. Neros.MODEL_VERSION
+    :options: Dictionary of anything else that changes the fit results"""
+
+    description = json.dumps([galaxyHash, milkyWayHash, modelVersion, options or {}],
+                             sort_keys=True)
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+class FitCache:
+    """Fit results stored on disk, keyed by cacheKey
+
+    Create one with FitCache(filename); the file is created if it
+    doesn't exist. Results are dictionaries that can be stored as JSON."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS fits (key TEXT PRIMARY KEY, result TEXT)")
+        self.connection.commit()
+
+
+    def get_many(self, keys):
+        """Returns a dictionary of key -> result for the keys that are cached"""
+
+        found = {}
+        keys = list(set(keys))
+        # SQLite limits the number of parameters in one query
+        batch = 500
+        for i in range(0, len(keys), batch):
+            chunk = keys[i:i + batch]
+            query = "SELECT key, result FROM fits WHERE key IN ({})".format(','.join('?' * len(chunk)))
+            for key, result in self.connection.execute(query, chunk):
+                found[key] = json.loads(result)
+        return found
+
+
+    def put_many(self, results):
+        """Stores a dictionary of key -> result"""
+
+        self.connection.executemany("INSERT OR REPLACE INTO fits (key, result) VALUES (?, ?)",
+                                    [(key, json.dumps(result)) for key, result in results.items()])
+        self.connection.commit()
+
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM fits").fetchone()[0]
+
+
+    def close(self):
+        self.connection.close()
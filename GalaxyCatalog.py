@@ -0,0 +1,241 @@
+# Galaxy catalogs in memory, as a few big arrays
+# DataAid.GetGalaxyData gives a dictionary with one small array per
+# galaxy. For the real catalogs that's fine, but with 10^5 galaxies
+# (e.g. synthetic ones) the per-array overhead and the conversions add up.
+# A GalaxyCatalog keeps every point of every galaxy in one
+# (columns x points) array, with an offsets index, the same layout
+# as CatalogFile.py uses on disk:
+#
+#   data     float64 (or float32), one contiguous row per column
+#   offsets  int64, galaxy i is data[:, offsets[i]:offsets[i+1]]
+#
+# catalog[name] gives a Galaxy, a small record of views into data
+# (nothing is copied), which Neros.fit_catalog and Neros.galaxy_columns
+# take directly:
+#
+#   catalog = GalaxyCatalog.fromDirectory("data/Sparc/Rotmod_LTG/")
+#   neros.fit(*catalog["NGC2841_rotmod"].fit_columns)
+#   Neros.fit_catalog(catalog, MWXueSofue)
+
+import numpy as np
+
+import DataAid
+import DataReader
+
+# Columns, in the Sparc/Little Things order that Neros.galaxy_columns expects
+RAD, VOBS, ERRV, VGAS, VDISK, VBUL = range(6)
+
+# Galaxies copied into a catalog at a time, by fromGalaxies
+_BLOCK_GALAXIES = 4096
+
+
+class Galaxy:
+    """One galaxy of a GalaxyCatalog
+
+    columns is a (columns x points) view into the catalog, and rad,
+    vObs, vObsError, vGas, vDisk and vBulge are views of its rows.
+    fit_columns gives them in the order Neros.fit takes them, always
+    as float64. np.asarray(galaxy) gives a points x columns array like
+    the ones in the DataAid.GetGalaxyData dictionary."""
+
+    __slots__ = ['name', 'columns']
+
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = columns
+
+
+    def __len__(self):
+        return self.columns.shape[1]
+
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.columns.T, dtype=dtype)
+
+
+    def __repr__(self):
+        return f"Galaxy({self.name!r}, {len(self)} points)"
+
+
+    @property
+    def rad(self):
+        return self.columns[RAD]
+
+
+    @property
+    def vObs(self):
+        return self.columns[VOBS]
+
+
+    @property
+    def vObsError(self):
+        return self.columns[ERRV]
+
+
+    @property
+    def vGas(self):
+        return self.columns[VGAS]
+
+
+    @property
+    def vDisk(self):
+        return self.columns[VDISK]
+
+
+    @property
+    def vBulge(self):
+        return self.columns[VBUL]
+
+
+    @property
+    def fit_columns(self):
+        """rad, vGas, vDisk, vBulge, vObs, vObsError, as for Neros.fit
+
+        These are views for a float64 catalog, float32 ones are converted"""
+
+        columns = self.columns
+        if columns.shape[0] < 6:
+            raise ValueError("Galaxy data must have at least six columns")
+        if columns.dtype != np.float64:
+            columns = columns[:6].astype(np.float64)
+        return columns[RAD], columns[VGAS], columns[VDISK], columns[VBUL], columns[VOBS], columns[ERRV]
+
+
+class GalaxyCatalog:
+    """A whole catalog of galaxies, stored column by column in one array
+
+    It behaves like the dictionary from DataAid.GetGalaxyData:
+    catalog[name] gives that galaxy (as a Galaxy), and keys(), items(),
+    len() and "in" all work. The galaxies are in the order they were given.
+
+    Usually made with fromDirectory, fromCatalog or fromGalaxies.
+
+    Parameters:
+    :names: The galaxy names, must be unique
+    :data: (columns x points) array of every galaxy's points, one after the other
+    :offsets: len(names) + 1 positions in data, galaxy i is data[:, offsets[i]:offsets[i+1]]
+    :columns: Optional column names
+    :dtype: float64, or float32 to halve the memory used. Fits are
+            always done in float64 (see Galaxy.fit_columns)"""
+
+    def __init__(self, names, data, offsets, columns=(), dtype=np.float64):
+        self.names = list(names)
+        self.data = np.ascontiguousarray(data, dtype=dtype)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        self.columns = list(columns)
+
+        if self.data.ndim != 2:
+            raise ValueError("Catalog data must be (columns x points)")
+        if len(self.offsets) != len(self.names) + 1 or self.offsets[-1] != self.data.shape[1]:
+            raise ValueError("Catalog offsets don't match the names and data")
+        self._index = {name: i for i, name in enumerate(self.names)}
+        if len(self._index) != len(self.names):
+            raise ValueError("Galaxy names in a catalog must be unique")
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    def __contains__(self, name):
+        return name in self._index
+
+
+    def __iter__(self):
+        return iter(self.names)
+
+
+    def __getitem__(self, name):
+        return self.galaxy(self._index[name])
+
+
+    def galaxy(self, i):
+        """The i-th galaxy"""
+        return Galaxy(self.names[i], self.data[:, self.offsets[i]:self.offsets[i + 1]])
+
+
+    def keys(self):
+        return list(self.names)
+
+
+    def items(self):
+        return ((name, self.galaxy(i)) for i, name in enumerate(self.names))
+
+
+    def values(self):
+        return (self.galaxy(i) for i in range(len(self.names)))
+
+
+    @property
+    def lengths(self):
+        """Number of points in each galaxy"""
+        return np.diff(self.offsets)
+
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+
+    def subset(self, names):
+        """A new catalog with just these galaxies, in this order"""
+
+        indices = [self._index[name] for name in names]
+        return fromGalaxies({self.names[i]: self.galaxy(i).columns.T for i in indices},
+                            columns=self.columns, dtype=self.data.dtype)
+
+
+def fromGalaxies(galaxies, columns=(), dtype=np.float64):
+    """A GalaxyCatalog from a dictionary of galaxy name -> 2-D (points x columns) data
+
+    The data can be anything np.asarray takes, e.g. the values from
+    DataAid.GetGalaxyData. Galaxies with fewer columns than the widest
+    are padded with NaN"""
+
+    names = list(galaxies)
+    arrays = [np.atleast_2d(np.asarray(galaxies[name])) for name in names]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in arrays], out=offsets[1:])
+    ncols = max((x.shape[1] for x in arrays), default=len(columns))
+
+    if arrays and all(x.shape[1] == ncols for x in arrays):
+        # Blocks of galaxies at a time, far fewer copies than one per galaxy,
+        # without a second copy of the whole catalog
+        data = np.empty((ncols, offsets[-1]), dtype=dtype)
+        for first in range(0, len(arrays), _BLOCK_GALAXIES):
+            last = min(first + _BLOCK_GALAXIES, len(arrays))
+            data[:, offsets[first]:offsets[last]] = np.concatenate(arrays[first:last]).T
+    else:
+        data = np.full((ncols, offsets[-1]), np.nan, dtype=dtype)
+        for array, start, stop in zip(arrays, offsets[:-1], offsets[1:]):
+            data[:array.shape[1], start:stop] = array.T
+    return GalaxyCatalog(names, data, offsets, columns, dtype)
+
+
+def fromDirectory(dirRelPath, dtype=np.float64):
+    """A GalaxyCatalog of every galaxy file in a directory
+
+    Files are chosen and named the same way as DataAid.GetGalaxyData"""
+
+    galaxies = {}
+    columns = []
+    for fileName in DataAid.getFiles(dirRelPath):
+        dataFile = DataReader.readDataFile(dirRelPath + fileName)
+        columns = columns or dataFile.columns
+        galaxies[DataAid.galaxyName(fileName)] = dataFile.values
+    return fromGalaxies(galaxies, columns, dtype)
+
+
+def fromCatalog(catalog, dtype=np.float64):
+    """A GalaxyCatalog from a CatalogFile.PackedCatalog, or any galaxy dictionary
+
+    A float64 GalaxyCatalog of a PackedCatalog uses the file's arrays
+    directly, so its galaxies are views into the memory map"""
+
+    if isinstance(catalog, GalaxyCatalog):
+        if catalog.data.dtype == dtype:
+            return catalog
+        return GalaxyCatalog(catalog.names, catalog.data, catalog.offsets, catalog.columns, dtype)
+    if hasattr(catalog, 'toGalaxyCatalog'):
+        return catalog.toGalaxyCatalog(dtype)
+    return fromGalaxies(catalog, dtype=dtype)
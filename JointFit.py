@@ -0,0 +1,165 @@
+# Joint fit of a whole catalog with a shared alpha(L/Reff) law
+# fit-analysis/alpha_correlation_plots.py fits alpha = A*(L/R)^k to
+# alphas that came out of separate per-galaxy fits. Here A and k are
+# fit directly, together with disk_scale and bulge_scale for every galaxy.
+#
+# Each galaxy's residuals only depend on A, k and its own two scales,
+# so the Jacobian is block sparse: every row has exactly four nonzero
+# entries. It's handed to scipy's least_squares as a sparse matrix and
+# solved with LSMR, so the cost grows with the number of data points
+# rather than with (number of galaxies)^2.
+#
+# alpha here is the "old" alpha that Model.ipynb writes out
+# (Neros' fit parameter squared), so the law is Neros alpha = sqrt(A*(L/R)^k)
+
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.sparse import csr_matrix
+
+import Neros
+
+
+class JointProblem:
+    """A catalog prepared for the joint fit
+
+    The parameters are [log(A), k, disk_scale_0, bulge_scale_0, disk_scale_1, ...]
+    with galaxies in the order of the problems passed in.
+
+    Parameters:
+    :problems: List of Neros.FitProblem, one per galaxy
+    :ratios: L/Reff of each galaxy, in the same order"""
+
+    def __init__(self, problems, ratios):
+        self.problems = problems
+        self.log_ratios = np.log(np.asarray(ratios, dtype=float))
+
+        lengths = [len(p.rad) for p in problems]
+        self.row_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+        self.vObs = np.concatenate([p.vObs for p in problems])
+        self.vObsError = np.concatenate([p.vObsError for p in problems])
+
+        # Sparsity structure: row j of galaxy i uses columns 0, 1, 2+2i, 3+2i
+        nrows = self.row_offsets[-1]
+        galaxy_of_row = np.repeat(np.arange(len(problems)), lengths)
+        self._indices = np.column_stack([np.zeros(nrows, dtype=int), np.ones(nrows, dtype=int),
+                                         2 + 2*galaxy_of_row, 3 + 2*galaxy_of_row]).ravel()
+        self._indptr = np.arange(0, 4*nrows + 1, 4)
+        self.shape = (nrows, 2 + 2*len(problems))
+
+
+    def alphas(self, params):
+        """Neros alpha for every galaxy, sqrt(A*(L/R)^k)"""
+        return np.exp(0.5*(params[0] + params[1]*self.log_ratios))
+
+
+    def model(self, params):
+        alphas = self.alphas(params)
+        return np.concatenate([p.vNeros(alpha, params[2 + 2*i], params[3 + 2*i])
+                               for i, (p, alpha) in enumerate(zip(self.problems, alphas))])
+
+
+    def residuals(self, params):
+        return (self.model(params) - self.vObs) / self.vObsError
+
+
+    def jacobian(self, params):
+        """The Jacobian of residuals, as a sparse CSR matrix"""
+
+        alphas = self.alphas(params)
+        data = np.empty((self.shape[0], 4))
+        for i, (p, alpha) in enumerate(zip(self.problems, alphas)):
+            rows = slice(self.row_offsets[i], self.row_offsets[i + 1])
+            jac = p.jacobian(alpha, params[2 + 2*i], params[3 + 2*i])
+            # d(alpha)/d(log A) = alpha/2, d(alpha)/d(k) = alpha*log(L/R)/2
+            data[rows, 0] = jac[:, 0] * (0.5*alpha)
+            data[rows, 1] = jac[:, 0] * (0.5*alpha*self.log_ratios[i])
+            data[rows, 2:] = jac[:, 1:]
+        data /= self.vObsError[:, np.newaxis]
+        return csr_matrix((data.ravel(), self._indices, self._indptr), shape=self.shape)
+
+
+def fit_joint(catalog, milky_way_data, luminosity_ratios, A=1.0, k=0.0, max_nfev=None):
+    """Fits alpha = A*(L/R)^k, plus disk and bulge scales, to a whole catalog at once
+
+    Parameters:
+    :catalog: Dictionary of galaxy name -> galaxy data, as for Neros.fit_catalog
+    :milky_way_data: Milky Way data, in any form accepted by Neros
+    :luminosity_ratios: Dictionary of galaxy name -> L/Reff, e.g. from
+                        DataReader.readLuminosityRatios("data/L_Reff_ratio.txt").
+                        Galaxies without one are left out of the fit, as are
+                        galaxies whose L/R isn't positive or that have 3 or
+                        fewer points in the range of the Milky Way data
+    :A: Starting value for A
+    :k: Starting value for k
+    :max_nfev: Maximum number of function evaluations, passed to least_squares
+
+    Returns a dictionary with
+    :A:, :k: The fit values
+    :chi_squared: Reduced chi^2 of the whole fit
+    :galaxies: DataFrame of Galaxy, L/R, alpha (=A*(L/R)^k), disk_scale,
+               bulge_scale and chi_squared (per galaxy, as in Neros.chiSquared)
+    :missing: Galaxies left out because they had no L/R
+    :skipped: Dictionary of galaxy name -> reason for the other galaxies left out
+    :success:, :message:, :nfev: From least_squares"""
+
+    import pandas as pd
+
+    neros = Neros.Neros(milky_way_data)
+
+    # Galaxies that Neros.fit_catalog would give an error row are left out
+    # here, as one of them would stop the whole fit
+    names, problems, ratios, missing, skipped = [], [], [], [], {}
+    for name, galaxy in catalog.items():
+        if name not in luminosity_ratios:
+            missing.append(name)
+            continue
+        ratio = luminosity_ratios[name]
+        if not ratio > 0:
+            skipped[name] = f"L/R is {ratio}, it must be positive"
+            continue
+        try:
+            problem = neros.prepare(*Neros.galaxy_columns(galaxy))
+        except Exception as e:
+            skipped[name] = f"{type(e).__name__}: {e}"
+            continue
+        if len(problem.rad) <= 3:
+            skipped[name] = (f"{len(problem.rad)} points in the range of the Milky Way data, "
+                             f"at least 4 are needed")
+            continue
+        names.append(name)
+        problems.append(problem)
+        ratios.append(ratio)
+
+    if not problems:
+        raise ValueError(f"None of the galaxies can be fit: {len(missing)} have no L/R "
+                         f"and {len(skipped)} were skipped")
+
+    joint = JointProblem(problems, ratios)
+    x0 = np.concatenate([[np.log(A), k], np.ones(2*len(problems))])
+    result = least_squares(joint.residuals, x0, jac=joint.jacobian, method='trf',
+                           tr_solver='lsmr', x_scale='jac', max_nfev=max_nfev)
+
+    params = result.x
+    residuals = result.fun
+    galaxy_chi_squared = [np.sum(residuals[joint.row_offsets[i]:joint.row_offsets[i + 1]]**2)
+                          / (len(p.rad) - 3) for i, p in enumerate(problems)]
+    galaxies = pd.DataFrame({
+        'Galaxy': names,
+        'L/R': ratios,
+        'alpha': joint.alphas(params)**2,
+        'disk_scale': np.abs(params[2::2]),
+        'bulge_scale': np.abs(params[3::2]),
+        'chi_squared': galaxy_chi_squared,
+    })
+
+    return {
+        'A': float(np.exp(params[0])),
+        'k': float(params[1]),
+        'chi_squared': float(np.sum(residuals**2) / (len(residuals) - len(params))),
+        'galaxies': galaxies,
+        'missing': missing,
+        'skipped': skipped,
+        'success': result.success,
+        'message': result.message,
+        'nfev': result.nfev,
+    }
@@ -0,0 +1,188 @@
+# Comparing forms of v1 and v2
+# Neros.V1_KERNELS and Neros.V2_KERNELS hold the forms of v1 (sinh,
+# 1-sinh, cosh, sech) and v2 (COSH:NN) that used to be picked by
+# uncommenting lines in Neros.py. A KernelComparison fits a catalog
+# under several (v1, v2) pairs in one run:
+#
+#   table = KernelComparison.compare_kernels(galaxies, MWXueSofue, workers=16)
+#
+# gives the reduced chi^2 of every galaxy (columns) under every pair (rows).
+#
+# Everything that doesn't depend on the kernel is only done once per
+# galaxy: reading its columns, interpolating the Milky Way phi and the
+# partial galaxy potentials (the FitProblem), and when evaluating the
+# model, kappa, eTsiCurve - 1 and eTsiFlat - 1. Only the fits themselves
+# are run once per pair.
+
+import itertools
+
+import numpy as np
+
+import Neros
+
+
+def kernelName(v1, v2):
+    """Name of a (v1, v2) pair, as used in the tables"""
+    return f"{v1}/{v2}"
+
+
+def allKernels():
+    """Every (v1, v2) pair in the registries, v1 varying fastest"""
+    return [(v1, v2) for v2, v1 in itertools.product(Neros.V2_KERNELS, Neros.V1_KERNELS)]
+
+
+class KernelComparison:
+    """One Milky Way model, with several forms of v1 and v2
+
+    Create one with
+    KernelComparison(milky_way_data, [('sinh', 'cosh_nn'), ('cosh', 'cosh_nn'), ...])
+    or leave out the pairs for every one in the registries (allKernels).
+
+    vLCM and vNeros return one row per pair. For fitting, a galaxy is
+    prepared once and the FitProblem is shared by every pair."""
+
+    def __init__(self, milky_way_data, kernels=None):
+        if kernels is None:
+            kernels = allKernels()
+        self.kernels = [tuple(x) for x in kernels]
+        if not self.kernels:
+            raise ValueError("No kernels to compare")
+        self.names = [kernelName(*x) for x in self.kernels]
+        # The Milky Way phi table is only computed for the first of these,
+        # see Neros.setMilkyWay
+        self.models = [Neros.Neros(milky_way_data, v1=v1, v2=v2) for v1, v2 in self.kernels]
+
+
+    def __len__(self):
+        return len(self.models)
+
+
+    def vLCM(self, galaxy_rad, galaxy_vLum):
+        """vLCM under every pair, pairs x radii"""
+
+        neros = self.models[0]
+        MW_phi = neros.mw_phi_interp(galaxy_rad)
+        galaxy_phi = neros.phi(galaxy_rad, galaxy_vLum)
+        return self.vLCM_from_phi(MW_phi, galaxy_phi, galaxy_vLum, MW_phi[-1])
+
+
+    def vLCM_from_phi(self, MW_phi, galaxy_phi, galaxy_vLum, phi_zero):
+        """vLCM under every pair given the potentials, parameters are as for Neros.vLCM_from_phi"""
+
+        neros = self.models[0]
+        k = neros.kappa(MW_phi, galaxy_phi, phi_zero)
+        etCurve = neros._eTsiCurveMinusOne(MW_phi, galaxy_phi, phi_zero)
+        etFlat = neros._eTsiFlatMinusOne(galaxy_vLum)
+
+        scale = Neros.c * Neros.c * k * k
+        v1s = {}
+        v2s = {}
+        vLCM = np.empty((len(self.models), len(scale)))
+        for row, model in zip(vLCM, self.models):
+            if model.v1_kernel not in v1s:
+                v1s[model.v1_kernel] = model._v1_fn(etCurve)
+            if model.v2_kernel not in v2s:
+                v2s[model.v2_kernel] = model._v2_fn(etFlat, etCurve)
+            np.multiply(scale * v1s[model.v1_kernel], v2s[model.v2_kernel], out=row)
+        return vLCM
+
+
+    def vNeros(self, galaxy_rad, galaxy_vLum, alpha):
+        """vNeros under every pair, pairs x radii
+
+        alpha can be a single value, or one per pair"""
+
+        alpha = np.asarray(alpha, dtype=float)
+        if alpha.ndim == 1:
+            alpha = alpha[:, np.newaxis]
+        vLCM = self.vLCM(galaxy_rad, galaxy_vLum)
+        return np.sqrt(galaxy_vLum**2 + (alpha**2)*vLCM)
+
+
+    def prepare(self, rad, vGas, vDisk, vBulge, vObs, vObsError):
+        """One FitProblem per pair, sharing the Milky Way phi and galaxy potentials"""
+
+        first = self.models[0].prepare(rad, vGas, vDisk, vBulge, vObs, vObsError)
+        problems = [first]
+        partial_phis = (first.phi_gas, first.phi_disk, first.phi_bulge)
+        for model in self.models[1:]:
+            # The data is already trimmed, so this only copies references
+            problems.append(Neros.FitProblem(model, first.rad, first.vGas, first.vDisk,
+                                             first.vBulge, first.vObs, first.vObsError,
+                                             partial_phis=partial_phis, mw_phi=first.mw_phi))
+        return problems
+
+
+    def fit(self, rad, vGas, vDisk, vBulge, vObs, vObsError):
+        """Fits a galaxy under every pair
+
+        Returns a list with the results for each pair, as from
+        Neros.get_fit_results plus fit_info, or the exception if the fit failed"""
+
+        results = []
+        for model, problem in zip(self.models, self.prepare(rad, vGas, vDisk, vBulge, vObs, vObsError)):
+            try:
+                model.fit_problem(problem)
+                results.append(dict(model.get_fit_results(rad), **model.fit_info))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+    def fit_catalog(self, catalog, workers=None, chunksize=None):
+        """Fits every galaxy in a catalog under every pair
+
+        Parameters are the same as for Neros.fit_catalog. Returns a Pandas
+        DataFrame with 'Kernel', 'v1' and 'v2' columns in front of the usual
+        columns, one row per galaxy per pair."""
+
+        import pandas as pd
+
+        rows = Neros._fit_items(self, list(catalog.items()), workers, chunksize, fit_galaxy_kernels)
+        return pd.DataFrame([row for galaxy_rows in rows for row in galaxy_rows],
+                            columns=['Kernel', 'v1', 'v2'] + Neros.FIT_RESULT_COLUMNS)
+
+
+def fit_galaxy_kernels(comparison, galaxy_name, galaxy):
+    """Fits a single galaxy under every pair in a KernelComparison
+
+    Returns one row per pair, like Neros.fit_galaxy with added 'Kernel', 'v1' and 'v2'"""
+
+    rows = []
+    try:
+        results = comparison.fit(*Neros.galaxy_columns(galaxy))
+    except Exception as e:
+        results = [e] * len(comparison)
+
+    for name, (v1, v2), result in zip(comparison.names, comparison.kernels, results):
+        row = dict.fromkeys(Neros.FIT_RESULT_COLUMNS, np.nan)
+        row.update(Kernel=name, v1=v1, v2=v2, Galaxy=galaxy_name, error=None)
+        if isinstance(result, Exception):
+            row['error'] = f"{type(result).__name__}: {result}"
+        else:
+            row.update(result)
+        rows.append(row)
+    return rows
+
+
+def chiSquaredTable(results):
+    """Reduced chi^2 as a pairs x galaxies table, from KernelComparison.fit_catalog
+
+    Failed fits are NaN. Rows and columns keep the order of the results"""
+
+    table = results.pivot(index='Kernel', columns='Galaxy', values='chi_squared')
+    return table.loc[results['Kernel'].unique(), results['Galaxy'].unique()]
+
+
+def compare_kernels(catalog, milky_way_data, kernels=None, workers=None, chunksize=None):
+    """Fits a catalog under several forms of v1 and v2, in one run
+
+    Parameters:
+    :catalog:, :milky_way_data:, :workers:, :chunksize: As for Neros.fit_catalog
+    :kernels: List of (v1, v2) name pairs, by default every pair (allKernels)
+
+    Returns the reduced chi^2 as a Pandas DataFrame with a row per pair
+    (named "v1/v2") and a column per galaxy. For everything else about
+    the fits, use KernelComparison(...).fit_catalog"""
+
+    return chiSquaredTable(KernelComparison(milky_way_data, kernels).fit_catalog(catalog, workers, chunksize))
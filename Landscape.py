@@ -0,0 +1,129 @@
+# Chi^2 landscapes
+# Evaluates the reduced chi^2 of a galaxy over a whole grid of
+# (alpha, disk_scale, bulge_scale), for spotting degeneracies and
+# checking that Neros.fit found the right minimum.
+#
+# The grid is worked through in chunks of (disk_scale, bulge_scale)
+# pairs. Everything expensive (the galaxy phi, vLCM) only depends on
+# the pair, so each chunk computes vLCM once and then broadcasts over
+# every alpha. Chunks are sized to stay under a memory budget (when
+# there are too many alphas for even one pair, a chunk goes through its
+# alphas a slice at a time), and can be spread over worker processes.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Roughly how many float64 values a chunk may use for its temporaries
+DEFAULT_CHUNK_ELEMENTS = 4 * 10**6
+
+_worker_problem = None
+
+
+def chiSquaredLandscape(problem, alphas, disk_scales, bulge_scales, n_best=10,
+                        workers=1, chunk_elements=DEFAULT_CHUNK_ELEMENTS, dtype=np.float32):
+    """Reduced chi^2 of a galaxy over a 3-D parameter grid
+
+    Parameters:
+    :problem: A Neros.FitProblem, from Neros.prepare
+    :alphas: 1-D array of alpha values (Neros' alpha, not the squared one)
+    :disk_scales: 1-D array of disk_scale values
+    :bulge_scales: 1-D array of bulge_scale values
+    :n_best: How many of the lowest grid points to return
+    :workers: Number of worker processes, None for the number of CPUs
+    :chunk_elements: Memory budget for one chunk, in values
+    :dtype: dtype of the returned chi^2 array
+
+    Returns a dictionary with
+    :chi_squared: Array of shape (len(alphas), len(disk_scales), len(bulge_scales)),
+                  NaN where vNeros^2 went negative
+    :alphas:, :disk_scales:, :bulge_scales: The grid
+    :best: List of the n_best lowest points, each a dictionary of
+           chi_squared, alpha, disk_scale, bulge_scale, lowest first"""
+
+    alphas = np.asarray(alphas, dtype=float)
+    disk_scales = np.asarray(disk_scales, dtype=float)
+    bulge_scales = np.asarray(bulge_scales, dtype=float)
+
+    disk_grid, bulge_grid = np.meshgrid(disk_scales, bulge_scales, indexing='ij')
+    pairs = np.column_stack([disk_grid.ravel(), bulge_grid.ravel()])
+
+    # Each pair needs a few arrays of galaxy length, plus one per alpha
+    n_rad = max(1, len(problem.rad))
+    pair_chunk = max(1, chunk_elements // (n_rad * (len(alphas) + 8)))
+    alpha_chunk = max(1, min(len(alphas), chunk_elements // (n_rad * pair_chunk) - 8))
+    chunks = [(pairs[i:i + pair_chunk], alphas, alpha_chunk) for i in range(0, len(pairs), pair_chunk)]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(chunks)))
+
+    if workers == 1:
+        blocks = [_chunk_chi_squared(problem, *chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(problem,)) as executor:
+            blocks = list(executor.map(_chunk_worker, chunks))
+
+    # Blocks are alpha x pairs, put them back together as alpha x disk x bulge
+    chi_squared = np.concatenate(blocks, axis=1).astype(dtype, copy=False)
+    chi_squared = chi_squared.reshape(len(alphas), len(disk_scales), len(bulge_scales))
+
+    return {
+        'chi_squared': chi_squared,
+        'alphas': alphas,
+        'disk_scales': disk_scales,
+        'bulge_scales': bulge_scales,
+        'best': bestPoints(chi_squared, alphas, disk_scales, bulge_scales, n_best),
+    }
+
+
+def bestPoints(chi_squared, alphas, disk_scales, bulge_scales, n_best=10):
+    """The n_best lowest points of a landscape, lowest first, ignoring NaN"""
+
+    flat = np.where(np.isnan(chi_squared), np.inf, chi_squared).ravel()
+    n_best = min(n_best, np.isfinite(flat).sum())
+    if n_best == 0:
+        return []
+    lowest = np.argpartition(flat, n_best - 1)[:n_best]
+    lowest = lowest[np.argsort(flat[lowest])]
+
+    a, d, b = np.unravel_index(lowest, chi_squared.shape)
+    return [{'chi_squared': float(flat[i]), 'alpha': float(alphas[ia]),
+             'disk_scale': float(disk_scales[id_]), 'bulge_scale': float(bulge_scales[ib])}
+            for i, ia, id_, ib in zip(lowest, a, d, b)]
+
+
+def _chunk_chi_squared(problem, pairs, alphas, alpha_chunk=None):
+    """Reduced chi^2 for every alpha and every (disk_scale, bulge_scale) pair, alpha x pairs
+
+    The alphas are done alpha_chunk at a time (default: all at once)"""
+
+    disk_scale = pairs[:, 0:1]
+    bulge_scale = pairs[:, 1:2]
+
+    # pairs x radii
+    vLum_squared = problem.vLumSquared(disk_scale, bulge_scale)
+    galaxy_phi = problem.galaxy_phi(disk_scale, bulge_scale)
+    vLCM = problem.neros.vLCM_from_phi(problem.mw_phi, galaxy_phi, np.sqrt(vLum_squared), problem.phi_zero)
+
+    if alpha_chunk is None:
+        alpha_chunk = max(1, len(alphas))
+    chi_squared = np.empty((len(alphas), len(pairs)))
+    for i in range(0, len(alphas), alpha_chunk):
+        # alpha x pairs x radii
+        with np.errstate(invalid='ignore'):
+            vNeros = np.sqrt(vLum_squared + (alphas[i:i + alpha_chunk, np.newaxis, np.newaxis]**2) * vLCM)
+        residuals = (vNeros - problem.vObs) / problem.vObsError
+        chi_squared[i:i + alpha_chunk] = np.einsum('apr,apr->ap', residuals, residuals)
+    return chi_squared / (len(problem.rad) - 3)
+
+
+def _init_worker(problem):
+    global _worker_problem
+    _worker_problem = problem
+
+
+def _chunk_worker(chunk):
+    return _chunk_chi_squared(_worker_problem, *chunk)
@@ -0,0 +1,174 @@
+# Multi-start fitting
+# Neros.fit always starts curve_fit from alpha=0.01, disk_scale=1,
+# bulge_scale=1. Some galaxies have more than one minimum, or a
+# minimum that's hard to reach from there, and end up with a poor
+# fit or no fit at all.
+#
+# fit_multistart first evaluates chi^2 on a coarse grid with
+# Landscape.chiSquaredLandscape, which is cheap since it's one
+# broadcast evaluation, and starts local fits from the lowest grid
+# points as well as from the usual starting point. Starts are run in
+# order, optionally over worker processes, and the remaining ones are
+# dropped as soon as enough of them agree on the best minimum.
+
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+import Landscape
+
+# The usual starting point, always tried first
+DEFAULT_START = (0.01, 1.0, 1.0)
+
+_worker_problem = None
+
+
+def defaultGrid(problem):
+    """A coarse (alphas, disk_scales, bulge_scales) grid covering the usual fit values
+
+    Galaxies without a bulge only get one bulge_scale, since it has no effect.
+    alpha = 0 is on the grid for the chi^2 there, but isn't used as a start
+    (see startingPoints)"""
+
+    alphas = np.concatenate([[0.0], np.geomspace(0.05, 200, 16)])
+    disk_scales = np.linspace(0.1, 3.0, 8)
+    if np.any(problem.vBulge != 0):
+        bulge_scales = np.linspace(0.1, 3.0, 6)
+    else:
+        bulge_scales = np.array([1.0])
+    return alphas, disk_scales, bulge_scales
+
+
+def startingPoints(problem, n_starts=8, grid=None):
+    """DEFAULT_START followed by the lowest points of a coarse chi^2 grid
+
+    Parameters:
+    :problem: A Neros.FitProblem, from Neros.prepare
+    :n_starts: Total number of starting points
+    :grid: Optional (alphas, disk_scales, bulge_scales), defaults to defaultGrid
+
+    Grid points with alpha = 0 are skipped: alpha only enters as alpha^2,
+    so the Jacobian has no alpha column there and a fit can't move alpha"""
+
+    if grid is None:
+        grid = defaultGrid(problem)
+    # Enough points to still have n_starts after leaving out the alpha = 0 ones
+    n_best = n_starts + len(grid[1]) * len(grid[2])
+    landscape = Landscape.chiSquaredLandscape(problem, *grid, n_best=n_best)
+
+    starts = [DEFAULT_START]
+    for point in landscape['best']:
+        start = (point['alpha'], point['disk_scale'], point['bulge_scale'])
+        if start[0] != 0 and start not in starts:
+            starts.append(start)
+    return starts[:n_starts]
+
+
+def fit_multistart(problem, n_starts=8, agree=3, rtol=1e-4, workers=1, grid=None):
+    """Fits a galaxy from several starting points and keeps the best fit
+
+    Parameters:
+    :problem: A Neros.FitProblem, from Neros.prepare
+    :n_starts: Maximum number of starting points, see startingPoints
+    :agree: Stop once this many fits have reached the best chi^2 found so far
+    :rtol: Relative tolerance for fits to count as reaching the same chi^2
+    :workers: Number of worker processes, None for the number of CPUs
+    :grid: Optional (alphas, disk_scales, bulge_scales) grid to seed the starts from
+
+    Returns a dictionary with
+    :fit_vals:, :cov: The best fit, as from FitProblem.fit
+    :chi_squared: Its reduced chi^2
+    :n_run: How many starts were run
+    :n_agree: How many of them reached the best chi^2
+    :starts: One dictionary per start that was run, in order, with
+             p0 and either fit_vals, chi_squared and nfev, or error
+
+    If every start fails the error from the last one is raised"""
+
+    starts = startingPoints(problem, n_starts, grid)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(starts)))
+
+    results = [None] * len(starts)
+    if workers == 1:
+        for i, p0 in enumerate(starts):
+            results[i] = _fit_start(problem, p0)
+            if _agreeing(results, rtol) >= agree:
+                break
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(problem,)) as executor:
+            pending = {executor.submit(_start_worker, p0): i for i, p0 in enumerate(starts)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+                if _agreeing(results, rtol) >= agree:
+                    for future in pending:
+                        future.cancel()
+                    break
+
+    run = [(p0, result) for p0, result in zip(starts, results) if result is not None]
+    fits = [result for _, result in run if 'error' not in result]
+    if not fits:
+        raise run[-1][1]['exception']
+
+    best = min(fits, key=lambda x: x['chi_squared'])
+    return {
+        'fit_vals': best['fit_vals'],
+        'cov': best['cov'],
+        'chi_squared': best['chi_squared'],
+        'n_run': len(run),
+        'n_agree': _agreeing(results, rtol),
+        'starts': [_summary(p0, result) for p0, result in run],
+    }
+
+
+def _fit_start(problem, p0):
+    try:
+        fit_vals, cov, infodict, _, _ = problem.fit(p0=p0, full_output=True)
+    except (RuntimeError, ValueError, np.linalg.LinAlgError) as e:
+        # curve_fit raises ValueError on NaN or infinite residuals, which a
+        # bad start can reach, and the covariance can fail to invert
+        return {'error': str(e), 'exception': e}
+    chi_squared = float(problem.chi_squared(*fit_vals))
+    if not np.isfinite(chi_squared):
+        e = RuntimeError("Fit ended where vNeros^2 is negative")
+        return {'error': str(e), 'exception': e}
+    return {'fit_vals': fit_vals, 'cov': cov, 'chi_squared': chi_squared, 'nfev': int(infodict['nfev'])}
+
+
+def _agreeing(results, rtol):
+    """How many finished fits are within rtol of the lowest chi^2"""
+
+    chi_squared = np.array([x['chi_squared'] for x in results if x is not None and 'error' not in x])
+    if len(chi_squared) == 0:
+        return 0
+    return int(np.sum(chi_squared <= chi_squared.min() * (1 + rtol)))
+
+
+def _summary(p0, result):
+    summary = {'p0': tuple(float(x) for x in p0)}
+    if 'error' in result:
+        summary['error'] = result['error']
+    else:
+        summary['fit_vals'] = result['fit_vals']
+        summary['chi_squared'] = result['chi_squared']
+        summary['nfev'] = result['nfev']
+    return summary
+
+
+def _init_worker(problem):
+    global _worker_problem
+    _worker_problem = problem
+
+
+def _start_worker(p0):
+    result = _fit_start(_worker_problem, p0)
+    # Exceptions don't always survive being sent back from a worker
+    if 'exception' in result:
+        result['exception'] = type(result['exception'])(result['error'])
+    return result
@@ -10,14 +10,227 @@
 
 # Formerly named Neros_v4_test.py
 
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import numpy as np
-from scipy.interpolate import interp1d
-import scipy.integrate
-from scipy.optimize import curve_fit
+# SciPy is imported where it's used, importing it takes longer than most
+# command line tasks (see rcfm.py) and fitting is the only thing that needs it
 
 
 c = 3 * (10**5) # km/s
 
+# Change this whenever a change to the model or the fit changes the fit results,
+# so that results cached by FitCache.py are recomputed
+MODEL_VERSION = 1
+
+# Milky Way phi tables already computed in this process, see Neros.setMilkyWay
+_milky_way_tables = {}
+MAX_MILKY_WAY_TABLES = 32
+
+# PhiOperators already built in this process, see phiOperator
+_phi_operators = {}
+MAX_PHI_OPERATORS = 1024
+
+# Rules for integrating phi, see PhiOperator
+INTEGRATION_RULES = ['trapezoid', 'simpson']
+
+
+# Forms of v1 and v2, which used to be picked by uncommenting lines in
+# Neros.v1 and Neros.v2. Each Neros uses one of each, by name (see
+# Neros.setKernels), and KernelComparison.py fits a catalog under several.
+# v1 kernels are (v1(etc), d(v1)/d(etc)) with etc = eTsiCurve - 1,
+# v2 kernels are (v2(etFlat, etCurve), (d(v2)/d(etFlat), d(v2)/d(etCurve))).
+# The values are written in terms of eTsi - 1 for numerical stability,
+# see NumericalStability.ipynb
+
+def _v1_sinh(etc):
+    num = (etc+1)**2 - 1
+    den = 2*(1 + etc)
+    return num/den
+
+
+def _dv1_sinh(etc):
+    # v1 = (e - 1/e)/2 with e = etc + 1
+    e = etc + 1
+    return (1 + 1/(e*e)) / 2
+
+
+def _v1_one_minus_sinh(etc):
+    return 1 - _v1_sinh(etc)
+
+
+def _dv1_one_minus_sinh(etc):
+    return -_dv1_sinh(etc)
+
+
+def _v1_cosh(etc):
+    num = (etc+1)**2 + 1
+    den = 2*(1 + etc)
+    return num/den
+
+
+def _dv1_cosh(etc):
+    # v1 = (e + 1/e)/2 with e = etc + 1
+    e = etc + 1
+    return (1 - 1/(e*e)) / 2
+
+
+def _v1_sech(etc):
+    num = 2*(1 + etc)
+    den = (etc+1)**2 + 1
+    return num/den
+
+
+def _dv1_sech(etc):
+    # v1 = 2e/(e^2 + 1) with e = etc + 1
+    e = etc + 1
+    e_squared = e*e
+    return 2*(1 - e_squared) / (e_squared + 1)**2
+
+
+def _v2_cosh_nn(etFlat, etCurve):
+    # version 1 (e^2z = e^c * e^f)
+    num = (etFlat +1)*(etCurve+1)  +1
+    den = 2*np.sqrt((etFlat + 1)*(etCurve +1))
+    return num/den
+
+
+def _dv2_cosh_nn(etFlat, etCurve):
+    # v2 = (w + 1) / (2*sqrt(w)), with w = (etFlat + 1)*(etCurve + 1)
+    w = (etFlat + 1) * (etCurve + 1)
+    dv2_dw = (1 - 1/w) / (4*np.sqrt(w))
+    return dv2_dw * (etCurve + 1), dv2_dw * (etFlat + 1)
+
+
+V1_KERNELS = {
+    'sinh': (_v1_sinh, _dv1_sinh),
+    '1-sinh': (_v1_one_minus_sinh, _dv1_one_minus_sinh),
+    'cosh': (_v1_cosh, _dv1_cosh),
+    'sech': (_v1_sech, _dv1_sech),
+}
+V2_KERNELS = {
+    'cosh_nn': (_v2_cosh_nn, _dv2_cosh_nn),
+}
+DEFAULT_V1 = 'sinh'
+DEFAULT_V2 = 'cosh_nn'
+
+
+# The same kernels, writing into arrays they're given instead of making
+# new ones, for FitWorkspace. They do exactly the same operations in the
+# same order as the kernels above, so the results are identical.
+# v1: (value(etc, etc1, out, scratch), derivative(etc, etc1, out, scratch)),
+#     with etc1 = etc + 1
+# v2: (value(etFlat1, etc1, out, state), derivative(etFlat1, etc1, out_flat, out_curve, state)),
+#     where state is three arrays, which the derivative takes as the value left them
+# Kernels without one are evaluated with the functions above instead.
+# tests/test_FitWorkspace.py checks that every kernel in V1_KERNELS and
+# V2_KERNELS has one here, giving the same values bit for bit.
+# Constants are 0-d arrays, NumPy takes those much faster than Python
+# numbers, which matters for arrays this small.
+
+def _constant(value):
+    array = np.array(value, dtype=np.float64)
+    array.flags.writeable = False
+    return array
+
+
+_ZERO = _constant(0)
+_ONE = _constant(1)
+_MINUS_ONE = _constant(-1)
+_TWO = _constant(2)
+_FOUR = _constant(4)
+_C = _constant(c)
+_C_SQUARED = _constant(c * c)
+
+
+def _v1_sinh_into(etc, etc1, out, scratch):
+    np.square(etc1, out)
+    np.subtract(out, _ONE, out)
+    np.multiply(_TWO, etc1, scratch)
+    np.divide(out, scratch, out)
+
+
+def _dv1_sinh_into(etc, etc1, out, scratch):
+    np.multiply(etc1, etc1, out)
+    np.divide(_ONE, out, out)
+    np.add(out, _ONE, out)
+    np.divide(out, _TWO, out)
+
+
+def _v1_one_minus_sinh_into(etc, etc1, out, scratch):
+    _v1_sinh_into(etc, etc1, out, scratch)
+    np.subtract(_ONE, out, out)
+
+
+def _dv1_one_minus_sinh_into(etc, etc1, out, scratch):
+    _dv1_sinh_into(etc, etc1, out, scratch)
+    np.negative(out, out)
+
+
+def _v1_cosh_into(etc, etc1, out, scratch):
+    np.square(etc1, out)
+    np.add(out, _ONE, out)
+    np.multiply(_TWO, etc1, scratch)
+    np.divide(out, scratch, out)
+
+
+def _dv1_cosh_into(etc, etc1, out, scratch):
+    np.multiply(etc1, etc1, out)
+    np.divide(_ONE, out, out)
+    np.subtract(_ONE, out, out)
+    np.divide(out, _TWO, out)
+
+
+def _v1_sech_into(etc, etc1, out, scratch):
+    np.square(etc1, scratch)
+    np.add(scratch, _ONE, scratch)
+    np.multiply(_TWO, etc1, out)
+    np.divide(out, scratch, out)
+
+
+def _dv1_sech_into(etc, etc1, out, scratch):
+    np.multiply(etc1, etc1, scratch)
+    np.subtract(_ONE, scratch, out)
+    np.multiply(_TWO, out, out)
+    np.add(scratch, _ONE, scratch)
+    np.square(scratch, scratch)
+    np.divide(out, scratch, out)
+
+
+def _v2_cosh_nn_into(etFlat1, etc1, out, state):
+    w, sqrt_w, scratch = state
+    np.multiply(etFlat1, etc1, w)
+    np.sqrt(w, sqrt_w)
+    np.add(w, _ONE, out)
+    np.multiply(_TWO, sqrt_w, scratch)
+    np.divide(out, scratch, out)
+
+
+def _dv2_cosh_nn_into(etFlat1, etc1, out_flat, out_curve, state):
+    w, sqrt_w, scratch = state
+    np.divide(_ONE, w, out_flat)
+    np.subtract(_ONE, out_flat, out_flat)
+    np.multiply(_FOUR, sqrt_w, scratch)
+    np.divide(out_flat, scratch, scratch)
+    np.multiply(scratch, etFlat1, out_curve)
+    np.multiply(scratch, etc1, out_flat)
+
+
+V1_KERNELS_INTO = {
+    'sinh': (_v1_sinh_into, _dv1_sinh_into),
+    '1-sinh': (_v1_one_minus_sinh_into, _dv1_one_minus_sinh_into),
+    'cosh': (_v1_cosh_into, _dv1_cosh_into),
+    'sech': (_v1_sech_into, _dv1_sech_into),
+}
+V2_KERNELS_INTO = {
+    'cosh_nn': (_v2_cosh_nn_into, _dv2_cosh_nn_into),
+}
+
+
 class Neros:
     """The Neros Model
     
@@ -25,7 +238,8 @@ class Neros:
     the Neros model. Since the model depends on the Milky Way
     mass curve, each instance of this class will need to be 
     supplied with one.  Meaning that if you want to do multiple
-    Milky Way models, each will need its own instance.
+    Milky Way models, each will need its own instance
+    (or see MilkyWayEnsemble, for evaluating several at once).
     
     Create an instance by calling
     Neros(milky_way_data)
@@ -37,13 +251,46 @@ class Neros:
     radius, vLum (it ignores Pandas column names).
     
     The Milky Way data can be changed later by calling setMilkyWay
+    
+    v1 and v2 pick the forms of v1 and v2 used, by name from V1_KERNELS
+    and V2_KERNELS (sinh and COSH:NN by default). They can be changed
+    later by calling setKernels
+    
+    integration is the rule phi is integrated with, 'trapezoid' (the
+    default) or 'simpson', for the Milky Way and the galaxies alike
+    
+    To see where the time goes in fits, pass in a Trace.Tracer as
+    tracer (or set neros.tracer), and every fit will be recorded in it
     """
     
-    def __init__(self, milky_way_data):
+    def __init__(self, milky_way_data, tracer=None, v1=DEFAULT_V1, v2=DEFAULT_V2,
+                 integration='trapezoid'):
+        if integration not in INTEGRATION_RULES:
+            raise ValueError(f"Unknown integration rule {integration!r}, "
+                             f"should be one of {', '.join(INTEGRATION_RULES)}")
+        self.integration = integration
         #This will check if the Milky Way data
         #is properly formatted, and raise an exception
         #if it isn't
         self.setMilkyWay(milky_way_data)
+        self.setKernels(v1, v2)
+        self.tracer = tracer
+
+
+    def setKernels(self, v1=DEFAULT_V1, v2=DEFAULT_V2):
+        """Changes the forms of v1 and v2, by name from V1_KERNELS and V2_KERNELS"""
+        
+        if v1 not in V1_KERNELS:
+            raise ValueError(f"Unknown v1 kernel {v1!r}, should be one of {', '.join(V1_KERNELS)}")
+        if v2 not in V2_KERNELS:
+            raise ValueError(f"Unknown v2 kernel {v2!r}, should be one of {', '.join(V2_KERNELS)}")
+        self.v1_kernel = v1
+        self.v2_kernel = v2
+        self._v1_fn, self._dv1_fn = V1_KERNELS[v1]
+        self._v2_fn, self._dv2_fn = V2_KERNELS[v2]
+        # In place forms for FitWorkspace, None if there isn't one
+        self._v1_into = V1_KERNELS_INTO.get(v1)
+        self._v2_into = V2_KERNELS_INTO.get(v2)
 
 
     def setMilkyWay(self, milky_way_data):
@@ -64,9 +311,29 @@ class Neros:
         self.milky_way_data = data
         self.mw_rad = data[:,0]
         self.mw_vLum = data[:,1]
-        self.mw_vLum_interp = interp1d(data[:,0], data[:,1], kind='cubic')
-        self.mw_phi = self.phi(data[:,0], data[:,1])
-        self.mw_phi_interp = interp1d(data[:,0], self.mw_phi)
+        self._mw_vLum_interp = None
+        
+        # The same Milky Way is often set up many times in one process
+        # (once per worker, per ensemble, per notebook cell), so the phi
+        # table is only computed the first time
+        key = hashlib.sha1(str((data.dtype.str, data.shape, self.integration)).encode('utf-8')
+                           + data.tobytes()).digest()
+        if key not in _milky_way_tables:
+            if len(_milky_way_tables) >= MAX_MILKY_WAY_TABLES:
+                _milky_way_tables.clear()
+            mw_phi = self.phi(data[:,0], data[:,1])
+            _milky_way_tables[key] = (mw_phi, MilkyWayTable(data[:,0], mw_phi))
+        self.mw_phi, self.mw_phi_interp = _milky_way_tables[key]
+
+
+    @property
+    def mw_vLum_interp(self):
+        """Cubic interpolation of the Milky Way vLum, only built when it's first used"""
+        
+        if self._mw_vLum_interp is None:
+            from scipy.interpolate import interp1d
+            self._mw_vLum_interp = interp1d(self.mw_rad, self.mw_vLum, kind='cubic')
+        return self._mw_vLum_interp
 
 
     def vLumSquared(self, vGas, vDisk, vBulge, disk_scale=1, bulge_scale=1):
@@ -91,23 +358,118 @@ class Neros:
         :vObs: Observed galaxy rotation velocity, as a numpy array
         :vObsError: Measurement error on vObs, as a numpy array"""
         
-        # First we need to clip the galaxy data so it doesn't extend beyond
-        # the range of our Milky Way data, we may improve this method later
+        tracer = self.tracer
+        if tracer is None:
+            self.fit_problem(self.prepare(rad, vGas, vDisk, vBulge, vObs, vObsError))
+            return
+        
+        with tracer.galaxy():
+            with tracer.stage('prepare'):
+                problem = self.prepare(rad, vGas, vDisk, vBulge, vObs, vObsError)
+            self.fit_problem(problem)
+
+
+    def fit_problem(self, problem):
+        """Fits a FitProblem from prepare, storing the results like fit does
+        
+        Returns this Neros instance, so the get_ functions can be chained"""
+        
+        start = time.perf_counter()
+        if self.tracer is None:
+            fit_vals, cov, infodict, _, _ = problem.fit(full_output=True)
+        else:
+            fit_vals, cov, infodict = self._traced_fit(problem)
+        self.fit_info = {'nfev': int(infodict['nfev']), 'fit_time': time.perf_counter() - start}
+        return self._store_fit(problem, fit_vals, cov)
+
+
+    def _traced_fit(self, problem):
+        """problem.fit, recording evaluations, timing and convergence in the tracer"""
+        
+        tracer = self.tracer
+        with tracer.galaxy():
+            tracer.record(n_points=len(problem.rad))
+            try:
+                with tracer.counting(problem), tracer.stage('fit'):
+                    fit_vals, cov, infodict, mesg, ier = problem.fit(full_output=True)
+            except Exception as e:
+                # curve_fit can also give up with a ValueError or LinAlgError
+                tracer.record(status='failed', message=f"{type(e).__name__}: {e}", residual_norm=None)
+                raise
+            residuals = (problem.vNeros(*fit_vals) - problem.vObs) / problem.vObsError
+            tracer.record(status='converged', message=mesg,
+                          residual_norm=float(np.sqrt(np.sum(residuals**2))))
+        return fit_vals, cov, infodict
+
+
+    def fit_multistart(self, rad, vGas, vDisk, vBulge, vObs, vObsError, **options):
+        """Fits a galaxy from several starting points, keeping the best fit
+        
+        Use this instead of fit for galaxies that fail, or end up in a poor
+        minimum, from the usual starting point. The parameters are the same
+        as for fit, and options are passed on to MultiStart.fit_multistart
+        (n_starts, agree, rtol, workers, grid). The results are stored the
+        same way as fit, with the details of each start in multistart_info."""
+        
+        tracer = self.tracer
+        if tracer is None:
+            return self._fit_multistart(rad, vGas, vDisk, vBulge, vObs, vObsError, **options)
+        
+        with tracer.galaxy():
+            try:
+                with tracer.stage('multistart'):
+                    self._fit_multistart(rad, vGas, vDisk, vBulge, vObs, vObsError, **options)
+            except Exception as e:
+                tracer.record(status='failed', message=f"{type(e).__name__}: {e}", residual_norm=None)
+                raise
+            info = self.multistart_info
+            tracer.record(status='converged', nfev=self.fit_info['nfev'], n_starts=info['n_run'],
+                          n_points=len(self.rad),
+                          residual_norm=float(np.sqrt(info['chi_squared'] * (len(self.rad) - 3))))
+        return self
+
+
+    def _fit_multistart(self, rad, vGas, vDisk, vBulge, vObs, vObsError, **options):
+        import MultiStart
+        
+        start = time.perf_counter()
+        problem = self.prepare(rad, vGas, vDisk, vBulge, vObs, vObsError)
+        self.multistart_info = MultiStart.fit_multistart(problem, **options)
+        self.fit_info = {'nfev': sum(x.get('nfev', 0) for x in self.multistart_info['starts']),
+                         'fit_time': time.perf_counter() - start}
+        return self._store_fit(problem, self.multistart_info['fit_vals'],
+                               self.multistart_info['cov'])
+
+
+    def _store_fit(self, problem, fit_vals, cov):
+        """Keeps the trimmed data and best fit values for the get_ functions
+        
+        The covariance of the fit values from curve_fit is kept in fit_covariance,
+        and the number of function evaluations and time taken in fit_info"""
+        
         # We're storing these for later computations, they'll get overwritten
         # every time we call fit
-        valid_rad = rad <= self.mw_rad[-1]
-        self.rad = rad[valid_rad]
-        self.vGas = vGas[valid_rad]
-        self.vDisk = vDisk[valid_rad]
-        self.vBulge = vBulge[valid_rad]
-        self.vObs = vObs[valid_rad]
-        self.vObsError = vObsError[valid_rad]
-        
-        fit_vals, cov = curve_fit(self.curve_fit_fn,(self.rad, self.vGas, self.vDisk, self.vBulge),
-                          self.vObs, p0=[0.01, 1.0, 1.0], sigma=self.vObsError, maxfev=10000)
+        self.rad = problem.rad
+        self.vGas = problem.vGas
+        self.vDisk = problem.vDisk
+        self.vBulge = problem.vBulge
+        self.vObs = problem.vObs
+        self.vObsError = problem.vObsError
         
         fit_parameter_names  = ['alpha', 'disk_scale', 'bulge_scale']
         self.best_fit_values = dict(zip(fit_parameter_names, fit_vals))
+        self.fit_covariance = cov
+        return self
+
+    
+    def prepare(self, rad, vGas, vDisk, vBulge, vObs, vObsError):
+        """Sets up a FitProblem for a galaxy against this Milky Way
+        
+        The parameters are the same as for fit. The galaxy is clipped
+        to the range of the Milky Way data, and everything that doesn't
+        depend on the fit parameters is computed once."""
+        
+        return FitProblem(self, rad, vGas, vDisk, vBulge, vObs, vObsError)
 
     
     def curve_fit_fn(self, galaxyData, alpha, disk_scale, bulge_scale):
@@ -132,6 +494,40 @@ class Neros:
         return self.vNeros(rad, vLum_scaled, alpha)
 
 
+    def curve_fit_jac(self, galaxyData, alpha, disk_scale, bulge_scale):
+        """The Jacobian of curve_fit_fn, used as jac in scipy.curve_fit
+
+        Returns an N x 3 NumPy array of the derivatives of vNeros
+        with respect to alpha, disk_scale and bulge_scale at each radius.
+        The parameters are the same as for curve_fit_fn.
+
+        The galaxy phi is linear in vLum^2, so
+        d(phi)/d(disk_scale) = 2*disk_scale*phi(vDisk), and the same for the bulge"""
+
+        rad,vGas,vDisk,vBulge = galaxyData
+
+        vLum_scaled = np.sqrt(self.vLumSquared(vGas,vDisk,vBulge,disk_scale,bulge_scale))
+        vLCM, dvLCM_dphi, dvLCM_dvLum = self.vLCM_derivatives(rad, vLum_scaled)
+        vNeros = np.sqrt(vLum_scaled**2 + (alpha**2)*vLCM)
+
+        # d(vLum)/d(scale) = scale*v^2/vLum, which is 0 wherever vLum is
+        dvLum_ddisk = np.divide(disk_scale*vDisk**2, vLum_scaled,
+                                out=np.zeros_like(vLum_scaled), where=vLum_scaled > 0)
+        dvLum_dbulge = np.divide(bulge_scale*vBulge**2, vLum_scaled,
+                                 out=np.zeros_like(vLum_scaled), where=vLum_scaled > 0)
+        dphi_ddisk = 2*disk_scale*self.phi(rad, vDisk)
+        dphi_dbulge = 2*bulge_scale*self.phi(rad, vBulge)
+
+        # d(vNeros) = d(vNeros^2) / (2*vNeros)
+        d_alpha = alpha*vLCM / vNeros
+        d_disk = (disk_scale*vDisk**2
+                  + 0.5*(alpha**2)*(dvLCM_dphi*dphi_ddisk + dvLCM_dvLum*dvLum_ddisk)) / vNeros
+        d_bulge = (bulge_scale*vBulge**2
+                   + 0.5*(alpha**2)*(dvLCM_dphi*dphi_dbulge + dvLCM_dvLum*dvLum_dbulge)) / vNeros
+
+        return np.column_stack([d_alpha, d_disk, d_bulge])
+
+
     def get_fit_results(self, galaxy_rad, old_alpha=True):
         """Returns the numerical fit results: chi^2 and best fit parameters
         
@@ -208,21 +604,17 @@ class Neros:
 
 
     def phi(self, radius, vlum):
-        """Computes potential. phi = integrate vlum^2/r/c^2"""
-        
-        x = radius
-        y = np.square(vlum) / (x*c*c)
-        x = np.concatenate([np.array([0]), x])
-        y = np.concatenate([np.array([0]), y])
-        #May want to switch to Simpson's rule: scipy.integrate.simps
-        try:
-            # newer scipy
-            integral = scipy.integrate.cumulative_trapezoid(y,x)
-        except AttributeError:
-            # older scipy
-            integral = scipy.integrate.cumtrapz(y,x)
-            
-        return integral
+        """Computes potential. phi = integrate vlum^2/r/c^2
+        
+        vlum can also be 2-D, one vLum per row, for computing many
+        potentials over the same radii at once"""
+        
+        return self.phi_operator(radius)(np.square(vlum))
+
+
+    def phi_operator(self, radius):
+        """The PhiOperator for these radii, with this instance's integration rule"""
+        return phiOperator(radius, self.integration)
 
 
     def vNeros(self, galaxy_rad, galaxy_vLum, alpha):
@@ -270,15 +662,73 @@ class Neros:
         trimmed_phi = MW_phi[:len(valid_rad)]
         phi_zero = trimmed_phi[-1]
         galaxy_phi = self.phi(galaxy_rad, galaxy_vLum)
-        k = self.kappa(trimmed_phi, galaxy_phi, phi_zero)
-        v1 = self.v1(trimmed_phi, galaxy_phi, phi_zero)
-        v2 = self.v2(trimmed_phi, galaxy_phi, galaxy_vLum, phi_zero)
+        
+        return self.vLCM_from_phi(trimmed_phi, galaxy_phi, galaxy_vLum, phi_zero)
+
+
+    def vLCM_from_phi(self, MW_phi, galaxy_phi, galaxy_vLum, phi_zero):
+        """vLCM given the potentials, for when they have already been computed
+        
+        The parameters are
+        :MW_phi: The Milky Way phi at the galaxy radii
+        :galaxy_phi: The galaxy phi at the galaxy radii
+        :galaxy_vLum: A 1-D NumPy array of vLums
+        :phi_zero: The Milky Way phi at the last galaxy radius"""
+        
+        # etCurve is shared by v1 and v2, so it's only computed once here
+        k = self.kappa(MW_phi, galaxy_phi, phi_zero)
+        etCurve = self._eTsiCurveMinusOne(MW_phi, galaxy_phi, phi_zero)
+        v1 = self._v1_fn(etCurve)
+        v2 = self._v2_fn(self._eTsiFlatMinusOne(galaxy_vLum), etCurve)
         vLCM = c * c * k * k * v1 * v2
         #vLCM = c * c * v2 * v2
         
         return vLCM
 
 
+    def vLCM_derivatives(self, galaxy_rad, galaxy_vLum):
+        """Computes vLCM along with its partial derivatives
+        
+        Returns vLCM, d(vLCM)/d(galaxy_phi), d(vLCM)/d(galaxy_vLum), where
+        the galaxy phi and vLum are treated as independent. This follows
+        the same steps as vLCM, so the two need to be kept in step.
+        
+        The parameters are
+        :galaxy_rad: A 1-D NumPy array or Pandas DataSeries of radii
+        :galaxy_vLum: A 1-D NumPy array or Pandas DataSeries of vLums"""
+        
+        valid_rad = galaxy_rad <= self.mw_rad[-1]
+        MW_phi = self.mw_phi_interp(galaxy_rad)
+        trimmed_phi = MW_phi[:len(valid_rad)]
+        phi_zero = trimmed_phi[-1]
+        galaxy_phi = self.phi(galaxy_rad, galaxy_vLum)
+        
+        return self.vLCM_derivatives_from_phi(trimmed_phi, galaxy_phi, galaxy_vLum, phi_zero)
+
+
+    def vLCM_derivatives_from_phi(self, MW_phi, galaxy_phi, galaxy_vLum, phi_zero):
+        """vLCM_derivatives given the potentials, parameters are as for vLCM_from_phi"""
+        
+        k = self.kappa(MW_phi, galaxy_phi, phi_zero)
+        etFlat = self._eTsiFlatMinusOne(galaxy_vLum)
+        etCurve = self._eTsiCurveMinusOne(MW_phi, galaxy_phi, phi_zero)
+        v1 = self._v1_fn(etCurve)
+        v2 = self._v2_fn(etFlat, etCurve)
+        vLCM = c * c * k * k * v1 * v2
+        
+        dk_dphi = self._dkappa_dphi(MW_phi)
+        dv1_detc = self._dv1_detc(etCurve)
+        dv2_detFlat, dv2_detCurve = self._dv2_det(etFlat, etCurve)
+        detc_dphi = self._deTsiCurveMinusOne_dphi(MW_phi, etCurve)
+        detFlat_dvLum = self._deTsiFlatMinusOne_dvlum(galaxy_vLum, etFlat)
+        
+        dvLCM_dphi = c * c * (2 * k * dk_dphi * v1 * v2
+                              + k * k * (dv1_detc * v2 + v1 * dv2_detCurve) * detc_dphi)
+        dvLCM_dvLum = c * c * k * k * v1 * dv2_detFlat * detFlat_dvLum
+        
+        return vLCM, dvLCM_dphi, dvLCM_dvLum
+
+
     def kappa(self, MW_phi, other_phi, phi_zero):
         """kappa(r) in the paper, just phi_gal(r)/phi_mw(r)"""
         
@@ -287,47 +737,28 @@ class Neros:
         
 
     def v1(self, MW_phi, other_phi, phi_zero):
-        etc = self._eTsiCurveMinusOne(MW_phi, other_phi, phi_zero)
-        #sinh: uncomment following three lines
-        num = (etc+1)**2 - 1
-        den = 2*(1 + etc)
-        v1_calc = num/den
-        
-        # 1-sinh: uncomment following three lines
-#         num = (etc+1)**2 - 1
-#         den = 2*(1 + etc)
-#         v1_calc = 1-(num/den)
-        
-        #cosh: uncomment following three lines
-#         num = (etc+1)**2 + 1
-#         den = 2*(1 + etc)
-#         v1_calc = num/den
-        
-        #sech: uncomment following three lines
-#         num = 2*(1 + etc)
-#         den = (etc+1)**2 + 1
-#         v1_calc = num/den
-        
-        return v1_calc
+        """v1 in the form picked by v1_kernel (sinh by default, see V1_KERNELS)"""
+        
+        return self._v1_fn(self._eTsiCurveMinusOne(MW_phi, other_phi, phi_zero))
        
 
     def v2(self, MW_phi, other_phi, other_vlum, phi_zero):
+        """v2 in the form picked by v2_kernel (COSH:NN by default, see V2_KERNELS)"""
+        
         etFlat = self._eTsiFlatMinusOne(other_vlum)
         etCurve = self._eTsiCurveMinusOne(MW_phi, other_phi, phi_zero)
-        #COSH:NN uncomment following two linesversion 1(e^2z =e^c * e^f)
-        num = (etFlat +1)*(etCurve+1)  +1
-        den = 2*np.sqrt((etFlat + 1)*(etCurve +1))
-        return num/den
+        return self._v2_fn(etFlat, etCurve)
         
 
 
     def chiSquared(self, model, expected, error):
-        """This computes chi squared"""
-        chiSquared = 0
-
-        for i in range(len(model)):
-            chiSquared = chiSquared + (((model[i] - expected[i])**2) / (error[i]**2))
-        return chiSquared / (len(model) - 3) 
+        """This computes chi squared, reduced by the 3 fit parameters"""
+        model = np.asarray(model)
+        expected = np.asarray(expected)
+        error = np.asarray(error)
+        
+        chiSquared = np.sum(((model - expected)**2) / (error**2))
+        return chiSquared / (len(model) - 3)
 
 
     def _eTsiFlatMinusOne(self, other_vlum):
@@ -339,9 +770,952 @@ class Neros:
         return numerator / denominator
 
 
+    def _deTsiFlatMinusOne_dvlum(self, other_vlum, etFlat):
+        """d(eTsiFlat - 1)/d(vlum), given etFlat = eTsiFlat - 1
+        
+        eTsiFlat = sqrt((1+beta)/(1-beta)), so its log derivative
+        with respect to beta is 1/(1-beta^2)"""
+        
+        beta = other_vlum / c
+        return (etFlat + 1) / ((1 - beta*beta) * c)
+
+
     def _eTsiCurveMinusOne(self, MW_phi, other_phi, phi_zero):
         """This computes eTsiCurve - 1, compared to the old code, for numerical stability"""
         #NOTE: this is the correct frame order and correct signs for numerical stability calculation
         numerator = ( 2*(MW_phi )-2*(other_phi )) / (1 - 2*(MW_phi ))
         denominator = np.sqrt((1 - 2*(other_phi)) / (1 - 2*(MW_phi ))) + 1
         return numerator / denominator
+
+
+    def _deTsiCurveMinusOne_dphi(self, MW_phi, etCurve):
+        """d(eTsiCurve - 1)/d(other_phi), given etCurve = eTsiCurve - 1
+        
+        eTsiCurve = sqrt((1 - 2*other_phi) / (1 - 2*MW_phi))"""
+        
+        return -1 / ((1 - 2*(MW_phi)) * (etCurve + 1))
+
+
+    def _dkappa_dphi(self, MW_phi):
+        """d(kappa)/d(other_phi)"""
+        
+        return 1 / MW_phi
+
+
+    def _dv1_detc(self, etc):
+        """d(v1)/d(etc) for the form of v1 picked by v1_kernel"""
+        
+        return self._dv1_fn(etc)
+
+
+    def _dv2_det(self, etFlat, etCurve):
+        """d(v2)/d(etFlat) and d(v2)/d(etCurve) for the form of v2 picked by v2_kernel"""
+        
+        return self._dv2_fn(etFlat, etCurve)
+
+
+
+class PhiOperator:
+    """Cumulative integration of vLum^2/(r c^2) from r = 0 over one set of radii
+    
+    phi is linear in vLum^2, so for fixed radii it's a fixed linear map,
+    and everything that only depends on the radii (the interval widths,
+    the quadrature weights) is worked out once here. Use phiOperator
+    (or Neros.phi_operator) to get one, they are reused for the same radii.
+    
+    operator(vLum_squared) gives phi at each radius. vLum_squared can
+    have any number of leading dimensions, e.g. one row per bootstrap
+    sample, grid point or component, all done in one array operation.
+    matrix is the same map as a (radii x radii) lower triangular matrix.
+    
+    rad can also be 2-D, one set of radii per row (e.g. many galaxies
+    with the same number of points), and then each row of vLum_squared
+    is integrated over its own radii.
+    
+    rule is
+    :trapezoid: The trapezoid rule, giving exactly the same values as
+                scipy.integrate.cumulative_trapezoid, which Neros used before
+    :simpson: Each interval integrates the quadratic through it and the
+              next radius (the previous one for the last interval), as
+              scipy.integrate.cumulative_simpson does. With a single
+              radius this is the trapezoid rule
+    
+    The integrand is 0 at r = 0, which is the first point of every interval grid."""
+    
+    __slots__ = ['rad', 'rule', 'rc2', 'widths', 'stencil', 'weights']
+    
+    def __init__(self, rad, rule='trapezoid'):
+        if rule not in INTEGRATION_RULES:
+            raise ValueError(f"Unknown integration rule {rule!r}, "
+                             f"should be one of {', '.join(INTEGRATION_RULES)}")
+        self.rad = np.array(rad, dtype=float)
+        self.rule = rule
+        self.rc2 = self.rad*c*c
+        x = np.concatenate([np.zeros(self.rad.shape[:-1] + (1,)), self.rad], axis=-1)
+        self.widths = np.diff(x, axis=-1)
+        self.stencil = None
+        self.weights = None
+        if rule == 'simpson' and x.shape[-1] >= 3:
+            self.stencil, self.weights = _simpsonWeights(x)
+    
+    
+    def __call__(self, vLum_squared):
+        y = vLum_squared / self.rc2
+        y = np.concatenate([np.zeros(y.shape[:-1] + (1,)), y], axis=-1)
+        if self.stencil is None:
+            # The same steps as scipy.integrate.cumulative_trapezoid
+            return np.cumsum(self.widths * (y[..., 1:] + y[..., :-1]) / 2.0, axis=-1)
+        return np.cumsum(np.sum(y[..., self.stencil] * self.weights, axis=-1), axis=-1)
+    
+    
+    @property
+    def matrix(self):
+        if self.rad.ndim != 1:
+            raise ValueError("matrix is only available for a single set of radii")
+        return self(np.eye(len(self.rad))).T
+
+
+def phiOperator(rad, rule='trapezoid'):
+    """The PhiOperator for these radii and rule, only built the first time they're seen in this process"""
+    
+    rad = np.asarray(rad, dtype=float)
+    key = (rule, rad.shape, rad.tobytes())
+    operator = _phi_operators.get(key)
+    if operator is None:
+        if len(_phi_operators) >= MAX_PHI_OPERATORS:
+            _phi_operators.clear()
+        operator = _phi_operators[key] = PhiOperator(rad, rule)
+    return operator
+
+
+def _simpsonWeights(x):
+    """Indices into x, and weights, of the quadratic rule for each interval of x
+    
+    As in scipy.integrate.cumulative_simpson, interval i (from x[i] to x[i+1])
+    uses x[i], x[i+1], x[i+2] when i is even, and x[i-1], x[i], x[i+1] when
+    i is odd or the last interval. Intervals where the three radii aren't
+    distinct (the Milky Way tables repeat some) use the trapezoid rule.
+    x can have leading dimensions. Returns the indices, (intervals x 3),
+    and the weights, (... x intervals x 3)"""
+    
+    n = x.shape[-1] - 1
+    intervals = np.arange(n)
+    first = np.where((intervals % 2 == 0) & (intervals < n - 1), intervals, intervals - 1)
+    stencil = first[:, np.newaxis] + np.arange(3)
+    # Shift each stencil so its interval starts at 0, for accuracy
+    nodes = x[..., stencil] - x[..., :-1, np.newaxis]
+    width = np.diff(x, axis=-1)[..., np.newaxis]
+    
+    # Integral of each Lagrange basis polynomial over the interval
+    weights = np.empty_like(nodes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k in range(3):
+            a = nodes[..., k:k+1]
+            b, d = (nodes[..., j:j+1] for j in range(3) if j != k)
+            integral = width**3/3 - (b + d)*width**2/2 + b*d*width
+            weights[..., k:k+1] = integral / ((a - b)*(a - d))
+    
+    degenerate = ~np.all(np.isfinite(weights), axis=-1, keepdims=True)
+    if degenerate.any():
+        # The interval's own two radii, where they are in the stencil
+        offset = (intervals - first)[:, np.newaxis]
+        ends = (np.arange(3) == offset) | (np.arange(3) == offset + 1)
+        weights = np.where(degenerate, ends * width / 2, weights)
+    return stencil, weights
+
+
+
+class MilkyWayTable:
+    """Linear interpolation of the Milky Way phi, used as Neros.mw_phi_interp
+    
+    This gives the same values as interp1d(mw_rad, mw_phi), but goes
+    straight to np.interp, which is several times faster for the few
+    dozen radii of a galaxy. Like interp1d, the radii are sorted first
+    (phi along with them), and radii outside the table raise a ValueError.
+    
+    The sorted table is available as rad and phi."""
+    
+    __slots__ = ['rad', 'phi']
+    
+    def __init__(self, rad, phi):
+        order = np.argsort(rad, kind='mergesort')
+        self.rad = np.ascontiguousarray(rad[order], dtype=float)
+        self.phi = np.ascontiguousarray(phi[order], dtype=float)
+    
+    
+    def __call__(self, galaxy_rad):
+        # NaN marks radii outside the table, checking for it is cheaper
+        # than finding the smallest and largest radius first
+        phi = np.interp(galaxy_rad, self.rad, self.phi, left=np.nan, right=np.nan)
+        if np.isnan(phi).any():
+            galaxy_rad = np.asarray(galaxy_rad, dtype=float)
+            below = galaxy_rad < self.rad[0]
+            above = galaxy_rad > self.rad[-1]
+            if below.any():
+                raise ValueError(f"A value ({galaxy_rad[below].min()}) is below the Milky Way "
+                                 f"table's minimum radius ({self.rad[0]})")
+            if above.any():
+                raise ValueError(f"A value ({galaxy_rad[above].max()}) is above the Milky Way "
+                                 f"table's maximum radius ({self.rad[-1]})")
+        return phi
+
+
+
+class FitProblem:
+    """A single galaxy prepared for fitting against one Milky Way model
+    
+    Create one with Neros.prepare(rad, vGas, vDisk, vBulge, vObs, vObsError).
+    
+    The galaxy phi is linear in vLum^2, so it is split into
+    phi_gas + disk_scale^2*phi_disk + bulge_scale^2*phi_bulge.
+    Those three partial potentials, the interpolated Milky Way phi
+    and phi_zero are computed once here, so evaluating the model
+    for new fit parameters is only elementwise work, done in place
+    in the problem's FitWorkspace.
+    
+    The trimmed data is available as rad, vGas, vDisk, vBulge,
+    vObs and vObsError, the same as on Neros after a fit.
+    
+    MilkyWayEnsemble passes in partial_phis (phi_gas, phi_disk, phi_bulge
+    over the untrimmed radii) and mw_phi (the Milky Way phi at the trimmed
+    radii) so that they're only computed once for all of its models.
+    Since phi is integrated outward from r = 0, trimming radii off the end
+    doesn't change it at the radii that are left."""
+    
+    fit_parameter_names = ['alpha', 'disk_scale', 'bulge_scale']
+    
+    def __init__(self, neros, rad, vGas, vDisk, vBulge, vObs, vObsError,
+                 partial_phis=None, mw_phi=None):
+        self.neros = neros
+        
+        # First we need to clip the galaxy data so it doesn't extend beyond
+        # the range of our Milky Way data, we may improve this method later
+        valid_rad = rad <= neros.mw_rad[-1]
+        self.rad = rad[valid_rad]
+        self.vGas = vGas[valid_rad]
+        self.vDisk = vDisk[valid_rad]
+        self.vBulge = vBulge[valid_rad]
+        self.vObs = vObs[valid_rad]
+        self.vObsError = vObsError[valid_rad]
+        
+        self.vGas_squared = self.vGas**2
+        self.vDisk_squared = self.vDisk**2
+        self.vBulge_squared = self.vBulge**2
+        
+        if mw_phi is None:
+            mw_phi = neros.mw_phi_interp(self.rad)
+        self.mw_phi = mw_phi
+        self.phi_zero = self.mw_phi[-1]
+        if partial_phis is None:
+            self.phi_gas, self.phi_disk, self.phi_bulge = neros.phi_operator(self.rad)(
+                np.stack([self.vGas_squared, self.vDisk_squared, self.vBulge_squared]))
+        else:
+            self.phi_gas, self.phi_disk, self.phi_bulge = (x[valid_rad] for x in partial_phis)
+        self.workspace = FitWorkspace(self)
+    
+    
+    def vLumSquared(self, disk_scale, bulge_scale):
+        return self.vGas_squared + (disk_scale**2)*self.vDisk_squared + (bulge_scale**2)*self.vBulge_squared
+    
+    
+    def galaxy_phi(self, disk_scale, bulge_scale):
+        return self.phi_gas + (disk_scale**2)*self.phi_disk + (bulge_scale**2)*self.phi_bulge
+    
+    
+    def vNeros(self, alpha, disk_scale, bulge_scale):
+        """vNeros at the trimmed radii, the same as Neros.curve_fit_fn
+        
+        This is evaluated in the FitWorkspace, see reference_vNeros for
+        the same thing written out with the Neros methods"""
+        
+        return self.workspace.vNeros(alpha, disk_scale, bulge_scale)
+    
+    
+    def jacobian(self, alpha, disk_scale, bulge_scale):
+        """Derivatives of vNeros, the same as Neros.curve_fit_jac
+        
+        This is evaluated in the FitWorkspace, see reference_jacobian"""
+        
+        return self.workspace.jacobian(alpha, disk_scale, bulge_scale)
+    
+    
+    def reference_vNeros(self, alpha, disk_scale, bulge_scale):
+        """vNeros, computed step by step with Neros.vLCM_from_phi"""
+        
+        vLum_squared = self.vLumSquared(disk_scale, bulge_scale)
+        vLCM = self.neros.vLCM_from_phi(self.mw_phi, self.galaxy_phi(disk_scale, bulge_scale),
+                                        np.sqrt(vLum_squared), self.phi_zero)
+        return np.sqrt(vLum_squared + (alpha**2)*vLCM)
+    
+    
+    def reference_jacobian(self, alpha, disk_scale, bulge_scale):
+        """The Jacobian, computed step by step with Neros.vLCM_derivatives_from_phi"""
+        
+        vLum_squared = self.vLumSquared(disk_scale, bulge_scale)
+        vLum = np.sqrt(vLum_squared)
+        vLCM, dvLCM_dphi, dvLCM_dvLum = self.neros.vLCM_derivatives_from_phi(
+            self.mw_phi, self.galaxy_phi(disk_scale, bulge_scale), vLum, self.phi_zero)
+        vNeros = np.sqrt(vLum_squared + (alpha**2)*vLCM)
+        
+        dvLum_ddisk = np.divide(disk_scale*self.vDisk_squared, vLum,
+                                out=np.zeros_like(vLum), where=vLum > 0)
+        dvLum_dbulge = np.divide(bulge_scale*self.vBulge_squared, vLum,
+                                 out=np.zeros_like(vLum), where=vLum > 0)
+        dphi_ddisk = 2*disk_scale*self.phi_disk
+        dphi_dbulge = 2*bulge_scale*self.phi_bulge
+        
+        d_alpha = alpha*vLCM / vNeros
+        d_disk = (disk_scale*self.vDisk_squared
+                  + 0.5*(alpha**2)*(dvLCM_dphi*dphi_ddisk + dvLCM_dvLum*dvLum_ddisk)) / vNeros
+        d_bulge = (bulge_scale*self.vBulge_squared
+                   + 0.5*(alpha**2)*(dvLCM_dphi*dphi_dbulge + dvLCM_dvLum*dvLum_dbulge)) / vNeros
+        
+        return np.column_stack([d_alpha, d_disk, d_bulge])
+    
+    
+    def curve_fit_fn(self, galaxyData, alpha, disk_scale, bulge_scale):
+        """Fitting function for scipy.curve_fit, galaxyData is ignored"""
+        return self.vNeros(alpha, disk_scale, bulge_scale)
+    
+    
+    def curve_fit_jac(self, galaxyData, alpha, disk_scale, bulge_scale):
+        """Jacobian for scipy.curve_fit, galaxyData is ignored"""
+        return self.jacobian(alpha, disk_scale, bulge_scale)
+    
+    
+    def chi_squared(self, alpha, disk_scale, bulge_scale):
+        """Reduced chi^2 of the model with these parameters"""
+        return self.neros.chiSquared(self.vNeros(alpha, disk_scale, bulge_scale), self.vObs, self.vObsError)
+    
+    
+    def fit(self, p0=(0.01, 1.0, 1.0), maxfev=10000, weights=None, full_output=False):
+        """Runs curve_fit on this galaxy, returns the best fit values and covariance
+        
+        weights optionally gives each point a weight, e.g. the number of
+        times it was drawn for a bootstrap sample, so that resampled data
+        can be fit without preparing it again. Points with weight 0 are left out.
+        
+        With full_output, curve_fit's infodict, mesg and ier are returned as well"""
+        
+        from scipy.optimize import curve_fit
+        
+        if weights is None:
+            return curve_fit(self.curve_fit_fn, self.rad, self.vObs, p0=list(p0),
+                             sigma=self.vObsError, maxfev=maxfev, jac=self.curve_fit_jac,
+                             full_output=full_output)
+        
+        weights = np.asarray(weights)
+        rows = weights > 0
+        return curve_fit(lambda galaxyData, *params: self.vNeros(*params)[rows],
+                         self.rad[rows], self.vObs[rows], p0=list(p0),
+                         sigma=self.vObsError[rows] / np.sqrt(weights[rows]), maxfev=maxfev,
+                         jac=lambda galaxyData, *params: self.jacobian(*params)[rows],
+                         full_output=full_output)
+
+
+
+class FitWorkspace:
+    """Preallocated arrays for evaluating one FitProblem over and over
+
+    FitProblem.vNeros and FitProblem.jacobian are evaluated thousands of
+    times per fit, and for a galaxy of a few dozen points most of the
+    time went into making and freeing small temporary arrays, and into
+    NumPy converting Python numbers. Here every intermediate array is
+    allocated once per galaxy and written in place, numbers are passed
+    as 0-d arrays, the parts that don't depend on the fit parameters
+    (2*MW_phi, 1 - 2*MW_phi and 1/MW_phi) are computed once, and the
+    rest is computed once per (disk_scale, bulge_scale):
+
+      values       vLum^2, vLum, galaxy phi, kappa, eTsiCurve - 1,
+                   eTsiFlat - 1, v1, v2 and vLCM, which vNeros and the
+                   Jacobian both need. curve_fit asks for the Jacobian at
+                   a point it has just evaluated, so usually these are
+                   already there when the Jacobian is asked for
+      derivatives  everything else the Jacobian needs
+
+    The operations are the same, in the same order, as in Neros.vLCM_from_phi,
+    Neros.vLCM_derivatives_from_phi and the kernels, so the results are
+    identical to them, bit for bit (FitProblem.reference_vNeros and
+    reference_jacobian compute them that way). Overriding those methods
+    in a subclass of Neros doesn't change what a FitWorkspace computes.
+
+    vNeros and jacobian return new arrays, which stay valid after later calls"""
+
+    __slots__ = ['problem', 'key', 'two_mw_phi', 'one_minus_two_mw_phi', 'dkappa_dphi',
+                 'vLum_squared', 'vLum', 'galaxy_phi', 'kappa', 'etCurve', 'etCurve1',
+                 'beta', 'one_minus_beta', 'etFlat', 'etFlat1', 'v1', 'v2', 'v2_state', 'vLCM',
+                 'dv1', 'dv2_flat', 'dv2_curve', 'positive', 'a', 'b', 'scratch', 'number']
+
+    def __init__(self, problem):
+        self.problem = problem
+        self.key = None
+        mw_phi = problem.mw_phi
+        self.two_mw_phi = 2*(mw_phi)
+        self.one_minus_two_mw_phi = 1 - 2*(mw_phi)
+        self.dkappa_dphi = 1 / mw_phi
+
+        n = len(mw_phi)
+        for name in ['vLum_squared', 'vLum', 'galaxy_phi', 'kappa', 'etCurve', 'etCurve1',
+                     'beta', 'one_minus_beta', 'etFlat', 'etFlat1', 'v1', 'v2', 'vLCM',
+                     'dv1', 'dv2_flat', 'dv2_curve', 'a', 'b', 'scratch']:
+            setattr(self, name, np.empty(n))
+        self.v2_state = (np.empty(n), np.empty(n), np.empty(n))
+        self.positive = np.empty(n, dtype=bool)
+        # For passing a number to NumPy as a 0-d array
+        self.number = np.empty(())
+
+
+    def values(self, disk_scale, bulge_scale):
+        """Computes the parts of the model shared by vNeros and the Jacobian, if they aren't already"""
+
+        p = self.problem
+        neros = p.neros
+        key = (disk_scale, bulge_scale, neros.v1_kernel, neros.v2_kernel)
+        if self.key == key:
+            return
+        # If anything below fails, nothing is cached
+        self.key = None
+        scratch, a, number = self.scratch, self.a, self.number
+
+        # vLum^2 and the galaxy phi, as FitProblem.vLumSquared and galaxy_phi
+        vLum_squared, galaxy_phi = self.vLum_squared, self.galaxy_phi
+        number[()] = disk_scale**2
+        np.multiply(number, p.vDisk_squared, scratch)
+        np.add(p.vGas_squared, scratch, vLum_squared)
+        np.multiply(number, p.phi_disk, scratch)
+        np.add(p.phi_gas, scratch, galaxy_phi)
+        number[()] = bulge_scale**2
+        np.multiply(number, p.vBulge_squared, scratch)
+        np.add(vLum_squared, scratch, vLum_squared)
+        np.multiply(number, p.phi_bulge, scratch)
+        np.add(galaxy_phi, scratch, galaxy_phi)
+        np.sqrt(vLum_squared, self.vLum)
+
+        # Neros.kappa
+        np.divide(galaxy_phi, p.mw_phi, self.kappa)
+
+        # Neros._eTsiCurveMinusOne
+        etCurve = self.etCurve
+        np.multiply(_TWO, galaxy_phi, scratch)
+        np.subtract(self.two_mw_phi, scratch, etCurve)
+        np.divide(etCurve, self.one_minus_two_mw_phi, etCurve)
+        np.subtract(_ONE, scratch, a)
+        np.divide(a, self.one_minus_two_mw_phi, a)
+        np.sqrt(a, a)
+        np.add(a, _ONE, a)
+        np.divide(etCurve, a, etCurve)
+        np.add(etCurve, _ONE, self.etCurve1)
+
+        # Neros._eTsiFlatMinusOne
+        beta, one_minus_beta, etFlat = self.beta, self.one_minus_beta, self.etFlat
+        np.divide(self.vLum, _C, beta)
+        np.subtract(_ONE, beta, one_minus_beta)
+        np.multiply(_TWO, beta, etFlat)
+        np.divide(etFlat, one_minus_beta, etFlat)
+        np.add(_ONE, beta, a)
+        np.divide(a, one_minus_beta, a)
+        np.sqrt(a, a)
+        np.add(a, _ONE, a)
+        np.divide(etFlat, a, etFlat)
+        np.add(etFlat, _ONE, self.etFlat1)
+
+        if neros._v1_into is not None:
+            neros._v1_into[0](etCurve, self.etCurve1, self.v1, scratch)
+        else:
+            np.copyto(self.v1, neros._v1_fn(etCurve))
+        if neros._v2_into is not None:
+            neros._v2_into[0](self.etFlat1, self.etCurve1, self.v2, self.v2_state)
+        else:
+            np.copyto(self.v2, neros._v2_fn(etFlat, etCurve))
+
+        # c*c*k*k*v1*v2
+        vLCM = self.vLCM
+        np.multiply(_C_SQUARED, self.kappa, vLCM)
+        np.multiply(vLCM, self.kappa, vLCM)
+        np.multiply(vLCM, self.v1, vLCM)
+        np.multiply(vLCM, self.v2, vLCM)
+        self.key = key
+
+
+    def vNeros(self, alpha, disk_scale, bulge_scale):
+        """vNeros at the trimmed radii, as a new array"""
+
+        self.values(disk_scale, bulge_scale)
+        return self._vNeros(alpha)
+
+
+    def _vNeros(self, alpha):
+        number = self.number
+        number[()] = alpha**2
+        out = np.multiply(number, self.vLCM)
+        np.add(self.vLum_squared, out, out)
+        return np.sqrt(out, out)
+
+
+    def jacobian(self, alpha, disk_scale, bulge_scale):
+        """Derivatives of vNeros with respect to alpha, disk_scale and bulge_scale, as a new points x 3 array"""
+
+        self.values(disk_scale, bulge_scale)
+        p = self.problem
+        neros = p.neros
+        k, v1, v2, scratch, a, b = self.kappa, self.v1, self.v2, self.scratch, self.a, self.b
+        dv1, dv2_flat, dv2_curve, number = self.dv1, self.dv2_flat, self.dv2_curve, self.number
+
+        if neros._v1_into is not None:
+            neros._v1_into[1](self.etCurve, self.etCurve1, dv1, scratch)
+        else:
+            np.copyto(dv1, neros._dv1_fn(self.etCurve))
+        if neros._v2_into is not None:
+            neros._v2_into[1](self.etFlat1, self.etCurve1, dv2_flat, dv2_curve, self.v2_state)
+        else:
+            flat, curve = neros._dv2_fn(self.etFlat, self.etCurve)
+            np.copyto(dv2_flat, flat)
+            np.copyto(dv2_curve, curve)
+
+        # d(vLCM)/d(galaxy phi), as in Neros.vLCM_derivatives_from_phi, into a
+        np.multiply(_TWO, k, a)
+        np.multiply(a, self.dkappa_dphi, a)
+        np.multiply(a, v1, a)
+        np.multiply(a, v2, a)
+        np.multiply(dv1, v2, b)
+        np.multiply(v1, dv2_curve, scratch)
+        np.add(b, scratch, b)
+        np.multiply(k, k, scratch)
+        np.multiply(scratch, b, scratch)
+        # d(eTsiCurve - 1)/d(galaxy phi)
+        np.multiply(self.one_minus_two_mw_phi, self.etCurve1, b)
+        np.divide(_MINUS_ONE, b, b)
+        np.multiply(scratch, b, scratch)
+        np.add(a, scratch, a)
+        np.multiply(_C_SQUARED, a, a)
+        dvLCM_dphi = a
+
+        # d(vLCM)/d(vLum), into b
+        np.multiply(_C_SQUARED, k, b)
+        np.multiply(b, k, b)
+        np.multiply(b, v1, b)
+        np.multiply(b, dv2_flat, b)
+        # d(eTsiFlat - 1)/d(vLum)
+        np.multiply(self.beta, self.beta, scratch)
+        np.subtract(_ONE, scratch, scratch)
+        np.multiply(scratch, _C, scratch)
+        np.divide(self.etFlat1, scratch, scratch)
+        np.multiply(b, scratch, b)
+        dvLCM_dvLum = b
+
+        # The columns, as in Neros.curve_fit_jac
+        vNeros = self._vNeros(alpha)
+        jac = np.empty((len(vNeros), 3))
+        d_alpha = jac[:, 0]
+        number[()] = alpha
+        np.multiply(number, self.vLCM, d_alpha)
+        np.divide(d_alpha, vNeros, d_alpha)
+
+        vLum, positive = self.vLum, self.positive
+        np.greater(vLum, _ZERO, positive)
+        all_positive = positive.all()
+        # dv2_flat and dv2_curve aren't needed any more, they're used for
+        # d(vLum)/d(scale) and d(phi)/d(scale)
+        dvLum_dscale, dphi_dscale = dv2_flat, dv2_curve
+        for scale, v_squared, phi, out in ((disk_scale, p.vDisk_squared, p.phi_disk, jac[:, 1]),
+                                           (bulge_scale, p.vBulge_squared, p.phi_bulge, jac[:, 2])):
+            # scale*v^2, with v the disk or bulge velocity
+            number[()] = scale
+            np.multiply(number, v_squared, scratch)
+            if all_positive:
+                np.divide(scratch, vLum, dvLum_dscale)
+            else:
+                dvLum_dscale.fill(0)
+                np.divide(scratch, vLum, dvLum_dscale, where=positive)
+            number[()] = 2*scale
+            np.multiply(number, phi, dphi_dscale)
+            np.multiply(dvLCM_dphi, dphi_dscale, dphi_dscale)
+            np.multiply(dvLCM_dvLum, dvLum_dscale, dvLum_dscale)
+            np.add(dphi_dscale, dvLum_dscale, dphi_dscale)
+            number[()] = 0.5*(alpha**2)
+            np.multiply(number, dphi_dscale, dphi_dscale)
+            np.add(scratch, dphi_dscale, scratch)
+            np.divide(scratch, vNeros, out)
+        return jac
+
+
+
+class MilkyWayEnsemble:
+    """Several Milky Way models, evaluated together
+    
+    Create one with
+    MilkyWayEnsemble({'XueSofue': MWXueSofue, 'McGaugh': MWMcGaugh, ...})
+    where each value is Milky Way data in any form accepted by Neros.
+    
+    All of the Milky Way phis are stored as one table (models x radii)
+    over the union of their radii. Since each phi is linearly interpolated,
+    interpolating that table gives exactly the same values as each
+    model's own mw_phi_interp.
+    
+    vLCM and vNeros return one row per model. A galaxy radius beyond
+    a model's range gives NaN in that model's row, the same points
+    Neros.fit would trim.
+    
+    For fitting, everything on the galaxy side (the partial potentials)
+    is computed once and shared by all of the models."""
+    
+    def __init__(self, milky_way_models):
+        self.names = list(milky_way_models)
+        self.models = [Neros(milky_way_models[name]) for name in self.names]
+        self.mw_rad_max = np.array([model.mw_rad[-1] for model in self.models])
+        
+        tables = [model.mw_phi_interp for model in self.models]
+        self.table_rad = np.unique(np.concatenate([table.rad for table in tables]))
+        self.phi_table = np.array([np.interp(self.table_rad, table.rad, table.phi,
+                                             left=np.nan, right=np.nan)
+                                   for table in tables])
+    
+    
+    def __len__(self):
+        return len(self.models)
+    
+    
+    def mw_phi(self, galaxy_rad):
+        """Milky Way phi of every model at the galaxy radii, models x radii
+        
+        NaN outside the range of a model"""
+        
+        galaxy_rad = np.asarray(galaxy_rad, dtype=float)
+        # side='right' makes exact hits on a table radius land at t = 0,
+        # so a NaN on the far side of a model's last radius isn't picked up
+        upper = np.searchsorted(self.table_rad, galaxy_rad, side='right')
+        in_table = (upper > 0) & (upper < len(self.table_rad)) | (galaxy_rad == self.table_rad[-1])
+        upper = np.clip(upper, 1, len(self.table_rad) - 1)
+        lower = upper - 1
+        
+        r0 = self.table_rad[lower]
+        r1 = self.table_rad[upper]
+        t = (galaxy_rad - r0) / (r1 - r0)
+        phi0 = self.phi_table[:, lower]
+        phi1 = self.phi_table[:, upper]
+        with np.errstate(invalid='ignore'):
+            phi = np.where(t == 0, phi0, phi0 + t*(phi1 - phi0))
+        phi[:, ~in_table] = np.nan
+        return phi
+    
+    
+    def vLCM(self, galaxy_rad, galaxy_vLum):
+        """vLCM against every model, models x radii"""
+        
+        MW_phi = self.mw_phi(galaxy_rad)
+        galaxy_phi = self.models[0].phi(galaxy_rad, galaxy_vLum)
+        phi_zero = self._phi_zero(galaxy_rad, MW_phi)
+        return self.models[0].vLCM_from_phi(MW_phi, galaxy_phi, galaxy_vLum, phi_zero[:, np.newaxis])
+    
+    
+    def vNeros(self, galaxy_rad, galaxy_vLum, alpha):
+        """vNeros against every model, models x radii
+        
+        alpha can be a single value, or one per model"""
+        
+        alpha = np.asarray(alpha, dtype=float)
+        if alpha.ndim == 1:
+            alpha = alpha[:, np.newaxis]
+        vLCM = self.vLCM(galaxy_rad, galaxy_vLum)
+        return np.sqrt(galaxy_vLum**2 + (alpha**2)*vLCM)
+    
+    
+    def _phi_zero(self, galaxy_rad, MW_phi):
+        """MW phi at the last galaxy radius each model keeps"""
+        
+        valid = galaxy_rad[np.newaxis, :] <= self.mw_rad_max[:, np.newaxis]
+        last = np.maximum(valid.sum(axis=1) - 1, 0)
+        return MW_phi[np.arange(len(self.models)), last]
+    
+    
+    def prepare(self, rad, vGas, vDisk, vBulge, vObs, vObsError):
+        """One FitProblem per model, sharing the galaxy potentials"""
+        
+        neros = self.models[0]
+        partial_phis = neros.phi(rad, np.stack([vGas, vDisk, vBulge]))
+        MW_phi = self.mw_phi(rad)
+        
+        problems = []
+        for model, model_phi in zip(self.models, MW_phi):
+            valid_rad = rad <= model.mw_rad[-1]
+            problems.append(FitProblem(model, rad, vGas, vDisk, vBulge, vObs, vObsError,
+                                       partial_phis=partial_phis, mw_phi=model_phi[valid_rad]))
+        return problems
+    
+    
+    def fit(self, rad, vGas, vDisk, vBulge, vObs, vObsError):
+        """Fits a galaxy against every model
+        
+        Returns a list with the results for each model, as from
+        Neros.get_fit_results plus fit_info, or the exception if the fit failed"""
+        
+        results = []
+        for model, problem in zip(self.models, self.prepare(rad, vGas, vDisk, vBulge, vObs, vObsError)):
+            try:
+                model.fit_problem(problem)
+                results.append(dict(model.get_fit_results(rad), **model.fit_info))
+            except Exception as e:
+                results.append(e)
+        return results
+    
+    
+    def fit_catalog(self, catalog, workers=None, chunksize=None):
+        """Fits every galaxy in a catalog against every model
+        
+        Parameters are the same as for fit_catalog. Returns a Pandas DataFrame
+        with an 'MW' column (the model name) in front of the usual columns,
+        one row per galaxy per model."""
+        
+        import pandas as pd
+        
+        rows = _fit_items(self, list(catalog.items()), workers, chunksize, fit_galaxy_ensemble)
+        return pd.DataFrame([row for galaxy_rows in rows for row in galaxy_rows],
+                            columns=['MW'] + FIT_RESULT_COLUMNS)
+
+
+
+# Catalog fitting
+# These replace the "for galaxyName in galaxies:" loop in Model.ipynb
+# Each worker process gets its own Neros instance once (in the
+# initializer) and then fits whole galaxies, so the only thing sent
+# between processes is the galaxy data and the fit results
+# With a FitCache, only galaxies that haven't been fit before
+# (with the same data, Milky Way, model version and options) go to the workers
+
+FIT_RESULT_COLUMNS = ['Galaxy', 'chi_squared', 'alpha', 'disk_scale', 'bulge_scale', 'phi_zero',
+                      'nfev', 'fit_time', 'error']
+
+_worker_fitter = None
+
+
+def galaxy_columns(galaxy):
+    """Splits one galaxy into the arrays Neros.fit expects
+
+    The galaxy can be the list of lists from DataAid.GetGalaxyData,
+    a NumPy array, a DataFrame from DataImporter.getGalaxyData, or a
+    GalaxyCatalog.Galaxy (which is used without any conversion).
+    Columns must be in the Sparc/Little Things order
+    Rad, Vobs, errV, Vgas, Vdisk, Vbul (names are ignored).
+
+    Returns rad, vGas, vDisk, vBulge, vObs, vObsError"""
+
+    if hasattr(galaxy, 'fit_columns'):
+        return galaxy.fit_columns
+
+    data = np.asarray(galaxy, dtype=float)
+    if len(data.shape) != 2 or data.shape[1] < 6:
+        raise ValueError("Galaxy data must have at least six columns")
+
+    return data[:,0], data[:,3], data[:,4], data[:,5], data[:,1], data[:,2]
+
+
+def fit_galaxy(neros, galaxy_name, galaxy):
+    """Fits a single galaxy and returns one row of the results table
+
+    Failures are recorded in the 'error' field instead of being raised,
+    so that one bad galaxy doesn't stop a catalog run. If neros has a
+    tracer, the galaxy's trace record is added to the row as 'trace'"""
+
+    return _fit_galaxy_row(neros, galaxy_name, galaxy, neros.fit)
+
+
+def fit_galaxy_multistart(neros, galaxy_name, galaxy):
+    """fit_galaxy, but using Neros.fit_multistart"""
+
+    return _fit_galaxy_row(neros, galaxy_name, galaxy, neros.fit_multistart)
+
+
+def _fit_galaxy_row(neros, galaxy_name, galaxy, fit_method):
+    tracer = neros.tracer
+    if tracer is None:
+        return _fit_row(neros, galaxy_name, galaxy, fit_method)
+
+    with tracer.galaxy(galaxy_name) as record:
+        row = _fit_row(neros, galaxy_name, galaxy, fit_method)
+    row['trace'] = record
+    return row
+
+
+def _fit_row(neros, galaxy_name, galaxy, fit_method):
+    row = dict.fromkeys(FIT_RESULT_COLUMNS, np.nan)
+    row['Galaxy'] = galaxy_name
+    row['error'] = None
+    try:
+        rad, vGas, vDisk, vBulge, vObs, vObsError = galaxy_columns(galaxy)
+        fit_method(rad, vGas, vDisk, vBulge, vObs, vObsError)
+        if neros.tracer is None:
+            row.update(neros.get_fit_results(rad))
+        else:
+            with neros.tracer.stage('results'):
+                row.update(neros.get_fit_results(rad))
+        row.update(neros.fit_info)
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def fit_galaxy_ensemble(ensemble, galaxy_name, galaxy):
+    """Fits a single galaxy against every model in a MilkyWayEnsemble
+    
+    Returns one row per model, like fit_galaxy with an added 'MW'"""
+
+    rows = []
+    try:
+        columns = galaxy_columns(galaxy)
+        results = ensemble.fit(*columns)
+    except Exception as e:
+        results = [e] * len(ensemble)
+
+    for name, result in zip(ensemble.names, results):
+        row = dict.fromkeys(FIT_RESULT_COLUMNS, np.nan)
+        row['MW'] = name
+        row['Galaxy'] = galaxy_name
+        row['error'] = None
+        if isinstance(result, Exception):
+            row['error'] = f"{type(result).__name__}: {result}"
+        else:
+            row.update(result)
+        rows.append(row)
+    return rows
+
+
+def _import_scipy():
+    """Imports what fitting uses from SciPy, so that the first fit (and
+    its time in a trace) doesn't include importing it"""
+
+    import scipy.optimize  # noqa: F401
+
+
+def _init_worker(fitter):
+    global _worker_fitter
+    _worker_fitter = fitter
+    _import_scipy()
+
+
+def _fit_worker(fit_fn, item):
+    galaxy_name, galaxy = item
+    return fit_fn(_worker_fitter, galaxy_name, galaxy)
+
+
+def fit_catalog(catalog, milky_way_data, workers=None, chunksize=None, cache=None,
+                multistart=False, trace=None, v1=DEFAULT_V1, v2=DEFAULT_V2, integration='trapezoid'):
+    """Fits every galaxy in a catalog against one Milky Way model
+
+    Parameters:
+    :catalog: Dictionary of galaxy name -> galaxy data, e.g. from
+              DataAid.GetGalaxyData, or from DataImporter.getGalaxyData
+              called on each file
+    :milky_way_data: Milky Way data, in any form accepted by Neros
+    :workers: Number of worker processes. Defaults to the number of CPUs,
+              1 fits everything in this process
+    :chunksize: Number of galaxies handed to a worker at a time, by default
+                chosen so each worker gets a few chunks
+    :cache: Optional FitCache.FitCache, or the filename of one. Galaxies
+            already in the cache aren't refit, and galaxies with identical
+            data are only fit once. Failed fits aren't cached, so they're
+            tried again on the next run
+    :multistart: Fit each galaxy with Neros.fit_multistart instead of Neros.fit
+    :trace: Optional Trace.Tracer, which gets a record for every galaxy
+            that's fit (not those found in the cache), from all workers
+    :v1:, :v2: The forms of v1 and v2, see Neros.setKernels (to compare
+               several, see KernelComparison.py)
+    :integration: The rule phi is integrated with, 'trapezoid' or 'simpson'
+
+    Returns a Pandas DataFrame with one row per galaxy, in catalog order,
+    with the same columns as the CSV written by Model.ipynb plus 'error',
+    which holds the reason a fit failed (missing for successful fits,
+    so failed fits are df[df['error'].notna()])"""
+
+    import pandas as pd
+
+    # Check the Milky Way data here, rather than once per worker
+    neros = Neros(milky_way_data, v1=v1, v2=v2, integration=integration)
+    if trace is not None:
+        # Every worker records into its own copy, the records come back with the rows
+        import Trace
+        neros.tracer = Trace.Tracer()
+
+    items = list(catalog.items())
+    fit_fn = fit_galaxy_multistart if multistart else fit_galaxy
+
+    if cache is None:
+        rows = _fit_items(neros, items, workers, chunksize, fit_fn)
+        _collect_traces(rows, trace)
+        return pd.DataFrame(rows, columns=FIT_RESULT_COLUMNS)
+
+    import FitCache
+
+    own_cache = isinstance(cache, str)
+    if own_cache:
+        cache = FitCache.FitCache(cache)
+
+    try:
+        mw_hash = FitCache.hashArray(neros.milky_way_data)
+        options = {'method': 'multistart' if multistart else 'fit', 'v1': v1, 'v2': v2,
+                   'integration': integration}
+        keys = [FitCache.cacheKey(_galaxy_hash(galaxy), mw_hash, MODEL_VERSION, options)
+                for _, galaxy in items]
+        results = cache.get_many(keys)
+
+        # Only fit each distinct galaxy once
+        todo = {}
+        for key, item in zip(keys, items):
+            if key not in results and key not in todo:
+                todo[key] = item
+        fitted = _fit_items(neros, list(todo.values()), workers, chunksize, fit_fn)
+        _collect_traces(fitted, trace)
+        new_results = {}
+        for key, row in zip(todo, fitted):
+            del row['Galaxy']
+            new_results[key] = row
+        # A failure may not happen again (maxfev, a worker that was killed)
+        cache.put_many({key: row for key, row in new_results.items() if row['error'] is None})
+        results.update(new_results)
+    finally:
+        if own_cache:
+            cache.close()
+
+    rows = [dict(results[key], Galaxy=name) for key, (name, _) in zip(keys, items)]
+    return pd.DataFrame(rows, columns=FIT_RESULT_COLUMNS)
+
+
+def _collect_traces(rows, trace):
+    """Moves the trace records out of the result rows and into trace"""
+
+    if trace is not None:
+        trace.extend(row.pop('trace') for row in rows if 'trace' in row)
+
+
+def _galaxy_hash(galaxy):
+    """Hash of the columns the fit uses, so the same data in another file or format matches"""
+
+    import FitCache
+
+    try:
+        data = np.asarray(galaxy, dtype=float)[:, :6]
+    except Exception:
+        # This will fail to fit anyway, so any unique key will do
+        return repr(galaxy)
+    return FitCache.hashArray(data)
+
+
+def _fit_items(fitter, items, workers, chunksize, fit_fn=fit_galaxy):
+    """Fits a list of (name, galaxy) pairs, in order, returning the result rows
+    
+    fit_fn(fitter, name, galaxy) is called for each galaxy, in worker
+    processes that each get their own copy of fitter"""
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(items)))
+
+    if workers == 1:
+        if items:
+            _import_scipy()
+        return [fit_fn(fitter, name, galaxy) for name, galaxy in items]
+
+    if chunksize is None:
+        chunksize = max(1, len(items) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(fitter,)) as executor:
+        return list(executor.map(partial(_fit_worker, fit_fn), items, chunksize=chunksize))
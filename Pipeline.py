@@ -0,0 +1,245 @@
+# Streaming catalog fits
+# Model.ipynb (and Neros.fit_catalog) reads a whole catalog into memory,
+# then fits all of it, then writes all of the results. Here the three
+# run at the same time, connected by bounded queues:
+#
+#   loading   galaxy files are read and parsed on a pool of threads, at
+#             most `prefetch` galaxies ahead of the fits
+#   fitting   galaxies go to worker processes as soon as they're read,
+#             with at most `in_flight` fits outstanding
+#   writing   each result is written as soon as its fit finishes
+#
+# so memory use doesn't grow with the size of the catalog, and the
+# first results are written after the first few galaxies, not after
+# the whole catalog has been read:
+#
+#   Pipeline.run(["data/Sparc/Rotmod_LTG/", "data/LittleThings/"], MWXueSofue, "results.csv")
+#
+# Results come out in the order the fits finish, with a Catalog column
+# (the directory name) in front of the usual Neros.fit_catalog columns.
+
+import csv
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from os.path import basename, join, normpath
+
+import numpy as np
+
+import DataAid
+import DataReader
+import Neros
+
+RESULT_COLUMNS = ['Catalog'] + Neros.FIT_RESULT_COLUMNS
+
+# Defaults for the queue sizes
+DEFAULT_PREFETCH = 64
+FITS_PER_WORKER = 4
+
+
+def sourceName(source):
+    """Name of a catalog in the Catalog column, e.g. Rotmod_LTG"""
+
+    if isinstance(source, str):
+        return os.path.splitext(basename(normpath(source)))[0]
+    return getattr(source, 'source', None) or type(source).__name__
+
+
+def loadGalaxies(sources, threads=4, prefetch=DEFAULT_PREFETCH):
+    """Yields (catalog name, galaxy name, galaxy) for every galaxy in the sources, in order
+
+    Parameters:
+    :sources: A list of directories of galaxy files (chosen and named
+              as DataAid.GetGalaxyData does), packed catalog files, or
+              catalogs already in memory (anything with items(), e.g. a
+              GalaxyCatalog), or a single one of these
+    :threads: Number of threads reading and parsing files
+    :prefetch: Most galaxies read ahead of the one last yielded
+
+    Files are read on the threads, so the next galaxies are being read
+    while earlier ones are used. If a file can't be read, its galaxy is
+    the exception instead, which fitGalaxies reports in the error column"""
+
+    if isinstance(sources, str) or hasattr(sources, 'items'):
+        sources = [sources]
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        for source in sources:
+            name = sourceName(source)
+            if isinstance(source, str) and os.path.isdir(source):
+                for fileName in DataAid.listFiles(source):
+                    if len(pending) >= prefetch:
+                        yield pending.popleft().result()
+                    pending.append(executor.submit(_readGalaxy, name, join(source, fileName)))
+            else:
+                if isinstance(source, str):
+                    import CatalogFile
+                    source = CatalogFile.openCatalog(source)
+                # Already in memory (or memory mapped), nothing to read ahead
+                while pending:
+                    yield pending.popleft().result()
+                for galaxy_name, galaxy in source.items():
+                    yield name, galaxy_name, galaxy
+        while pending:
+            yield pending.popleft().result()
+
+
+def galaxyNames(source):
+    """Names of the galaxies in a catalog, as loadGalaxies gives them, without reading any data"""
+
+    if isinstance(source, str) and os.path.isdir(source):
+        return [DataAid.galaxyName(fileName) for fileName in DataAid.listFiles(source)]
+    if isinstance(source, str):
+        import CatalogFile
+        return CatalogFile.openCatalog(source).keys()
+    return list(source.keys())
+
+
+def checkStoreNames(sources):
+    """Raises a ValueError if two of the catalogs have a galaxy with the same name
+
+    A ResultsStore has one row per Milky Way model and galaxy, so the
+    results of one catalog would replace the other's"""
+
+    if isinstance(sources, str) or hasattr(sources, 'items'):
+        sources = [sources]
+
+    seen = {}
+    clashes = []
+    for source in sources:
+        name = sourceName(source)
+        for galaxy_name in galaxyNames(source):
+            other = seen.setdefault(galaxy_name, name)
+            if other != name:
+                clashes.append(f"{galaxy_name} ({other} and {name})")
+    if clashes:
+        more = f" and {len(clashes) - 5} more" if len(clashes) > 5 else ""
+        raise ValueError(f"Galaxies with the same name in different catalogs can't go in one "
+                         f"ResultsStore: {', '.join(clashes[:5])}{more}")
+
+
+def _readGalaxy(catalog_name, path):
+    """(catalog name, galaxy name, data), with the exception in place of the
+    data if the file can't be read, so one bad file doesn't stop the rest"""
+
+    galaxy_name = DataAid.galaxyName(basename(path))
+    try:
+        return catalog_name, galaxy_name, DataReader.readValues(path)
+    except Exception as e:
+        return catalog_name, galaxy_name, e
+
+
+def _failedRow(catalog_name, galaxy_name, error):
+    """A result row for a galaxy that couldn't be read, like Neros.fit_galaxy's for a failed fit"""
+
+    row = dict.fromkeys(Neros.FIT_RESULT_COLUMNS, np.nan)
+    row.update(Galaxy=galaxy_name, error=f"{type(error).__name__}: {error}", Catalog=catalog_name)
+    return row
+
+
+def fitGalaxies(galaxies, milky_way_data, workers=None, in_flight=None, multistart=False, **options):
+    """Fits galaxies as they arrive, yielding result rows as the fits finish
+
+    Parameters:
+    :galaxies: Iterable of (catalog name, galaxy name, galaxy), e.g. from loadGalaxies
+    :milky_way_data: Milky Way data, in any form accepted by Neros
+    :workers: Number of worker processes. Defaults to the number of CPUs,
+              1 fits everything in this process
+    :in_flight: Most galaxies sent to the workers and not yet finished,
+                by default FITS_PER_WORKER per worker
+    :multistart: Fit each galaxy with Neros.fit_multistart
+    :options: v1, v2 or integration for the Neros, see Neros.fit_catalog
+
+    Rows are dictionaries with the RESULT_COLUMNS, like Neros.fit_catalog's
+    rows with the catalog name added. Galaxies that couldn't be read get
+    a row with only the error. They come in the order the fits
+    finish, which for more than one worker isn't the order of the galaxies."""
+
+    neros = Neros.Neros(milky_way_data, **options)
+    fit_fn = Neros.fit_galaxy_multistart if multistart else Neros.fit_galaxy
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        Neros._import_scipy()
+        for catalog_name, galaxy_name, galaxy in galaxies:
+            if isinstance(galaxy, Exception):
+                yield _failedRow(catalog_name, galaxy_name, galaxy)
+            else:
+                yield dict(fit_fn(neros, galaxy_name, galaxy), Catalog=catalog_name)
+        return
+
+    if in_flight is None:
+        in_flight = FITS_PER_WORKER * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=Neros._init_worker,
+                             initargs=(neros,)) as executor:
+        pending = {}
+        for catalog_name, galaxy_name, galaxy in galaxies:
+            if isinstance(galaxy, Exception):
+                yield _failedRow(catalog_name, galaxy_name, galaxy)
+                continue
+            if len(pending) >= in_flight:
+                yield from _finished(pending, FIRST_COMPLETED)
+            future = executor.submit(partial(Neros._fit_worker, fit_fn), (galaxy_name, galaxy))
+            pending[future] = catalog_name
+        while pending:
+            yield from _finished(pending, FIRST_COMPLETED)
+
+
+def _finished(pending, return_when):
+    done, _ = wait(pending, return_when=return_when)
+    for future in done:
+        yield dict(future.result(), Catalog=pending.pop(future))
+
+
+def run(sources, milky_way_data, out, workers=None, threads=4, prefetch=DEFAULT_PREFETCH,
+        in_flight=None, store=None, mw_name=None, flush_every=100, multistart=False, **options):
+    """Reads, fits and writes the results for whole catalogs, all at once
+
+    Parameters:
+    :sources: Catalogs to fit, see loadGalaxies
+    :milky_way_data: Milky Way data, in any form accepted by Neros
+    :out: CSV file for the results, with the RESULT_COLUMNS, written row by row
+    :workers:, :in_flight:, :multistart:, :options: As for fitGalaxies
+    :threads:, :prefetch: As for loadGalaxies
+    :store: Optional ResultsStore (or the filename of one) to also add the results to.
+            Its results are keyed on the galaxy name only, so catalogs that
+            share galaxy names raise a ValueError (see checkStoreNames)
+    :mw_name: Name of the Milky Way model in the store
+    :flush_every: Rows written between flushes of the CSV file
+
+    Returns the number of galaxies fit and the number that failed"""
+
+    if store is not None:
+        checkStoreNames(sources)
+    own_store = isinstance(store, str)
+    if own_store:
+        import ResultsStore
+        store = ResultsStore.ResultsStore(store)
+    if store is not None and mw_name is None:
+        raise ValueError("mw_name is needed to add results to a ResultsStore")
+
+    galaxies = loadGalaxies(sources, threads, prefetch)
+    count = failed = 0
+    try:
+        with open(out, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            for row in fitGalaxies(galaxies, milky_way_data, workers, in_flight, multistart, **options):
+                writer.writerow(row)
+                count += 1
+                if row['error'] is not None:
+                    failed += 1
+                if store is not None:
+                    store.add(mw_name, row)
+                if count % flush_every == 0:
+                    f.flush()
+    finally:
+        galaxies.close()
+        if own_store:
+            store.close()
+        elif store is not None:
+            store.flush()
+    return count, failed
@@ -0,0 +1,193 @@
+# Rotation curve plots for a whole catalog
+# Model.ipynb draws each galaxy's plot inside the fitting loop,
+# with a new figure for every galaxy. Here plotting is a separate
+# stage: the fit results are turned into curves (plain arrays, no
+# matplotlib), and the curves are rendered afterwards, either to
+# one image per galaxy across a pool of worker processes, or to a
+# single multi-page PDF.
+#
+# Each process draws every galaxy on the same figure, only updating
+# the data of the lines, so nothing is rebuilt or leaked per galaxy.
+# matplotlib is only imported by the rendering functions, using the
+# Agg backend so no display is needed.
+
+import os
+from os.path import join
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import Neros
+
+FIGURE_SIZE = (15, 15)
+MED_SIZE = 24
+LG_SIZE = 30
+
+_worker_figure = None
+
+
+def galaxy_curves(neros, galaxy_name):
+    """The curves of the galaxy neros was last fit to, as plotted by Model.ipynb
+
+    Returns a dictionary of Galaxy, chi_squared, rad, vNeros, vLum
+    (scaled by the fit), vObs and vObsError"""
+
+    return {
+        'Galaxy': galaxy_name,
+        'chi_squared': neros.get_chi_squared(),
+        'rad': neros.get_rad(),
+        'vNeros': neros.get_vNeros(),
+        'vLum': neros.get_vLum_scaled(),
+        'vObs': neros.get_vObs(),
+        'vObsError': neros.get_vObsError(),
+    }
+
+
+def curves_from_results(catalog, milky_way_data, results):
+    """Curves for every successfully fit galaxy, without fitting again
+
+    Parameters:
+    :catalog: Dictionary of galaxy name -> galaxy data, as for Neros.fit_catalog
+    :milky_way_data: The Milky Way data the galaxies were fit with
+    :results: The DataFrame from Neros.fit_catalog (or the CSV written by
+              Model.ipynb, read with pandas), with Galaxy, alpha, disk_scale
+              and bulge_scale columns
+
+    Returns a list of dictionaries, as from galaxy_curves, in the order of results"""
+
+    neros = Neros.Neros(milky_way_data)
+    if 'error' in results:
+        results = results[results['error'].isna()]
+
+    curves = []
+    for row in results.itertuples(index=False):
+        problem = neros.prepare(*Neros.galaxy_columns(catalog[row.Galaxy]))
+        # The results have alpha squared and the absolute scales,
+        # the model only depends on their squares anyway
+        params = (np.sqrt(row.alpha), row.disk_scale, row.bulge_scale)
+        vNeros = problem.vNeros(*params)
+        curves.append({
+            'Galaxy': row.Galaxy,
+            'chi_squared': neros.chiSquared(vNeros, problem.vObs, problem.vObsError),
+            'rad': problem.rad,
+            'vNeros': vNeros,
+            'vLum': np.sqrt(problem.vLumSquared(*params[1:])),
+            'vObs': problem.vObs,
+            'vObsError': problem.vObsError,
+        })
+    return curves
+
+
+def render_galaxies(curves, out_dir="graphs", mw_name="", workers=None, fmt="png", dpi=100):
+    """Renders one image per galaxy, named <Galaxy>_<mw_name>.<fmt> as in Model.ipynb
+
+    Parameters:
+    :curves: List of curve dictionaries, from galaxy_curves or curves_from_results
+    :out_dir: Directory to write the images to, created if needed
+    :mw_name: Name of the Milky Way model, for the file names
+    :workers: Number of worker processes, None for the number of CPUs
+    :fmt: Image format, anything matplotlib's savefig accepts
+    :dpi: Resolution of the images
+
+    Returns the list of files written"""
+
+    os.makedirs(out_dir, exist_ok=True)
+    suffix = f"_{mw_name}" if mw_name else ""
+    jobs = [(curve, join(out_dir, f"{curve['Galaxy']}{suffix}.{fmt}"), dpi) for curve in curves]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+
+    if workers == 1:
+        _init_worker()
+        for job in jobs:
+            _render_worker(job)
+    else:
+        chunksize = max(1, len(jobs) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            list(executor.map(_render_worker, jobs, chunksize=chunksize))
+    return [filename for _, filename, _ in jobs]
+
+
+def render_pdf(curves, filename):
+    """Renders every galaxy as one page of a PDF"""
+
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    figure = GalaxyFigure()
+    with PdfPages(filename) as pdf:
+        for curve in curves:
+            figure.draw(curve)
+            pdf.savefig(figure.fig)
+    figure.close()
+
+
+class GalaxyFigure:
+    """One reusable rotation curve figure, in the style of Model.ipynb
+
+    draw(curve) replaces the data shown, so the same figure can be
+    saved once per galaxy"""
+
+    def __init__(self, figsize=FIGURE_SIZE):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        # Figure and FigureCanvasAgg directly, rather than pyplot, so the
+        # figure isn't tracked by pyplot (which keeps every figure alive)
+        # and works the same whatever backend was chosen
+        self.fig = Figure(figsize=figsize)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(1, 1, 1)
+
+        ax = self.ax
+        ax.set_xlabel("radius (kpc)", fontsize=LG_SIZE)
+        ax.set_ylabel("velocity (km/sec)", fontsize=LG_SIZE)
+        ax.tick_params(axis='both', which='major', labelsize=MED_SIZE)
+        ax.tick_params(axis='both', which='minor', labelsize=MED_SIZE)
+
+        self.vNeros_line, = ax.plot([], [], color="red", linewidth=3)
+        self.vLum_line, = ax.plot([], [], color="purple", linewidth=3, linestyle="dashed")
+        self.chi_squared_line, = ax.plot([], [], ' ')
+        # All of the vObs error bars are one collection
+        self.error_bars = ax.vlines([], [], [], linewidth=2)
+
+
+    def draw(self, curve):
+        rad = np.asarray(curve['rad'])
+        vObs = np.asarray(curve['vObs'])
+        vObsError = np.asarray(curve['vObsError'])
+        name = curve['Galaxy']
+
+        self.vNeros_line.set_data(rad, curve['vNeros'])
+        self.vNeros_line.set_label(f"{name}_vNeros")
+        self.vLum_line.set_data(rad, curve['vLum'])
+        self.vLum_line.set_label(f"{name}_new_vLum")
+        self.chi_squared_line.set_label(f"$\\chi^2$ = {curve['chi_squared']}")
+
+        segments = np.empty((len(rad), 2, 2))
+        segments[:, :, 0] = rad[:, np.newaxis]
+        segments[:, 0, 1] = vObs - vObsError
+        segments[:, 1, 1] = vObs + vObsError
+        self.error_bars.set_segments(segments)
+
+        # y-axis scales to the largest of vObs + error and vNeros
+        y_max = max(np.max(vObs + vObsError), np.max(curve['vNeros']))
+        self.ax.relim()
+        self.ax.autoscale_view(scaley=False)
+        self.ax.set_ylim(bottom=0, top=y_max + 15)
+
+
+    def close(self):
+        self.fig.clear()
+
+
+def _init_worker():
+    global _worker_figure
+    _worker_figure = GalaxyFigure()
+
+
+def _render_worker(job):
+    curve, filename, dpi = job
+    _worker_figure.draw(curve)
+    _worker_figure.fig.savefig(filename, dpi=dpi)
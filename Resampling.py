@@ -0,0 +1,221 @@
+# Bootstrap and jackknife uncertainties on fit parameters
+# curve_fit's covariance assumes the errors on vObs are right and
+# Gaussian, which they often aren't. Resampling the data points gives
+# uncertainties that don't depend on that.
+#
+# A replica of a galaxy's data never needs to be prepared again: a
+# bootstrap sample is the original points, each drawn some number of
+# times, and a jackknife sample is the original points with one left
+# out. Both are fit as the original FitProblem with a weight per point
+# (FitProblem.fit(weights=...)), so the galaxy phi, Milky Way phi and
+# trimming are all reused. The weights for a whole batch of replicas
+# are drawn at once, and each replica fit starts from the best fit of
+# the original data, so it converges in a few iterations.
+#
+# Parameters are reported the same way as Neros.get_fit_results:
+# alpha is the "old" alpha (Neros' alpha squared), and the scales are
+# absolute values.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import Neros
+
+PARAMETER_NAMES = ['alpha', 'disk_scale', 'bulge_scale']
+
+# Replica fits start at the best fit, so they don't need as many evaluations
+REPLICA_MAXFEV = 2000
+
+
+def bootstrapWeights(n_points, n_replicas, rng):
+    """How many times each point is drawn in each bootstrap sample, n_replicas x n_points"""
+    return rng.multinomial(n_points, np.full(n_points, 1.0 / n_points), size=n_replicas)
+
+
+def jackknifeWeights(n_points):
+    """Leave-one-out weights, n_points x n_points"""
+    return 1 - np.eye(n_points, dtype=int)
+
+
+def percentileIntervals(replicas, level=95):
+    """Percentile interval of each parameter, ignoring failed (NaN) replicas
+
+    Returns a dictionary of parameter name -> (low, high)"""
+
+    tail = (100 - level) / 2
+    low, high = np.nanpercentile(replicas, [tail, 100 - tail], axis=0)
+    return {name: (float(lo), float(hi)) for name, lo, hi in zip(PARAMETER_NAMES, low, high)}
+
+
+def fitReplicas(problem, weights, p0, maxfev=REPLICA_MAXFEV):
+    """Fits one replica per row of weights, returns replicas x parameters
+
+    Replicas whose fit fails to converge, or that have fewer distinct
+    points than parameters, are NaN"""
+
+    replicas = np.full((len(weights), len(PARAMETER_NAMES)), np.nan)
+    for i, w in enumerate(weights):
+        if np.count_nonzero(w) < len(PARAMETER_NAMES):
+            # Too few distinct points left to fit
+            continue
+        try:
+            fit_vals, _ = problem.fit(p0=p0, maxfev=maxfev, weights=w)
+        except RuntimeError:
+            # maxfev reached
+            continue
+        replicas[i] = _as_results(fit_vals)
+    return replicas
+
+
+def bootstrap(problem, n_replicas=1000, seed=0, level=95, p0=None, workers=1, batch=100):
+    """Bootstrap percentile intervals for one galaxy
+
+    Parameters:
+    :problem: A Neros.FitProblem, from Neros.prepare
+    :n_replicas: Number of bootstrap samples
+    :seed: Seed for the random number generator, the same seed gives the same samples
+    :level: Confidence level of the intervals, in percent
+    :p0: Best fit of the original data, fit here if not given
+    :workers: Number of worker processes, None for the number of CPUs
+    :batch: Number of replicas given to a worker at a time
+
+    Returns a dictionary with
+    :fit_vals: The best fit of the original data
+    :replicas: Array of n_replicas x 3 fit values, NaN where the fit failed
+    :intervals: Dictionary of parameter name -> (low, high)
+    :n_failed: Number of replicas that couldn't be fit"""
+
+    if p0 is None:
+        p0, _ = problem.fit()
+    rng = np.random.default_rng(seed)
+    weights = bootstrapWeights(len(problem.rad), n_replicas, rng)
+    replicas = _fitBatches(problem, weights, p0, workers, batch)
+
+    return {
+        'fit_vals': _as_results(p0),
+        'replicas': replicas,
+        'intervals': percentileIntervals(replicas, level),
+        'n_failed': int(np.isnan(replicas[:, 0]).sum()),
+    }
+
+
+def jackknife(problem, p0=None, workers=1, batch=100):
+    """Leave-one-out jackknife estimates for one galaxy
+
+    Parameters are the same as for bootstrap.
+
+    Returns a dictionary with
+    :fit_vals: The best fit of the original data
+    :replicas: Array of n_points x 3 fit values, NaN where the fit failed
+    :std_error: Dictionary of parameter name -> jackknife standard error
+    :bias: Dictionary of parameter name -> jackknife estimate of the bias
+    :n_failed: Number of replicas that couldn't be fit
+
+    With fewer than two replicas fit, the standard errors and biases are NaN"""
+
+    if p0 is None:
+        p0, _ = problem.fit()
+    replicas = _fitBatches(problem, jackknifeWeights(len(problem.rad)), p0, workers, batch)
+
+    fit_vals = _as_results(p0)
+    n = int(np.sum(~np.isnan(replicas[:, 0])))
+    if n < 2:
+        std_error = bias = np.full(len(PARAMETER_NAMES), np.nan)
+    else:
+        mean = np.nanmean(replicas, axis=0)
+        std_error = np.sqrt((n - 1) / n * np.nansum((replicas - mean)**2, axis=0))
+        bias = (n - 1) * (mean - fit_vals)
+
+    return {
+        'fit_vals': fit_vals,
+        'replicas': replicas,
+        'std_error': dict(zip(PARAMETER_NAMES, std_error.tolist())),
+        'bias': dict(zip(PARAMETER_NAMES, bias.tolist())),
+        'n_failed': int(len(replicas) - n),
+    }
+
+
+def bootstrap_catalog(catalog, milky_way_data, n_replicas=1000, seed=0, level=95,
+                      workers=None, batch=100):
+    """Bootstrap percentile intervals for every galaxy in a catalog
+
+    Parameters:
+    :catalog: Dictionary of galaxy name -> galaxy data, as for Neros.fit_catalog
+    :milky_way_data: Milky Way data, in any form accepted by Neros
+    :n_replicas:, :seed:, :level:, :batch: As for bootstrap. Each galaxy gets
+                                           its own random stream from seed,
+                                           so results don't depend on workers
+    :workers: Number of worker processes, None for the number of CPUs
+
+    Returns a Pandas DataFrame with one row per galaxy: Galaxy, the best
+    fit values, <parameter>_low and <parameter>_high for each parameter,
+    n_failed, and error (why the galaxy couldn't be fit, if it couldn't)"""
+
+    import pandas as pd
+
+    neros = Neros.Neros(milky_way_data)
+    seeds = np.random.SeedSequence(seed).spawn(len(catalog))
+
+    rows, problems, tasks = [], [], []
+    for (name, galaxy), galaxy_seed in zip(catalog.items(), seeds):
+        row = {'Galaxy': name, 'n_failed': np.nan, 'error': None}
+        rows.append(row)
+        try:
+            problem = neros.prepare(*Neros.galaxy_columns(galaxy))
+            p0, _ = problem.fit()
+        except Exception as e:
+            row['error'] = f"{type(e).__name__}: {e}"
+            problems.append(None)
+            continue
+        row.update(zip(PARAMETER_NAMES, _as_results(p0)))
+        problems.append(problem)
+        weights = bootstrapWeights(len(problem.rad), n_replicas, np.random.default_rng(galaxy_seed))
+        tasks.extend((len(rows) - 1, problem, weights[i:i + batch], p0)
+                     for i in range(0, n_replicas, batch))
+
+    blocks = _run(tasks, workers)
+
+    replicas = {}
+    for (i, *_), block in zip(tasks, blocks):
+        replicas.setdefault(i, []).append(block)
+    for i, blocks in replicas.items():
+        galaxy_replicas = np.concatenate(blocks)
+        rows[i]['n_failed'] = int(np.isnan(galaxy_replicas[:, 0]).sum())
+        for name, (low, high) in percentileIntervals(galaxy_replicas, level).items():
+            rows[i][name + '_low'] = low
+            rows[i][name + '_high'] = high
+
+    columns = ['Galaxy'] + PARAMETER_NAMES
+    columns += [name + suffix for name in PARAMETER_NAMES for suffix in ('_low', '_high')]
+    return pd.DataFrame(rows, columns=columns + ['n_failed', 'error'])
+
+
+def _as_results(fit_vals):
+    """Fit values as reported by Neros.get_fit_results"""
+    alpha, disk_scale, bulge_scale = fit_vals
+    return np.array([alpha**2, abs(disk_scale), abs(bulge_scale)])
+
+
+def _fitBatches(problem, weights, p0, workers, batch):
+    tasks = [(0, problem, weights[i:i + batch], p0) for i in range(0, len(weights), batch)]
+    return np.concatenate(_run(tasks, workers))
+
+
+def _run(tasks, workers):
+    """Fits (index, problem, weights, p0) tasks, returning one block of replicas per task"""
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(tasks)))
+
+    if workers == 1:
+        return [_task(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_task, tasks))
+
+
+def _task(task):
+    _, problem, weights, p0 = task
+    return fitReplicas(problem, weights, p0)
@@ -0,0 +1,256 @@
+# Fit results, stored in SQLite
+# Model.ipynb appends one line of text per galaxy to
+# imported-data/data_<MW>.csv, which only has room for a few numbers.
+# A ResultsStore keeps everything a fit produces, for any number
+# of Milky Way models, in one file:
+#
+#   fits    one row per (MW, Galaxy): the values from Neros.get_fit_results,
+#           nfev, fit_time, error, and the 3 x 3 covariance as a blob
+#   curves  one row per (MW, Galaxy): rad, vNeros, vLum (scaled),
+#           vObs and vObsError, each a float64 blob of the galaxy's length
+#
+# Both tables are keyed on (MW, Galaxy), so looking up one galaxy is
+# an index lookup, and reading just the scalars never touches the curves.
+# Rows are buffered and written in batches, one transaction per batch.
+
+import sqlite3
+
+import numpy as np
+
+import Neros
+
+SCALAR_COLUMNS = ['chi_squared', 'alpha', 'disk_scale', 'bulge_scale', 'phi_zero',
+                  'nfev', 'fit_time', 'error']
+CURVE_COLUMNS = ['rad', 'vNeros', 'vLum', 'vObs', 'vObsError']
+
+_SQLITE_MAGIC = b'SQLite format 3\x00'
+
+
+def isResultsStore(filename):
+    """Whether a file is a SQLite database, rather than e.g. a CSV of results"""
+
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(_SQLITE_MAGIC)) == _SQLITE_MAGIC
+    except OSError:
+        return False
+
+
+class ResultsStore:
+    """Fit results for any number of Milky Way models, stored in SQLite
+
+    Create one with ResultsStore(filename); the file is created if it
+    doesn't exist. Add results with add or store_catalog, they're written
+    every batch_size rows and on flush or close. It can be used in a
+    with statement, which closes it at the end.
+
+    Parameters:
+    :filename: The SQLite file
+    :batch_size: Number of rows to buffer before writing"""
+
+    def __init__(self, filename, batch_size=500):
+        self.filename = filename
+        self.batch_size = batch_size
+        self._fits = []
+        # (mw, galaxy) -> curves row, or None to delete that galaxy's curves
+        self._curves = {}
+
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fits (mw TEXT, galaxy TEXT, chi_squared REAL, alpha REAL, "
+            "disk_scale REAL, bulge_scale REAL, phi_zero REAL, nfev INTEGER, fit_time REAL, "
+            "error TEXT, covariance BLOB, PRIMARY KEY (mw, galaxy)) WITHOUT ROWID")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS curves (mw TEXT, galaxy TEXT, rad BLOB, vNeros BLOB, "
+            "vLum BLOB, vObs BLOB, vObsError BLOB, PRIMARY KEY (mw, galaxy)) WITHOUT ROWID")
+        self.connection.commit()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def add(self, mw, row, covariance=None, curves=None):
+        """Adds the results of one fit, replacing any earlier results for the same galaxy and MW
+
+        Parameters:
+        :mw: Name of the Milky Way model
+        :row: Dictionary with Galaxy and any of SCALAR_COLUMNS, e.g. a row
+              from Neros.fit_catalog. covariance and curves can also be
+              given in the row, as from fit_galaxy_details
+        :covariance: Optional covariance of the fit values
+        :curves: Optional dictionary of CURVE_COLUMNS arrays, e.g. from
+                 Plotting.galaxy_curves. Without them, any curves stored
+                 for an earlier fit of the galaxy are deleted"""
+
+        covariance = row.get('covariance', covariance)
+        curves = row.get('curves', curves)
+        self._fits.append([mw, row['Galaxy']] + [_scalar(row.get(x)) for x in SCALAR_COLUMNS]
+                          + [_blob(covariance)])
+        key = (mw, row['Galaxy'])
+        if curves is None:
+            self._curves[key] = None
+        else:
+            self._curves[key] = [mw, row['Galaxy']] + [_blob(curves[x]) for x in CURVE_COLUMNS]
+        if len(self._fits) + len(self._curves) >= self.batch_size:
+            self.flush()
+
+
+    def add_many(self, mw, rows):
+        """add for each row of a list, or of a DataFrame from Neros.fit_catalog"""
+
+        if hasattr(rows, 'to_dict'):
+            rows = rows.to_dict('records')
+        for row in rows:
+            self.add(mw, row)
+
+
+    def flush(self):
+        """Writes any buffered rows"""
+
+        if not (self._fits or self._curves):
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO fits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._fits)
+            self.connection.executemany(
+                "DELETE FROM curves WHERE mw = ? AND galaxy = ?",
+                [key for key, curves in self._curves.items() if curves is None])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO curves VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [curves for curves in self._curves.values() if curves is not None])
+        self._fits = []
+        self._curves = {}
+
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+    def mw_models(self):
+        """Names of the Milky Way models with results"""
+        self.flush()
+        return [x for x, in self.connection.execute("SELECT DISTINCT mw FROM fits ORDER BY mw")]
+
+
+    def galaxies(self, mw):
+        """Names of the galaxies with results for a Milky Way model"""
+        self.flush()
+        return [x for x, in self.connection.execute(
+            "SELECT galaxy FROM fits WHERE mw = ? ORDER BY galaxy", (mw,))]
+
+
+    def results(self, mw=None, columns=None):
+        """The scalar results as a Pandas DataFrame, like the one from Neros.fit_catalog
+
+        Parameters:
+        :mw: Only this Milky Way model, otherwise all of them with an 'MW' column
+        :columns: Only these of SCALAR_COLUMNS (Galaxy is always included)"""
+
+        import pandas as pd
+
+        self.flush()
+        columns = SCALAR_COLUMNS if columns is None else [x for x in columns if x != 'Galaxy']
+        for column in columns:
+            if column not in SCALAR_COLUMNS:
+                raise ValueError(f"Unknown results column {column}")
+        select = ', '.join(columns)
+        if mw is None:
+            query = f"SELECT mw, galaxy, {select} FROM fits ORDER BY mw, galaxy"
+            names = ['MW', 'Galaxy'] + columns
+            rows = self.connection.execute(query).fetchall()
+        else:
+            query = f"SELECT galaxy, {select} FROM fits WHERE mw = ? ORDER BY galaxy"
+            names = ['Galaxy'] + columns
+            rows = self.connection.execute(query, (mw,)).fetchall()
+        return pd.DataFrame(rows, columns=names)
+
+
+    def get(self, mw, galaxy):
+        """The scalar results of one galaxy as a dictionary, raises KeyError if there aren't any"""
+
+        self.flush()
+        row = self.connection.execute(f"SELECT {', '.join(SCALAR_COLUMNS)} FROM fits "
+                                      "WHERE mw = ? AND galaxy = ?", (mw, galaxy)).fetchone()
+        if row is None:
+            raise KeyError((mw, galaxy))
+        return dict(zip(SCALAR_COLUMNS, row), Galaxy=galaxy)
+
+
+    def covariance(self, mw, galaxy):
+        """The covariance of the fit values, 3 x 3, or None if it wasn't stored"""
+
+        self.flush()
+        row = self.connection.execute("SELECT covariance FROM fits WHERE mw = ? AND galaxy = ?",
+                                      (mw, galaxy)).fetchone()
+        if row is None:
+            raise KeyError((mw, galaxy))
+        if row[0] is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float64).reshape(3, 3)
+
+
+    def curves(self, mw, galaxy):
+        """The fitted curves of one galaxy, as a dictionary like Plotting.galaxy_curves"""
+
+        self.flush()
+        row = self.connection.execute(f"SELECT {', '.join(CURVE_COLUMNS)} FROM curves "
+                                      "WHERE mw = ? AND galaxy = ?", (mw, galaxy)).fetchone()
+        if row is None:
+            raise KeyError((mw, galaxy))
+        curves = {name: np.frombuffer(blob, dtype=np.float64) for name, blob in zip(CURVE_COLUMNS, row)}
+        curves['Galaxy'] = galaxy
+        curves['chi_squared'] = self.get(mw, galaxy)['chi_squared']
+        return curves
+
+
+def fit_galaxy_details(neros, galaxy_name, galaxy):
+    """Neros.fit_galaxy, with the covariance and curves of successful fits added to the row"""
+
+    import Plotting
+
+    row = Neros.fit_galaxy(neros, galaxy_name, galaxy)
+    if row['error'] is None:
+        row['covariance'] = neros.fit_covariance
+        row['curves'] = Plotting.galaxy_curves(neros, galaxy_name)
+    return row
+
+
+def store_catalog(store, mw, catalog, milky_way_data, workers=None, chunksize=None):
+    """Fits every galaxy in a catalog, as Neros.fit_catalog does, and stores
+    everything about the fits, including the covariance and curves
+
+    Parameters:
+    :store: A ResultsStore
+    :mw: Name of the Milky Way model, to store the results under
+    :catalog:, :milky_way_data:, :workers:, :chunksize: As for Neros.fit_catalog"""
+
+    neros = Neros.Neros(milky_way_data)
+    rows = Neros._fit_items(neros, list(catalog.items()), workers, chunksize, fit_galaxy_details)
+    for row in rows:
+        store.add(mw, row)
+    store.flush()
+
+
+def _scalar(value):
+    """Values as SQLite takes them, NaN (pandas' missing value) as NULL"""
+
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (np.integer, int)):
+        return int(value)
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def _blob(array):
+    if array is None:
+        return None
+    return np.ascontiguousarray(array, dtype=np.float64).tobytes()
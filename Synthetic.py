@@ -0,0 +1,262 @@
+# Synthetic rotation curve catalogs
+# For testing how the loaders and the fits scale to catalogs much
+# bigger than the ones in data/, and whether the fits get the right
+# answer. Every galaxy gets known fit parameters (alpha, disk_scale,
+# bulge_scale) and smooth gas, disk and bulge curves, and its vObs is
+# vNeros from those against a chosen Milky Way, plus Gaussian noise:
+#
+#   catalog, truth = Synthetic.syntheticCatalog(100000, MWXueSofue, seed=1)
+#   results = Neros.fit_catalog(catalog, MWXueSofue)
+#   Synthetic.checkRecovery(truth, results)
+#
+# The catalog is a GalaxyCatalog in the Sparc column order (Rad Vobs
+# errV Vgas Vdisk Vbul SBdisk SBbul), which writeDirectory writes as
+# Sparc style text files and writeCatalogFile as a CatalogFile.py
+# binary catalog. The same seed always gives the same catalog.
+#
+# The curves are only meant to look like real ones:
+#   disk    an exponential (Freeman) disk with scale length rd
+#   gas     the same, with a longer scale length and lower peak
+#   bulge   a Hernquist sphere with scale a, in some of the galaxies
+# The surface brightnesses are exponential and Hernquist-like profiles
+# that fill out the format, nothing uses them.
+# Galaxies are generated in groups with the same number of points,
+# each group as one set of array operations.
+
+import numpy as np
+
+import GalaxyCatalog
+import Neros
+
+SPARC_COLUMNS = ['Rad', 'Vobs', 'errV', 'Vgas', 'Vdisk', 'Vbul', 'SBdisk', 'SBbul']
+SPARC_UNITS = ['kpc', 'km/s', 'km/s', 'km/s', 'km/s', 'km/s', 'L/pc^2', 'L/pc^2']
+
+# How many times galaxies whose vNeros^2 goes negative are drawn again
+MAX_ATTEMPTS = 10
+
+# Peak of y^2 (I0(y)K0(y) - I1(y)K1(y)), the exponential disk's v^2 shape, at y = 1.075
+_DISK_PEAK = 0.19352270148795297
+
+# The disk shape is tabulated up to this y = rad/(2 rd) (4 is as far as the
+# curves go), at this many points, and interpolated. Bessel functions at
+# every point of 10^5 galaxies take seconds
+_DISK_TABLE_Y = 5.0
+_DISK_TABLE_POINTS = 20001
+_disk_table = None
+
+
+def diskVelocity(rad, rd):
+    """Rotation curve of an exponential disk with scale length rd, with a peak of 1"""
+
+    global _disk_table
+    if _disk_table is None:
+        table_y = np.linspace(0, _DISK_TABLE_Y, _DISK_TABLE_POINTS)
+        _disk_table = (table_y, _diskShape(table_y))
+
+    y = rad / (2*rd)
+    shape = np.interp(y, *_disk_table)
+    beyond = y > _DISK_TABLE_Y
+    if beyond.any():
+        shape[beyond] = _diskShape(y[beyond])
+    return np.sqrt(shape)
+
+
+def _diskShape(y):
+    from scipy.special import i0e, i1e, k0e, k1e
+
+    # I_n(y) K_n(y) = i_ne(y) k_ne(y), the exponential factors cancel
+    with np.errstate(invalid='ignore'):
+        shape = y*y * (i0e(y)*k0e(y) - i1e(y)*k1e(y))
+    return np.maximum(np.nan_to_num(shape), 0) / _DISK_PEAK
+
+
+def bulgeVelocity(rad, a):
+    """Rotation curve of a Hernquist sphere with scale a, with a peak of 1 (at rad = a)"""
+    return np.sqrt(4*rad*a) / (rad + a)
+
+
+def syntheticCatalog(n_galaxies, milky_way_data, seed=0, points=(8, 60), alpha=(0.7, 30.0),
+                     disk_scale=(0.5, 2.0), bulge_scale=(0.5, 1.5), bulge_fraction=0.3,
+                     noise=0.05, error_floor=2.0, neros=None, dtype=np.float64):
+    """A catalog of galaxies with known fit parameters
+
+    Parameters:
+    :n_galaxies: Number of galaxies
+    :milky_way_data: The Milky Way the curves are made against, in any
+                     form accepted by Neros. Every radius is within its range
+    :seed: Seed for the random numbers, the same seed gives the same catalog
+    :points: (fewest, most) points per galaxy
+    :alpha: (lowest, highest) Neros alpha, drawn log-uniformly. Fits report
+            alpha^2 (see Neros.get_fit_results), as does the truth table
+    :disk_scale:, :bulge_scale: (lowest, highest), drawn uniformly
+    :bulge_fraction: Fraction of galaxies with a bulge, the rest have Vbul = 0
+                     and bulge_scale = 1
+    :noise: errV is about this fraction of vObs (between 0.5 and 1.5 times it)
+    :error_floor: Smallest errV, in km/s
+    :neros: Optional Neros to make the curves with, e.g. one with other
+            kernels or integration rule. Otherwise Neros(milky_way_data)
+    :dtype: dtype of the GalaxyCatalog
+
+    Returns the GalaxyCatalog and the truth, a Pandas DataFrame with one
+    row per galaxy: Galaxy, alpha, disk_scale, bulge_scale (in the same
+    form as the columns of Neros.fit_catalog), n_points, rd (kpc),
+    bulge_a (kpc, NaN without a bulge) and distance (Mpc, only for the headers)"""
+
+    import pandas as pd
+
+    if neros is None:
+        neros = Neros.Neros(milky_way_data)
+    rng = np.random.default_rng(seed)
+
+    lengths = rng.integers(points[0], points[1], endpoint=True, size=n_galaxies)
+    offsets = np.zeros(n_galaxies + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    data = np.empty((len(SPARC_COLUMNS), offsets[-1]))
+
+    ranges = {'alpha': alpha, 'disk_scale': disk_scale, 'bulge_scale': bulge_scale}
+    params = _drawParameters(rng, n_galaxies, ranges, bulge_fraction, neros)
+    todo = np.arange(n_galaxies)
+    for _ in range(MAX_ATTEMPTS):
+        bad = []
+        for length in np.unique(lengths[todo]):
+            group = todo[lengths[todo] == length]
+            curves = _curves(neros, {k: v[group] for k, v in params.items()}, length)
+            ok = np.all(curves[1] > 0, axis=1)
+            positions = offsets[group[ok], np.newaxis] + np.arange(length)
+            data[:, positions] = curves[:, ok]
+            bad.append(group[~ok])
+        todo = np.sort(np.concatenate(bad))
+        if len(todo) == 0:
+            break
+        redrawn = _drawParameters(rng, len(todo), ranges, bulge_fraction, neros)
+        for key, values in redrawn.items():
+            params[key][todo] = values
+    else:
+        raise RuntimeError(f"{len(todo)} galaxies still had a negative vNeros^2 "
+                           f"after {MAX_ATTEMPTS} attempts, try a smaller alpha range")
+
+    # Noise, drawn for every point in catalog order, so it doesn't depend on the groups
+    vTrue = data[1]
+    errV = np.maximum(error_floor, noise * vTrue * rng.uniform(0.5, 1.5, len(vTrue)))
+    data[1] = vTrue + errV * rng.standard_normal(len(vTrue))
+    data[2] = errV
+
+    width = len(str(n_galaxies - 1))
+    names = [f"SYN{i:0{width}d}" for i in range(n_galaxies)]
+    catalog = GalaxyCatalog.GalaxyCatalog(names, data, offsets, SPARC_COLUMNS, dtype)
+
+    has_bulge = params['v_bulge'] > 0
+    truth = pd.DataFrame({
+        'Galaxy': names,
+        'alpha': params['alpha']**2,
+        'disk_scale': params['disk_scale'],
+        'bulge_scale': np.where(has_bulge, params['bulge_scale'], 1.0),
+        'n_points': lengths,
+        'rd': params['rd'],
+        'bulge_a': np.where(has_bulge, params['bulge_a'], np.nan),
+        'distance': params['distance'],
+    })
+    return catalog, truth
+
+
+def _drawParameters(rng, n, ranges, bulge_fraction, neros):
+    """Fit parameters and curve shapes for n galaxies"""
+
+    rd = np.clip(np.exp(rng.normal(np.log(3.0), 0.5, n)), 0.5, 15.0)
+    extent = rd * rng.uniform(3.0, 8.0, n)
+    v_disk = np.exp(rng.uniform(np.log(30.0), np.log(250.0), n))
+    has_bulge = rng.uniform(size=n) < bulge_fraction
+    low, high = ranges['alpha']
+    return {
+        'alpha': np.exp(rng.uniform(np.log(low), np.log(high), n)),
+        'disk_scale': rng.uniform(*ranges['disk_scale'], n),
+        'bulge_scale': rng.uniform(*ranges['bulge_scale'], n),
+        'rd': rd,
+        # Radii have to be inside the Milky Way table
+        'extent': np.clip(extent, neros.mw_rad.min() * 100, neros.mw_rad.max()),
+        'v_disk': v_disk,
+        'gas_rd': rd * rng.uniform(1.5, 3.0, n),
+        'v_gas': v_disk * rng.uniform(0.1, 0.6, n),
+        'bulge_a': rd * rng.uniform(0.05, 0.2, n),
+        'v_bulge': np.where(has_bulge, v_disk * rng.uniform(0.5, 1.5, n), 0.0),
+        'distance': np.exp(rng.uniform(np.log(1.0), np.log(100.0), n)),
+    }
+
+
+def _curves(neros, params, length):
+    """Every column of a group of galaxies with the same number of points,
+    (columns x galaxies x points), with the noiseless vNeros as Vobs"""
+
+    column = lambda x: x[:, np.newaxis]
+    rad = column(params['extent']) * (np.arange(1, length + 1) / length)
+    vGas = column(params['v_gas']) * diskVelocity(rad, column(params['gas_rd']))
+    vDisk = column(params['v_disk']) * diskVelocity(rad, column(params['rd']))
+    vBulge = column(params['v_bulge']) * bulgeVelocity(rad, column(params['bulge_a']))
+
+    vLum_squared = neros.vLumSquared(vGas, vDisk, vBulge, column(params['disk_scale']),
+                                     column(params['bulge_scale']))
+    galaxy_phi = Neros.PhiOperator(rad, neros.integration)(vLum_squared)
+    MW_phi = neros.mw_phi_interp(rad)
+    vLCM = neros.vLCM_from_phi(MW_phi, galaxy_phi, np.sqrt(vLum_squared), MW_phi[:, -1:])
+    with np.errstate(invalid='ignore'):
+        vNeros_squared = vLum_squared + column(params['alpha'])**2 * vLCM
+        vObs = np.where(vNeros_squared > 0, np.sqrt(vNeros_squared), np.nan)
+
+    sb_disk = 1000 * (column(params['v_disk']) / 150)**2 * (3 / column(params['rd']))
+    sbDisk = sb_disk * np.exp(-rad / column(params['rd']))
+    sbBulge = np.where(column(params['v_bulge']) > 0,
+                       5000 * (1 + rad / column(params['bulge_a']))**-3, 0.0)
+    errV = np.zeros_like(rad)
+    return np.array([rad, vObs, errV, vGas, vDisk, vBulge, sbDisk, sbBulge])
+
+
+def checkRecovery(truth, results):
+    """How well fits got back the known parameters
+
+    Parameters:
+    :truth: The truth table from syntheticCatalog
+    :results: Fit results for the catalog, e.g. from Neros.fit_catalog
+
+    Returns one row per galaxy with the true and fitted alpha,
+    disk_scale and bulge_scale (alpha_true, alpha_fit, ...), the
+    fitted chi_squared and error, and the relative error of each
+    parameter (alpha_rel_error, ...)"""
+
+    df = truth[['Galaxy', 'alpha', 'disk_scale', 'bulge_scale']].merge(
+        results[['Galaxy', 'alpha', 'disk_scale', 'bulge_scale', 'chi_squared', 'error']],
+        on='Galaxy', suffixes=('_true', '_fit'))
+    for x in ('alpha', 'disk_scale', 'bulge_scale'):
+        df[x + '_rel_error'] = (df[x + '_fit'] - df[x + '_true']) / df[x + '_true']
+    return df
+
+
+def galaxyHeader(distance):
+    """The header lines of a Sparc file"""
+    return [f"# Distance = {distance:.2f} Mpc",
+            "# " + "\t".join(SPARC_COLUMNS),
+            "# " + "\t".join(SPARC_UNITS)]
+
+
+def writeDirectory(catalog, truth, dirRelPath):
+    """Writes a synthetic catalog as one Sparc style text file per galaxy,
+    named <galaxy>.dat, which DataAid.GetGalaxyData reads back"""
+
+    import os
+
+    os.makedirs(dirRelPath, exist_ok=True)
+    distances = dict(zip(truth['Galaxy'], truth['distance']))
+    for name, galaxy in catalog.items():
+        with open(os.path.join(dirRelPath, name + '.dat'), 'w') as f:
+            f.write('\n'.join(galaxyHeader(distances[name])) + '\n')
+            np.savetxt(f, np.asarray(galaxy), fmt='%.6g', delimiter='\t')
+
+
+def writeCatalogFile(catalog, truth, filename, source='synthetic'):
+    """Writes a synthetic catalog as a binary catalog, see CatalogFile.py"""
+
+    import CatalogFile
+
+    distances = dict(zip(truth['Galaxy'], truth['distance']))
+    CatalogFile.writeCatalog(filename, catalog.keys(), [np.asarray(x) for x in catalog.values()],
+                             headers=[galaxyHeader(distances[x]) for x in catalog.keys()],
+                             columns=SPARC_COLUMNS, units=SPARC_UNITS, source=source)
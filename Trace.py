@@ -0,0 +1,171 @@
+# Instrumentation of fits
+# Set neros.tracer = Trace.Tracer() (or pass trace=Tracer() to
+# Neros.fit_catalog) and every fit records, per galaxy:
+#   - the wall time of each stage: prepare (clipping the galaxy,
+#     interpolating the Milky Way phi, the galaxy phi), fit (curve_fit)
+#     and results (get_fit_results)
+#   - the number of model and Jacobian evaluations, including for
+#     fits that fail by reaching maxfev
+#   - whether the fit converged, curve_fit's message, and the norm of
+#     the final residuals (vNeros - vObs)/vObsError
+#
+# With no tracer (the default) Neros only checks "tracer is None",
+# nothing is timed or counted.
+#
+# Records can be looked at as a DataFrame, written as JSON lines, or
+# written in the Chrome trace event format, which chrome://tracing and
+# https://ui.perfetto.dev show as a timeline per process.
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class Tracer:
+    """Collects one record per galaxy fit, in records
+
+    Each record is a dictionary with Galaxy, pid, n_points, stages
+    (stage name -> seconds), events (stage name, start time, seconds),
+    nfev, njev, status ('converged' or 'failed'), message and residual_norm"""
+
+    def __init__(self):
+        self.records = []
+        self._current = None
+
+
+    @contextmanager
+    def galaxy(self, name=None):
+        """Everything recorded inside this goes into one record
+
+        If a record is already open this just adds to it, so
+        fit_galaxy can open a record with the galaxy name and
+        Neros.fit doesn't start a second one"""
+
+        if self._current is not None:
+            yield self._current
+            return
+        self._current = {'Galaxy': name, 'pid': os.getpid(), 'stages': {}, 'events': []}
+        try:
+            yield self._current
+        finally:
+            self.records.append(self._current)
+            self._current = None
+
+
+    @contextmanager
+    def stage(self, name):
+        """Times the code inside, as a stage of the open record"""
+
+        start_time = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            record = self._current
+            if record is not None:
+                record['stages'][name] = record['stages'].get(name, 0.0) + seconds
+                record['events'].append((name, start_time, seconds))
+
+
+    def record(self, **values):
+        """Adds values to the open record"""
+        if self._current is not None:
+            self._current.update(values)
+
+
+    @contextmanager
+    def counting(self, problem):
+        """Counts calls to a FitProblem's curve_fit_fn and curve_fit_jac inside this
+
+        The methods are only wrapped on this problem instance, and put
+        back afterwards. The counts go into the open record as nfev and njev"""
+
+        record = self._current
+        if record is None:
+            yield
+            return
+        record['nfev'] = 0
+        record['njev'] = 0
+        fn, jac = problem.curve_fit_fn, problem.curve_fit_jac
+
+        def counted_fn(*args):
+            record['nfev'] += 1
+            return fn(*args)
+
+        def counted_jac(*args):
+            record['njev'] += 1
+            return jac(*args)
+
+        problem.curve_fit_fn = counted_fn
+        problem.curve_fit_jac = counted_jac
+        try:
+            yield
+        finally:
+            del problem.curve_fit_fn
+            del problem.curve_fit_jac
+
+
+    def extend(self, records):
+        """Adds records collected elsewhere, e.g. in worker processes"""
+        self.records.extend(records)
+
+
+    def toDataFrame(self):
+        """One row per record, with a time_<stage> column per stage and time_total"""
+
+        import pandas as pd
+
+        rows = []
+        for record in self.records:
+            row = {k: v for k, v in record.items() if k not in ('stages', 'events')}
+            for stage, seconds in record['stages'].items():
+                row['time_' + stage] = seconds
+            row['time_total'] = sum(record['stages'].values())
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+
+    def slowest(self, n=10):
+        """The n records that took the longest, as a DataFrame"""
+        df = self.toDataFrame()
+        if df.empty:
+            return df
+        return df.sort_values('time_total', ascending=False).head(n)
+
+
+    def write(self, filename):
+        """Writes the records as JSON lines, one record per line"""
+
+        with open(filename, 'w') as f:
+            for record in self.records:
+                f.write(json.dumps(record, default=_jsonValue) + '\n')
+
+
+    def writeChromeTrace(self, filename):
+        """Writes the stages as a Chrome trace event file"""
+
+        events = []
+        for record in self.records:
+            for stage, start, seconds in record['events']:
+                events.append({
+                    'name': stage,
+                    'cat': 'fit',
+                    'ph': 'X',
+                    'ts': start * 1e6,
+                    'dur': seconds * 1e6,
+                    'pid': record['pid'],
+                    'tid': 0,
+                    'args': {'Galaxy': record['Galaxy']},
+                })
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+
+
+def _jsonValue(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} can't be written to a trace")
@@ -0,0 +1,319 @@
+### Benchmarks for the model and the data loaders
+### to run (from anywhere):
+### python3 benchmarks/run_benchmarks.py
+###
+### Times the hot paths of Neros.py (phi, alone and for 1000 vLums at once,
+### vLCM, curve_fit_fn, chiSquared, a curve_fit step with and without the
+### FitWorkspace, a single fit and a whole catalog fit)
+### and the data loaders, on the real catalogs in data/, on copies of them
+### scaled up, and on Synthetic.py catalogs.
+###
+### Every run is added to benchmarks/history.json. If there's a baseline
+### (saved with --save-baseline, e.g. before starting on a change), any
+### benchmark that got more than --threshold slower is reported as a
+### regression. The SPARC fits are also checked against the reference fit
+### parameters in benchmarks/reference_fits.json, so a faster path that
+### changes the results is caught. The exit code is 1 if anything failed.
+###
+### The reference is regenerated with --update-reference, which should
+### only be done when a change is meant to change the fit results
+### (along with Neros.MODEL_VERSION).
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from os.path import join, dirname, abspath
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import numpy as np
+
+import DataAid
+import DataImporter
+import Neros
+import Synthetic
+
+BENCHMARK_DIR = join(REPO, "benchmarks")
+HISTORY_FILE = join(BENCHMARK_DIR, "history.json")
+BASELINE_FILE = join(BENCHMARK_DIR, "baseline.json")
+REFERENCE_FILE = join(BENCHMARK_DIR, "reference_fits.json")
+
+SPARC_DIR = join(REPO, "data/Sparc/Rotmod_LTG/")
+MILKY_WAY_DIR = join(REPO, "data/XueSofue/")
+EXAMPLE_GALAXY = "NGC2841_rotmod"
+
+# Tolerances for matching the reference fits
+CHI_SQUARED_RTOL = 1e-6
+PARAMETER_RTOL = 1e-4
+PARAMETER_ATOL = 1e-6
+
+
+def timeIt(fn, min_time=0.2, repeat=5):
+    """Best time of one call to fn, in seconds
+
+    fn is called in loops long enough to take about min_time, and
+    the best of repeat loops is used, as timeit does"""
+
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat or number >= 10**6:
+            break
+        number *= 10
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+def denseGalaxy(galaxy, factor):
+    """A galaxy with factor times as many radii, interpolated from a real one"""
+
+    galaxy = np.asarray(galaxy)
+    rad = galaxy[:, 0]
+    new_rad = np.linspace(rad[0], rad[-1], len(rad) * factor)
+    return np.column_stack([np.interp(new_rad, rad, galaxy[:, i]) if i else new_rad
+                            for i in range(galaxy.shape[1])])
+
+
+def scaledCatalogDirectory(source_dir, factor, out_dir):
+    """Copies every galaxy file in source_dir factor times, for timing loaders on bigger catalogs"""
+
+    for fileName in DataAid.getFiles(source_dir):
+        base, ext = os.path.splitext(fileName)
+        for i in range(factor):
+            shutil.copyfile(join(source_dir, fileName), join(out_dir, f"{base}_{i}{ext}"))
+    return out_dir
+
+
+def modelBenchmarks(neros, galaxies, quick):
+    """Timings of the Neros hot paths"""
+
+    results = {}
+    galaxy = np.asarray(galaxies[EXAMPLE_GALAXY])
+    rad, vGas, vDisk, vBulge, vObs, vObsError = Neros.galaxy_columns(galaxy)
+    neros.fit(rad, vGas, vDisk, vBulge, vObs, vObsError)
+    trimmed = [neros.rad, neros.vGas, neros.vDisk, neros.vBulge]
+    vLum = neros.get_vLum_scaled()
+    params = [neros.best_fit_values[x] for x in ('alpha', 'disk_scale', 'bulge_scale')]
+    vNeros = neros.get_vNeros()
+
+    results['phi'] = timeIt(lambda: neros.phi(trimmed[0], vLum))
+    results['vLCM'] = timeIt(lambda: neros.vLCM(trimmed[0], vLum))
+    results['curve_fit_fn'] = timeIt(lambda: neros.curve_fit_fn(trimmed, *params))
+    results['chiSquared'] = timeIt(lambda: neros.chiSquared(vNeros, neros.vObs, neros.vObsError))
+    results['fit'] = timeIt(lambda: neros.fit(rad, vGas, vDisk, vBulge, vObs, vObsError))
+
+    # One step of curve_fit: the model then the Jacobian at a new point, in the
+    # FitWorkspace and step by step with the Neros methods
+    problem = neros.prepare(rad, vGas, vDisk, vBulge, vObs, vObsError)
+    points = itertools.cycle([params, [params[0], params[1] * (1 + 1e-6), params[2]]])
+    for name, vNeros_fn, jacobian_fn in (('fit_step', problem.vNeros, problem.jacobian),
+                                         ('fit_step_reference', problem.reference_vNeros,
+                                          problem.reference_jacobian)):
+        def step():
+            point = next(points)
+            vNeros_fn(*point)
+            jacobian_fn(*point)
+        results[name] = timeIt(step)
+
+    # Many potentials over the same radii in one call, as in bootstraps and grid scans
+    scales = np.random.default_rng(0).uniform(0.5, 2.0, (1000, 1))
+    many_vLum = scales * vLum
+    results['phi_batch_1000'] = timeIt(lambda: neros.phi(trimmed[0], many_vLum))
+
+    # The same galaxy with many more radii, to see how things scale
+    for factor in ((10,) if quick else (10, 100)):
+        dense = denseGalaxy(galaxy, factor)
+        dense = dense[dense[:, 0] <= neros.mw_rad[-1]]
+        rad, vGas, vDisk, vBulge = dense[:, 0], dense[:, 3], dense[:, 4], dense[:, 5]
+        vLum = np.sqrt(neros.vLumSquared(vGas, vDisk, vBulge))
+        results[f'phi_x{factor}'] = timeIt(lambda: neros.phi(rad, vLum))
+        results[f'vLCM_x{factor}'] = timeIt(lambda: neros.vLCM(rad, vLum))
+        results[f'curve_fit_fn_x{factor}'] = timeIt(
+            lambda: neros.curve_fit_fn([rad, vGas, vDisk, vBulge], *params))
+
+    return results
+
+
+def loaderBenchmarks(quick):
+    """Timings of DataAid.GetGalaxyData and DataImporter.getGalaxyData"""
+
+    results = {}
+    files = sorted(DataAid.getFiles(SPARC_DIR))
+    results['GetGalaxyData_sparc'] = timeIt(lambda: DataAid.GetGalaxyData(SPARC_DIR), repeat=3)
+    results['getGalaxyData_file'] = timeIt(lambda: DataImporter.getGalaxyData(join(SPARC_DIR, files[0])))
+    results['getGalaxyData_sparc'] = timeIt(
+        lambda: [DataImporter.getGalaxyData(join(SPARC_DIR, x)) for x in files], repeat=3)
+
+    for factor in ((4,) if quick else (4, 16)):
+        with tempfile.TemporaryDirectory() as tmp:
+            scaledCatalogDirectory(SPARC_DIR, factor, tmp)
+            results[f'GetGalaxyData_sparc_x{factor}'] = timeIt(
+                lambda: DataAid.GetGalaxyData(tmp + os.sep), min_time=0, repeat=3)
+
+    # Synthetic catalogs, bigger than any real one
+    milky_way_data = np.array(DataAid.GetGalaxyData(MILKY_WAY_DIR)['MW_lum'])
+    for n in ((2000,) if quick else (2000, 20000)):
+        catalog, truth = Synthetic.syntheticCatalog(n, milky_way_data, seed=0)
+        with tempfile.TemporaryDirectory() as tmp:
+            Synthetic.writeDirectory(catalog, truth, tmp)
+            results[f'GetGalaxyData_synthetic_{n}'] = timeIt(
+                lambda: DataAid.GetGalaxyData(tmp + os.sep), min_time=0, repeat=3)
+
+    return results
+
+
+def catalogFit(galaxies, milky_way_data):
+    """Fits the whole catalog in this process, returns the results and time taken"""
+
+    start = time.perf_counter()
+    df = Neros.fit_catalog(galaxies, milky_way_data, workers=1)
+    return df, time.perf_counter() - start
+
+
+def referenceFits(df):
+    """Fit results in the form stored in REFERENCE_FILE"""
+
+    reference = {}
+    for row in df.to_dict('records'):
+        if isinstance(row['error'], str):
+            reference[row['Galaxy']] = {'error': row['error']}
+        else:
+            reference[row['Galaxy']] = {x: row[x] for x in ('chi_squared', 'alpha', 'disk_scale', 'bulge_scale')}
+    return reference
+
+
+def checkReference(df, reference):
+    """Differences between fit results and the reference, as a list of messages"""
+
+    problems = []
+    results = referenceFits(df)
+    for name in sorted(set(reference) | set(results)):
+        ref, new = reference.get(name), results.get(name)
+        if ref is None or new is None:
+            problems.append(f"{name}: {'not in the reference' if ref is None else 'missing from the fit'}")
+        elif ('error' in ref) != ('error' in new):
+            problems.append(f"{name}: {'now fails' if 'error' in new else 'no longer fails'}")
+        elif 'error' not in ref:
+            if not np.isclose(new['chi_squared'], ref['chi_squared'], rtol=CHI_SQUARED_RTOL, atol=0):
+                problems.append(f"{name}: chi_squared {new['chi_squared']} != {ref['chi_squared']}")
+            for x in ('alpha', 'disk_scale', 'bulge_scale'):
+                if not np.isclose(new[x], ref[x], rtol=PARAMETER_RTOL, atol=PARAMETER_ATOL):
+                    problems.append(f"{name}: {x} {new[x]} != {ref[x]}")
+    return problems
+
+
+def compareBaseline(results, baseline, threshold):
+    """Benchmarks more than threshold (a fraction) slower than the baseline"""
+
+    regressions = []
+    for name, seconds in results.items():
+        if name in baseline and seconds > baseline[name] * (1 + threshold):
+            regressions.append(f"{name}: {seconds:.3g} s vs {baseline[name]:.3g} s "
+                               f"({seconds / baseline[name]:.2f}x)")
+    return regressions
+
+
+def runInfo():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.node(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the model and the data loaders")
+    parser.add_argument("--quick", action="store_true", help="fewer and smaller synthetic catalogs")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown vs the baseline reported as a regression (default 0.2 = 20%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="save this run as the baseline")
+    parser.add_argument("--update-reference", action="store_true",
+                        help="save this run's fits as the reference fit parameters")
+    parser.add_argument("--no-history", action="store_true", help="don't add this run to the history")
+    args = parser.parse_args()
+
+    warnings.filterwarnings('ignore')
+
+    galaxies = DataAid.GetGalaxyData(SPARC_DIR)
+    milky_way_data = np.array(DataAid.GetGalaxyData(MILKY_WAY_DIR)['MW_lum'])
+    neros = Neros.Neros(milky_way_data)
+
+    results = {}
+    results.update(modelBenchmarks(neros, galaxies, args.quick))
+    results.update(loaderBenchmarks(args.quick))
+    df, results['fit_catalog_sparc'] = catalogFit(galaxies, milky_way_data)
+
+    for name, seconds in results.items():
+        print(f"{name:32s} {seconds * 1e3:12.4f} ms")
+
+    failed = False
+
+    if args.update_reference:
+        with open(REFERENCE_FILE, 'w') as f:
+            json.dump(referenceFits(df), f, indent=1, sort_keys=True)
+        print(f"Saved the reference fits to {REFERENCE_FILE}")
+    elif os.path.exists(REFERENCE_FILE):
+        with open(REFERENCE_FILE) as f:
+            problems = checkReference(df, json.load(f))
+        if problems:
+            failed = True
+            print(f"\n{len(problems)} differences from the reference fits:")
+            for problem in problems:
+                print("  " + problem)
+        else:
+            print("\nFits match the reference")
+
+    if os.path.exists(BASELINE_FILE) and not args.save_baseline:
+        with open(BASELINE_FILE) as f:
+            regressions = compareBaseline(results, json.load(f)['results'], args.threshold)
+        if regressions:
+            failed = True
+            print(f"\n{len(regressions)} regressions against the baseline:")
+            for regression in regressions:
+                print("  " + regression)
+        else:
+            print("No regressions against the baseline")
+
+    run = dict(runInfo(), results=results)
+    if args.save_baseline:
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(run, f, indent=1)
+        print(f"Saved the baseline to {BASELINE_FILE}")
+    if not args.no_history:
+        history = []
+        if os.path.exists(HISTORY_FILE):
+            with open(HISTORY_FILE) as f:
+                history = json.load(f)
+        history.append(run)
+        with open(HISTORY_FILE, 'w') as f:
+            json.dump(history, f, indent=1)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+# alpha (y), L/Reff (x), for every set of fits at once
+# alpha_correlation_plots.py fits alpha = A (L/R)^k to one fit file at a
+# time. This fits it to every set of fits (every Milky Way model of every
+# catalog) in one go, with bootstrap intervals on k and A:
+#
+#   python alpha_correlation_batch.py ../results.sqlite ../results/*.csv --out alpha_correlations.csv
+#
+# or from Python
+#
+#   table = alpha_correlations(["../results.sqlite"], "../data/L_Reff_ratio.txt")
+#
+# A set of fits is one (MW, Catalog) pair. ResultsStore files give a set
+# per Milky Way model; CSVs use their MW and Catalog columns when they
+# have them (as Pipeline.run writes), otherwise the file name is the MW.
+#
+# Galaxies are matched to the L/Reff table through a RatioIndex, built
+# once. Every set's alphas then go in one sets x galaxies array (NaN
+# where a set doesn't have a galaxy), and all of the log-log fits are a
+# few sums over that array. Each set's bootstrap replicas are one matrix
+# product with the resampling weights, with the sets across worker processes.
+
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import DataReader
+import Resampling
+
+DEFAULT_RATIOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'L_Reff_ratio.txt')
+
+RESULT_COLUMNS = ['MW', 'Catalog', 'n', 'k', 'A', 'r_squared', 'k_stderr',
+                  'k_low', 'k_high', 'A_low', 'A_high']
+
+# Most replicas x galaxies values in memory at a time, per set
+_BATCH_VALUES = 1 << 22
+
+
+def canonicalName(name):
+    """Galaxy name without the "-Copy1" that some copied data files have"""
+    return re.sub(r'-Copy\d*$', '', name)
+
+
+class RatioIndex:
+    """The L/Reff table, indexed by galaxy name
+
+    Parameters:
+    :ratios: Dictionary of galaxy name -> L/Reff, e.g. from DataReader.readLuminosityRatios
+
+    Galaxies are looked up by name, or failing that by canonicalName"""
+
+    def __init__(self, ratios):
+        self.names = list(ratios)
+        self.log_ratios = np.log(np.array([ratios[x] for x in self.names], dtype=float))
+        self._index = {}
+        for i, name in enumerate(self.names):
+            self._index.setdefault(canonicalName(name), i)
+        self._index.update((name, i) for i, name in enumerate(self.names))
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    def positions(self, names):
+        """Position of each galaxy in the table, -1 for galaxies that aren't in it"""
+
+        index = self._index
+        return np.array([index.get(x, index.get(canonicalName(x), -1)) for x in names], dtype=np.int64)
+
+
+def loadFitSets(sources):
+    """Every set of fits in the sources, as one Pandas DataFrame with MW, Catalog, Galaxy and alpha
+
+    Parameters:
+    :sources: ResultsStore files and CSVs of fit results (from fit_catalog,
+              rcfm.py or Pipeline.run), or a single one
+
+    Only fits with a positive alpha are kept. The Catalog of a
+    ResultsStore is its file name, the MW of a CSV without an MW column
+    is its file name, and the Catalog of one without a Catalog column is blank."""
+
+    import pandas as pd
+
+    import ResultsStore
+
+    if isinstance(sources, str):
+        sources = [sources]
+
+    frames = []
+    for source in sources:
+        name = os.path.splitext(os.path.basename(source))[0]
+        if ResultsStore.isResultsStore(source):
+            with ResultsStore.ResultsStore(source) as store:
+                df = store.results(columns=['alpha', 'error'])
+            df['Catalog'] = name
+        else:
+            df = pd.read_csv(source)
+            if 'MW' not in df:
+                df['MW'] = name
+            if 'Catalog' not in df:
+                df['Catalog'] = ''
+        if 'error' in df:
+            df = df[df['error'].isna()]
+        frames.append(df[['MW', 'Catalog', 'Galaxy', 'alpha']])
+
+    fits = pd.concat(frames, ignore_index=True)
+    fits = fits[np.isfinite(fits['alpha']) & (fits['alpha'] > 0)]
+    return fits.reset_index(drop=True)
+
+
+def alphaMatrix(fits, index):
+    """The log alphas of every set, matched to the L/Reff table
+
+    Parameters:
+    :fits: DataFrame with MW, Catalog, Galaxy and alpha, e.g. from loadFitSets
+    :index: A RatioIndex
+
+    Returns the (MW, Catalog) of each set, and a sets x len(index) array
+    of log alpha, NaN where a set has no fit for a galaxy. Galaxies that
+    aren't in the table are left out"""
+
+    import pandas as pd
+
+    positions = index.positions(fits['Galaxy'])
+    fits = fits[positions >= 0]
+    positions = positions[positions >= 0]
+
+    codes, sets = pd.factorize(pd.MultiIndex.from_frame(fits[['MW', 'Catalog']]))
+    log_alpha = np.full((len(sets), len(index)), np.nan)
+    # A galaxy in a set twice (e.g. a copy of it) keeps its first fit
+    log_alpha[codes[::-1], positions[::-1]] = np.log(fits['alpha'].to_numpy(dtype=float)[::-1])
+    return list(sets), log_alpha
+
+
+def powerLawFits(log_x, log_y, weights=None):
+    """Least squares fits of log y = k log x + log A, one per row of log_y
+
+    Parameters:
+    :log_x: log L/Reff of each galaxy
+    :log_y: rows x galaxies log alpha, NaN for galaxies to leave out of a row
+    :weights: Optional rows x galaxies number of times each galaxy is
+              counted (e.g. bootstrap weights), 1 otherwise
+
+    Returns a dictionary of arrays with a value per row: n, k, A,
+    r_squared and k_stderr, the same as scipy.stats.linregress gives
+    (with k the slope, A the exponential of the intercept, and
+    k_stderr its stderr). Rows with fewer than two distinct x are NaN"""
+
+    log_y = np.atleast_2d(log_y)
+    present = ~np.isnan(log_y)
+    w = present.astype(float) if weights is None else np.where(present, weights, 0.0)
+    y = np.where(present, log_y, 0.0)
+    x = np.broadcast_to(log_x, y.shape)
+
+    n = w.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = (w*x).sum(axis=1) / n
+        y_mean = (w*y).sum(axis=1) / n
+        dx = np.where(present, x - x_mean[:, np.newaxis], 0.0)
+        dy = np.where(present, y - y_mean[:, np.newaxis], 0.0)
+        sxx = (w*dx*dx).sum(axis=1)
+        sxy = (w*dx*dy).sum(axis=1)
+        syy = (w*dy*dy).sum(axis=1)
+
+        k = sxy / sxx
+        r = np.clip(sxy / np.sqrt(sxx*syy), -1, 1)
+        k_stderr = np.sqrt((1 - r*r) * syy / sxx / (n - 2))
+    k[sxx <= 0] = np.nan
+    return {'n': n, 'k': k, 'A': np.exp(y_mean - k*x_mean), 'r_squared': r*r, 'k_stderr': k_stderr}
+
+
+def bootstrapPowerLaw(log_x, log_y, n_replicas=1000, seed=0, level=95):
+    """Bootstrap percentile intervals on k and A for one set of galaxies
+
+    Parameters:
+    :log_x:, :log_y: log L/Reff and log alpha of the set's galaxies
+    :n_replicas: Number of bootstrap samples
+    :seed: Random seed, or a numpy SeedSequence
+    :level: Confidence level in percent
+
+    Returns a dictionary with k_low, k_high, A_low and A_high. Samples
+    that don't have two distinct galaxies are left out"""
+
+    rng = np.random.default_rng(seed)
+    n = len(log_x)
+    batch = max(1, _BATCH_VALUES // max(n, 1))
+    k, A = [], []
+    for first in range(0, n_replicas, batch):
+        weights = Resampling.bootstrapWeights(n, min(batch, n_replicas - first), rng)
+        fits = powerLawFits(log_x, np.broadcast_to(log_y, weights.shape), weights)
+        k.append(fits['k'])
+        A.append(fits['A'])
+
+    tail = (100 - level) / 2
+    intervals = {}
+    for name, replicas in (('k', np.concatenate(k)), ('A', np.concatenate(A))):
+        if np.isnan(replicas).all():
+            low = high = np.nan
+        else:
+            low, high = np.nanpercentile(replicas, [tail, 100 - tail])
+        intervals[name + '_low'] = float(low)
+        intervals[name + '_high'] = float(high)
+    return intervals
+
+
+def _bootstrapTask(task):
+    return bootstrapPowerLaw(*task)
+
+
+def alpha_correlations(sources, ratios=DEFAULT_RATIOS, n_replicas=1000, seed=0, level=95, workers=None):
+    """Fits alpha = A (L/R)^k to every set of fits in the sources
+
+    Parameters:
+    :sources: ResultsStore files and CSVs of fit results, see loadFitSets,
+              or a DataFrame like the one loadFitSets returns
+    :ratios: The L/Reff table file, or a dictionary of galaxy name -> L/Reff
+    :n_replicas: Bootstrap samples per set, 0 for no intervals
+    :seed: Random seed. Each set gets its own random stream from it,
+           so results don't depend on workers
+    :level: Confidence level of the intervals, in percent
+    :workers: Number of worker processes for the bootstrap, None for the number of CPUs
+
+    Returns a Pandas DataFrame with a row per set and the RESULT_COLUMNS"""
+
+    import pandas as pd
+
+    if isinstance(ratios, str):
+        ratios = DataReader.readLuminosityRatios(ratios)
+    index = RatioIndex(ratios)
+    fits = sources if isinstance(sources, pd.DataFrame) else loadFitSets(sources)
+    sets, log_alpha = alphaMatrix(fits, index)
+
+    table = pd.DataFrame(sets, columns=['MW', 'Catalog'])
+    for name, values in powerLawFits(index.log_ratios, log_alpha).items():
+        table[name] = values
+    table['n'] = table['n'].astype(int)
+
+    tasks = []
+    if n_replicas:
+        seeds = np.random.SeedSequence(seed).spawn(len(sets))
+        for row, set_seed in zip(log_alpha, seeds):
+            present = ~np.isnan(row)
+            tasks.append((index.log_ratios[present], row[present], n_replicas, set_seed, level))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(tasks)))
+    if workers == 1:
+        intervals = [_bootstrapTask(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            intervals = list(executor.map(_bootstrapTask, tasks))
+
+    for name in RESULT_COLUMNS[-4:]:
+        table[name] = [x[name] for x in intervals] if intervals else np.nan
+    return table[RESULT_COLUMNS]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="alpha = A (L/R)^k for every set of fits, with bootstrap intervals")
+    parser.add_argument("sources", nargs="+", help="ResultsStore files and CSVs of fit results")
+    parser.add_argument("--ratios", default=DEFAULT_RATIOS, help="L/Reff table (default: data/L_Reff_ratio.txt)")
+    parser.add_argument("--replicas", type=int, default=1000, help="bootstrap samples per set (default: 1000)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument("--level", type=float, default=95, help="confidence level in percent (default: 95)")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--out", help="also write the table to this CSV")
+    args = parser.parse_args()
+
+    table = alpha_correlations(args.sources, args.ratios, args.replicas, args.seed, args.level, args.workers)
+    print(table.to_string(index=False))
+    if args.out:
+        table.to_csv(args.out, index=False)
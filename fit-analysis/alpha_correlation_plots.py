@@ -3,11 +3,30 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.stats import linregress
 import numpy as np
-plt.style.use('../mplstyles/standard.mplstyle')
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+plt.style.use(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mplstyles', 'standard.mplstyle'))
 
-def make_alpha_correlation_plots(fit_filename, luminosity_filename, legend_text, output_filename):
+def read_fit_results(fit_filename, mw=None):
+    import ResultsStore
+
+    if not ResultsStore.isResultsStore(fit_filename):
+        return pd.read_csv(fit_filename)
+    with ResultsStore.ResultsStore(fit_filename) as store:
+        if mw is None:
+            models = store.mw_models()
+            if len(models) > 1:
+                # Fits against different Milky Ways don't belong in one regression
+                raise ValueError(f"{fit_filename} has fits for several Milky Way models, "
+                                 f"pick one with mw: {', '.join(models)}")
+        return store.results(mw, columns=['alpha']).dropna()
+
+def make_alpha_correlation_plots(fit_filename, luminosity_filename, legend_text, output_filename, mw=None):
+    # fit_filename is either a CSV of fit results, or a ResultsStore
+    # file, in which case mw is the Milky Way model to use
     df_lum = pd.read_csv(luminosity_filename, sep="\t", skiprows=1)
-    df_fit = pd.read_csv(fit_filename)
+    df_fit = read_fit_results(fit_filename, mw)
     
     merged = df_lum.merge(df_fit, on="Galaxy")
 
@@ -0,0 +1,356 @@
+# Command line runner
+# Does what Model.ipynb does, and runs the other tools, without
+# editing notebook cells:
+#
+#   python rcfm.py fit --catalog data/Sparc/Rotmod_LTG --mw data/XueSofue/MW_lum.dat --workers 16 --out results
+#   python rcfm.py plot --catalog data/Sparc/Rotmod_LTG --mw data/XueSofue/MW_lum.dat --results results/Rotmod_LTG_MW_lum.csv --out graphs
+#   python rcfm.py bootstrap --catalog ... --mw ... --replicas 1000 --out results
+#   python rcfm.py joint --catalog ... --mw ... --ratios data/L_Reff_ratio.txt --out results
+#   python rcfm.py kernels --catalog ... --mw ... --v1 sinh cosh --out results
+#   python rcfm.py stream --catalog data/Sparc/Rotmod_LTG data/LittleThings --mw ... --out results.csv
+#   python rcfm.py pack data/Sparc/Rotmod_LTG sparc.rcat
+#   python rcfm.py synthetic --galaxies 100000 --mw data/XueSofue/MW_lum.dat --out synthetic.rcat
+#
+# --catalog is either a directory of galaxy files or a catalog packed
+# with "pack" (or CatalogFile.py). Run any command with --help for all
+# of its options.
+#
+# Only the standard library is imported up front. Each command imports
+# NumPy, SciPy, Pandas or matplotlib when it runs, so --help and small
+# tasks start quickly. For cluster array jobs, --shard i/n works on
+# every n-th galaxy starting from the i-th (counting from 0), and
+# writes its own output file.
+
+import argparse
+import os
+import sys
+from os.path import basename, join, splitext, isfile
+
+
+def loadCatalog(path):
+    """A directory of galaxy files, or a packed catalog file, as a galaxy name -> data dictionary"""
+
+    if not os.path.exists(path):
+        raise SystemExit(f"No catalog at {path}")
+    if isfile(path):
+        import CatalogFile
+        return CatalogFile.openCatalog(path)
+
+    import DataAid
+    return DataAid.GetGalaxyData(join(path, ''))
+
+
+def loadMilkyWay(path):
+    if not isfile(path):
+        raise SystemExit(f"No Milky Way data file at {path}")
+    import DataReader
+    return DataReader.readValues(path)[:, :2]
+
+
+def name(path):
+    """The name of a catalog or Milky Way, from its path"""
+    return splitext(basename(os.path.normpath(path)))[0]
+
+
+def parseShard(spec):
+    """(i, n) from "i/n", checked before anything is loaded"""
+
+    try:
+        index, count = (int(x) for x in spec.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must look like i/n, not {spec}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"{spec}: i must be from 0 to n-1")
+    return index, count
+
+
+def shard(catalog, spec):
+    """The part of the catalog for shard (i, n), or the whole catalog if spec is None"""
+
+    if spec is None:
+        return catalog, ""
+    index, count = spec
+    names = list(catalog.keys())[index::count]
+    return {x: catalog[x] for x in names}, f"_shard{index}of{count}"
+
+
+def outputFile(args, kind, suffix, extension=".csv"):
+    os.makedirs(args.out, exist_ok=True)
+    return join(args.out, f"{kind}{name(args.catalog)}_{args.mw_name}{suffix}{extension}")
+
+
+def checkKernels(args):
+    """Exits with a usage error if --v1 or --v2 isn't a known form, before anything is loaded"""
+
+    import Neros
+
+    for option, value, kernels in (("--v1", args.v1, Neros.V1_KERNELS), ("--v2", args.v2, Neros.V2_KERNELS)):
+        if value not in kernels:
+            raise SystemExit(f"rcfm.py {args.command}: error: argument {option}: invalid choice: {value!r} "
+                             f"(choose from {', '.join(sorted(kernels))})")
+
+
+def fitCommand(args):
+    import Neros
+
+    checkKernels(args)
+    catalog, suffix = shard(loadCatalog(args.catalog), args.shard)
+    milky_way = loadMilkyWay(args.mw)
+
+    trace = None
+    if args.trace:
+        import Trace
+        trace = Trace.Tracer()
+
+    df = Neros.fit_catalog(catalog, milky_way, workers=args.workers, chunksize=args.chunksize,
+                           cache=args.cache, multistart=args.multistart, trace=trace,
+                           v1=args.v1, v2=args.v2)
+
+    out_file = outputFile(args, "", suffix)
+    df.to_csv(out_file, index=False)
+    failed = df['error'].notna().sum()
+    print(f"Fit {len(df) - failed} of {len(df)} galaxies against {args.mw_name}, results in {out_file}")
+    if failed:
+        print(f"{failed} fits failed, see the error column")
+
+    if args.store:
+        import ResultsStore
+        with ResultsStore.ResultsStore(args.store) as store:
+            store.add_many(args.mw_name, df)
+        print(f"Results stored in {args.store} as {args.mw_name}")
+
+    if trace is not None:
+        trace.write(args.trace)
+        print(f"Trace written to {args.trace}")
+
+
+def plotCommand(args):
+    import pandas as pd
+
+    import Plotting
+    import ResultsStore
+
+    catalog = loadCatalog(args.catalog)
+    if ResultsStore.isResultsStore(args.results):
+        with ResultsStore.ResultsStore(args.results) as store:
+            results = store.results(args.mw_name)
+    else:
+        results = pd.read_csv(args.results)
+
+    curves = Plotting.curves_from_results(catalog, loadMilkyWay(args.mw), results)
+    if args.pdf:
+        Plotting.render_pdf(curves, args.pdf)
+        print(f"Plotted {len(curves)} galaxies to {args.pdf}")
+    else:
+        files = Plotting.render_galaxies(curves, args.out, args.mw_name, workers=args.workers)
+        print(f"Plotted {len(files)} galaxies to {args.out}")
+
+
+def bootstrapCommand(args):
+    import Resampling
+
+    catalog, suffix = shard(loadCatalog(args.catalog), args.shard)
+    df = Resampling.bootstrap_catalog(catalog, loadMilkyWay(args.mw), n_replicas=args.replicas,
+                                      seed=args.seed, level=args.level, workers=args.workers)
+    out_file = outputFile(args, "bootstrap_", suffix)
+    df.to_csv(out_file, index=False)
+    print(f"{args.level}% intervals from {args.replicas} replicas written to {out_file}")
+
+
+def jointCommand(args):
+    import DataReader
+    import JointFit
+
+    result = JointFit.fit_joint(loadCatalog(args.catalog), loadMilkyWay(args.mw),
+                                DataReader.readLuminosityRatios(args.ratios))
+    out_file = outputFile(args, "joint_", "")
+    result['galaxies'].to_csv(out_file, index=False)
+    print(f"alpha = {result['A']:.6g} (L/R)^{result['k']:.6g}, reduced chi^2 = {result['chi_squared']:.6g}")
+    print(f"{result['message']}")
+    for galaxy, reason in result['skipped'].items():
+        print(f"Skipped {galaxy}: {reason}")
+    print(f"Per-galaxy results written to {out_file}")
+
+
+def kernelsCommand(args):
+    import KernelComparison
+    import Neros
+
+    catalog, suffix = shard(loadCatalog(args.catalog), args.shard)
+    kernels = [(v1, v2) for v2 in (args.v2 or Neros.V2_KERNELS) for v1 in (args.v1 or Neros.V1_KERNELS)]
+    try:
+        comparison = KernelComparison.KernelComparison(loadMilkyWay(args.mw), kernels)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    df = comparison.fit_catalog(catalog, workers=args.workers, chunksize=args.chunksize)
+
+    out_file = outputFile(args, "kernels_", suffix)
+    table = KernelComparison.chiSquaredTable(df)
+    table.to_csv(out_file)
+    print(f"Reduced chi^2 of {table.shape[1]} galaxies under {table.shape[0]} kernels written to {out_file}")
+    print(table.median(axis=1).rename("median chi^2").to_string())
+
+
+def streamCommand(args):
+    import Pipeline
+
+    checkKernels(args)
+    for path in args.catalog:
+        if not os.path.exists(path):
+            raise SystemExit(f"No catalog at {path}")
+    catalogs = [join(x, '') if os.path.isdir(x) else x for x in args.catalog]
+    if args.store:
+        try:
+            Pipeline.checkStoreNames(catalogs)
+        except ValueError as e:
+            raise SystemExit(f"{e}. Use a --store per catalog, or leave out --store")
+    directory = os.path.dirname(args.out)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    count, failed = Pipeline.run(catalogs,
+                                 loadMilkyWay(args.mw), args.out, workers=args.workers,
+                                 threads=args.threads, prefetch=args.prefetch, store=args.store,
+                                 mw_name=args.mw_name, multistart=args.multistart,
+                                 v1=args.v1, v2=args.v2)
+    print(f"Fit {count - failed} of {count} galaxies against {args.mw_name}, results in {args.out}")
+    if failed:
+        print(f"{failed} fits failed, see the error column")
+    if args.store:
+        print(f"Results stored in {args.store} as {args.mw_name}")
+
+
+def syntheticCommand(args):
+    import Synthetic
+
+    catalog, truth = Synthetic.syntheticCatalog(args.galaxies, loadMilkyWay(args.mw), seed=args.seed,
+                                                noise=args.noise)
+    if isfile(args.out) or splitext(args.out)[1]:
+        Synthetic.writeCatalogFile(catalog, truth, args.out, source=f"synthetic, seed {args.seed}")
+    else:
+        Synthetic.writeDirectory(catalog, truth, args.out)
+    truth_file = args.truth or splitext(os.path.normpath(args.out))[0] + "_truth.csv"
+    truth.to_csv(truth_file, index=False)
+    print(f"{args.galaxies} synthetic galaxies written to {args.out}, their parameters to {truth_file}")
+
+
+def packCommand(args):
+    import CatalogFile
+
+    CatalogFile.packCatalog(join(args.directory, ''), args.catalog_file)
+    print(f"Packed {args.directory} into {args.catalog_file}")
+
+
+def parser():
+    top = argparse.ArgumentParser(prog="rcfm.py", description="Rotation curve fits with the Neros model")
+    commands = top.add_subparsers(dest="command", required=True)
+
+    def catalogOptions(command, out=True):
+        command.add_argument("--catalog", required=True,
+                             help="directory of galaxy files, or a packed catalog file")
+        command.add_argument("--mw", required=True, help="Milky Way data file, e.g. data/XueSofue/MW_lum.dat")
+        command.add_argument("--mw-name", help="name of the Milky Way model in outputs "
+                                               "(default: the name of the --mw file)")
+        if out:
+            command.add_argument("--out", default="results", help="output directory (default: results)")
+
+    def workerOptions(command):
+        command.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+
+    def shardOption(command):
+        command.add_argument("--shard", metavar="I/N", type=parseShard,
+                             help="only every N-th galaxy, starting from the I-th (from 0)")
+
+    fit = commands.add_parser("fit", help="fit every galaxy in a catalog")
+    catalogOptions(fit)
+    workerOptions(fit)
+    shardOption(fit)
+    fit.add_argument("--chunksize", type=int, help="galaxies handed to a worker at a time")
+    fit.add_argument("--cache", help="FitCache file, galaxies already in it aren't refit")
+    fit.add_argument("--multistart", action="store_true", help="fit from several starting points")
+    fit.add_argument("--store", help="also store the results in this ResultsStore file")
+    fit.add_argument("--trace", help="write a trace of every fit to this file (JSON lines)")
+    fit.add_argument("--v1", default="sinh", help="form of v1, see Neros.V1_KERNELS (default: sinh)")
+    fit.add_argument("--v2", default="cosh_nn", help="form of v2, see Neros.V2_KERNELS (default: cosh_nn)")
+    fit.set_defaults(run=fitCommand)
+
+    plot = commands.add_parser("plot", help="plot the fits in a results file")
+    catalogOptions(plot, out=False)
+    workerOptions(plot)
+    plot.add_argument("--results", required=True, help="results CSV from fit, or a ResultsStore file")
+    plot.add_argument("--out", default="graphs", help="directory for the images (default: graphs)")
+    plot.add_argument("--pdf", help="write one PDF with a page per galaxy instead of images")
+    plot.set_defaults(run=plotCommand)
+
+    bootstrap = commands.add_parser("bootstrap", help="bootstrap intervals on the fit parameters")
+    catalogOptions(bootstrap)
+    workerOptions(bootstrap)
+    shardOption(bootstrap)
+    bootstrap.add_argument("--replicas", type=int, default=1000, help="bootstrap samples per galaxy (default: 1000)")
+    bootstrap.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    bootstrap.add_argument("--level", type=float, default=95, help="confidence level in percent (default: 95)")
+    bootstrap.set_defaults(run=bootstrapCommand)
+
+    joint = commands.add_parser("joint", help="fit alpha = A (L/R)^k to the whole catalog at once")
+    catalogOptions(joint)
+    joint.add_argument("--ratios", default="data/L_Reff_ratio.txt", help="L/Reff table (default: data/L_Reff_ratio.txt)")
+    joint.set_defaults(run=jointCommand)
+
+    kernels = commands.add_parser("kernels", help="chi^2 of every galaxy under several forms of v1 and v2")
+    catalogOptions(kernels)
+    workerOptions(kernels)
+    shardOption(kernels)
+    kernels.add_argument("--chunksize", type=int, help="galaxies handed to a worker at a time")
+    kernels.add_argument("--v1", nargs="+", help="forms of v1 to compare (default: all of them)")
+    kernels.add_argument("--v2", nargs="+", help="forms of v2 to compare (default: all of them)")
+    kernels.set_defaults(run=kernelsCommand)
+
+    stream = commands.add_parser("stream", help="fit several catalogs, reading, fitting and writing "
+                                                "the results all at once")
+    stream.add_argument("--catalog", required=True, nargs="+",
+                        help="directories of galaxy files, or packed catalog files")
+    stream.add_argument("--mw", required=True, help="Milky Way data file, e.g. data/XueSofue/MW_lum.dat")
+    stream.add_argument("--mw-name", help="name of the Milky Way model in the store "
+                                          "(default: the name of the --mw file)")
+    stream.add_argument("--out", default="results.csv", help="results CSV, written as the fits finish "
+                                                            "(default: results.csv)")
+    workerOptions(stream)
+    stream.add_argument("--threads", type=int, default=4, help="threads reading galaxy files (default: 4)")
+    stream.add_argument("--prefetch", type=int, default=64,
+                        help="most galaxies read ahead of the fits (default: 64)")
+    stream.add_argument("--multistart", action="store_true", help="fit from several starting points")
+    stream.add_argument("--store", help="also store the results in this ResultsStore file")
+    stream.add_argument("--v1", default="sinh", help="form of v1, see Neros.V1_KERNELS (default: sinh)")
+    stream.add_argument("--v2", default="cosh_nn", help="form of v2, see Neros.V2_KERNELS (default: cosh_nn)")
+    stream.set_defaults(run=streamCommand)
+
+    synthetic = commands.add_parser("synthetic", help="make a catalog of galaxies with known fit parameters")
+    synthetic.add_argument("--galaxies", type=int, required=True, help="number of galaxies")
+    synthetic.add_argument("--mw", required=True, help="Milky Way data file the curves are made against")
+    synthetic.add_argument("--out", required=True,
+                           help="a directory for one text file per galaxy, or a file name "
+                                "(e.g. synthetic.rcat) for a packed catalog")
+    synthetic.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    synthetic.add_argument("--noise", type=float, default=0.05,
+                           help="errV as a fraction of vObs (default: 0.05)")
+    synthetic.add_argument("--truth", help="CSV for the true parameters (default: next to --out)")
+    synthetic.set_defaults(run=syntheticCommand)
+
+    pack = commands.add_parser("pack", help="pack a directory of galaxy files into one catalog file")
+    pack.add_argument("directory")
+    pack.add_argument("catalog_file")
+    pack.set_defaults(run=packCommand)
+
+    return top
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if getattr(args, 'mw', None) and not getattr(args, 'mw_name', None):
+        args.mw_name = name(args.mw)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
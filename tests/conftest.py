@@ -0,0 +1,41 @@
+# Shared setup for the regression tests
+# The modules live at the top of the repository rather than in a
+# package, so it goes on sys.path. Run the tests from anywhere with
+#
+#   python -m pytest tests
+
+import importlib.util
+import os
+import sys
+
+# Plots are only ever written to files here
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+DATA_DIR = os.path.join(ROOT, 'data')
+SPARC_DIR = os.path.join(DATA_DIR, 'Sparc', 'Rotmod_LTG', '')
+MILKY_WAY_FILE = os.path.join(DATA_DIR, 'XueSofue', 'MW_lum.dat')
+
+
+def pytest_configure(config):
+    # curve_fit warns when a galaxy's covariance can't be estimated, which
+    # some real galaxies always give
+    config.addinivalue_line('filterwarnings', 'ignore::scipy.optimize.OptimizeWarning')
+
+
+def loadScript(path):
+    """Imports a script that isn't on the path, e.g. 'fit-analysis/alpha_correlation_batch.py'
+
+    The module is added to sys.modules, so its functions can be sent to
+    worker processes"""
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,109 @@
+# A packed catalog gives back exactly what was packed
+
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import CatalogFile
+import DataAid
+import DataReader
+from conftest import DATA_DIR, SPARC_DIR
+
+SPARC_SAMPLE = ['CamB_rotmod.dat', 'D631-7_rotmod.dat', 'NGC3198_rotmod.dat', 'UGC02953_rotmod.dat']
+
+
+@pytest.fixture
+def galaxy_dir(tmp_path):
+    directory = tmp_path / 'galaxies'
+    directory.mkdir()
+    for name in SPARC_SAMPLE:
+        shutil.copy(os.path.join(SPARC_DIR, name), directory)
+    return str(directory) + os.sep
+
+
+def test_packCatalog_round_trip(galaxy_dir, tmp_path):
+    filename = str(tmp_path / 'sample.rcat')
+    CatalogFile.packCatalog(galaxy_dir, filename)
+    catalog = CatalogFile.openCatalog(filename)
+
+    expected = DataAid.GetGalaxyData(galaxy_dir)
+    assert sorted(catalog.keys()) == sorted(expected)
+    assert len(catalog) == len(expected)
+    for name, values in expected.items():
+        assert name in catalog
+        np.testing.assert_array_equal(catalog[name], values)
+
+        path = os.path.join(galaxy_dir, name + '.dat')
+        dataFile = DataReader.readDataFile(path)
+        assert catalog.header(name) == dataFile.header
+        assert catalog.file_hash(name) == DataAid.hashFile(path)
+        assert catalog.distance(name) == CatalogFile.parseDistance(dataFile.header)
+    assert catalog.columns == dataFile.columns
+    assert catalog.units == dataFile.units
+
+
+def test_writeCatalog_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    names = ['b', 'a', 'galaxy with a longer name', 'ünïcode']
+    galaxies = [rng.normal(size=(5, 3)), rng.normal(size=(1, 3)), rng.normal(size=(7, 2)), np.zeros((0, 3))]
+    headers = [['# Distance = 3.36 Mpc'], [], ['# one', '# two'], []]
+    filename = str(tmp_path / 'written.rcat')
+    CatalogFile.writeCatalog(filename, names, galaxies, headers=headers, columns=['x', 'y', 'z'])
+    catalog = CatalogFile.openCatalog(filename)
+
+    assert catalog.keys() == names
+    assert catalog.columns == ['x', 'y', 'z']
+    for name, galaxy, header in zip(names, galaxies, headers):
+        stored = catalog[name]
+        assert stored.shape == (len(galaxy), 3)
+        # Narrower galaxies are padded with NaN
+        np.testing.assert_array_equal(stored[:, :galaxy.shape[1]], galaxy)
+        assert np.isnan(stored[:, galaxy.shape[1]:]).all()
+        assert catalog.header(name) == header
+    assert catalog.distance('b') == 3.36
+    assert np.isnan(catalog.distance('a'))
+    assert [name for name, _ in catalog.items()] == names
+
+
+def test_missing_galaxies(tmp_path):
+    filename = str(tmp_path / 'small.rcat')
+    CatalogFile.writeCatalog(filename, ['abc'], [np.ones((2, 2))])
+    catalog = CatalogFile.openCatalog(filename)
+
+    assert 'ab' not in catalog
+    assert 'abcd' not in catalog
+    assert 'a much longer name than any in the catalog' not in catalog
+    with pytest.raises(KeyError):
+        catalog['abd']
+    with pytest.raises(KeyError):
+        catalog.header('abd')
+
+
+def test_duplicate_names(tmp_path):
+    with pytest.raises(ValueError):
+        CatalogFile.writeCatalog(str(tmp_path / 'dup.rcat'), ['a', 'a'], [np.ones((1, 2))] * 2)
+
+
+def test_not_a_catalog(tmp_path):
+    path = tmp_path / 'not_a_catalog.rcat'
+    path.write_bytes(b'# Rad\tVobs\n1.0\t2.0\n')
+    with pytest.raises(ValueError):
+        CatalogFile.openCatalog(str(path))
+
+
+def test_names_match_the_directory(tmp_path):
+    # This directory has a file without an extension
+    directory = os.path.join(DATA_DIR, 'LCMFits', 'data', '')
+    filename = str(tmp_path / 'lcm.rcat')
+    CatalogFile.packCatalog(directory, filename)
+    catalog = CatalogFile.openCatalog(filename)
+
+    expected = DataAid.GetGalaxyData(directory)
+    assert sorted(catalog.keys()) == sorted(expected)
+    # In file name order
+    assert catalog.keys() == [DataAid.galaxyName(x) for x in sorted(DataAid.listFiles(directory))]
+    assert 'NGC6946_deBlok_TH' in catalog
+    for name, values in expected.items():
+        np.testing.assert_array_equal(catalog[name], values)
@@ -0,0 +1,78 @@
+# DataReader reads every data file the same way a line by line parse does
+
+import os
+
+import numpy as np
+import pytest
+
+import DataReader
+from conftest import DATA_DIR
+
+# Files that aren't rotation curve or Milky Way tables, with their own readers
+OTHER_FILES = {'L_Reff_ratio.txt'}
+
+
+def dataFiles():
+    paths = []
+    for directory, _, files in os.walk(DATA_DIR):
+        paths.extend(os.path.join(directory, x) for x in files if x not in OTHER_FILES)
+    return sorted(paths)
+
+
+def lineByLine(path):
+    """The values of a data file, one line at a time, rows padded with NaN"""
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    while lines and lines[0].strip()[:1] == '#':
+        lines.pop(0)
+    rows = [[float(x) for x in line.split()] for line in lines if line.strip()]
+    ncols = max(len(x) for x in rows)
+    return np.array([row + [np.nan] * (ncols - len(row)) for row in rows])
+
+
+@pytest.mark.parametrize('path', dataFiles(), ids=lambda x: os.path.relpath(x, DATA_DIR))
+def test_every_data_file(path):
+    values = DataReader.readValues(path)
+    np.testing.assert_array_equal(values, lineByLine(path))
+
+
+def test_columns_and_units():
+    text = ("# Distance = 3.36 Mpc\n"
+            "# Rad\tVobs\terrV\tVgas\tVdisk\tVbul\tSBdisk\tSBbul\n"
+            "# kpc\tkm/s\tkm/s\tkm/s\tkm/s\tkm/s\tL/pc^2\tL/pc^2\n"
+            "0.32\t1.56\t4.25\t0.51\t2.19\t0.00\t73.21\t0.00\n"
+            "0.64\t3.38\t3.12\t1.68\t4.06\t0.00\t60.55\t0.00\n")
+    dataFile = DataReader.parseDataFile(text)
+    assert dataFile.header[0] == "# Distance = 3.36 Mpc"
+    assert dataFile.columns == ['Rad', 'Vobs', 'errV', 'Vgas', 'Vdisk', 'Vbul', 'SBdisk', 'SBbul']
+    assert dataFile.units[:2] == ['kpc', 'km/s']
+    np.testing.assert_array_equal(dataFile['Vobs'], [1.56, 3.38])
+    np.testing.assert_array_equal(dataFile[0], [0.32, 0.64])
+
+
+def test_milky_way_columns():
+    dataFile = DataReader.parseDataFile("# Xue Sofue\r\n# comment\r\n1.0 200.0\r\n2.0 210.5\r\n")
+    assert dataFile.columns == DataReader.MILKY_WAY_COLUMNS
+    np.testing.assert_array_equal(dataFile.values, [[1.0, 200.0], [2.0, 210.5]])
+
+
+def test_ragged_rows():
+    # The same number of values as two full rows, but not in rows of the same length
+    values = DataReader.parseDataFile("1 2 3\n4\n5 6\n\n").values
+    np.testing.assert_array_equal(values, [[1, 2, 3], [4, np.nan, np.nan], [5, 6, np.nan]])
+
+
+def test_empty_body():
+    assert DataReader.parseDataFile("# Rad\tVobs\n").values.shape == (0, 0)
+
+
+def test_bad_value():
+    with pytest.raises(ValueError):
+        DataReader.parseDataFile("# Rad\tVobs\n1.0 foo\n")
+
+
+def test_readLuminosityRatios():
+    ratios = DataReader.readLuminosityRatios(os.path.join(DATA_DIR, 'L_Reff_ratio.txt'))
+    assert ratios['CamB_rotmod'] == 0.06198347107
+    assert all(isinstance(x, float) for x in ratios.values())
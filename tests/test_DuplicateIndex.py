@@ -0,0 +1,105 @@
+# The duplicate index finds the same files as hashing everything, and only rehashes what changed
+
+import os
+import shutil
+
+import pytest
+
+import DuplicateIndex
+from conftest import SPARC_DIR
+
+GALAXY = os.path.join(SPARC_DIR, 'CamB_rotmod.dat')
+OTHER = os.path.join(SPARC_DIR, 'DDO154_rotmod.dat')
+
+
+def retabbed(path):
+    """The same numbers as path, written differently"""
+    with open(path) as f:
+        lines = f.read().splitlines()
+    return '\n'.join([line if line.startswith('#') else '  '.join(line.split()) for line in lines]
+                     + ['']).replace('# Distance', '#  Distance')
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    directory = tmp_path / 'data'
+    directory.mkdir()
+    shutil.copy(GALAXY, directory / 'a.dat')
+    shutil.copy(GALAXY, directory / 'b.dat')
+    (directory / 'c.dat').write_text(retabbed(GALAXY))
+    shutil.copy(OTHER, directory / 'd.dat')
+    (directory / '.hidden.dat').write_text(retabbed(GALAXY))
+    (directory / 'sub').mkdir()
+    shutil.copy(GALAXY, directory / 'sub' / 'e.dat')
+    return str(directory)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_reports_the_duplicates(data_dir, tmp_path, workers):
+    with DuplicateIndex.DuplicateIndex(str(tmp_path / 'index.sqlite')) as index:
+        assert index.update(data_dir, workers=workers, chunksize=1) == 4
+        assert len(index) == 4
+        path = lambda name: os.path.join(data_dir, name)
+        assert index.exactDuplicates() == [[path('a.dat'), path('b.dat')]]
+        assert index.numericDuplicates() == [[path('a.dat'), path('b.dat'), path('c.dat')]]
+
+
+def test_only_changed_files_are_hashed_again(data_dir, tmp_path):
+    filename = str(tmp_path / 'index.sqlite')
+    with DuplicateIndex.DuplicateIndex(filename) as index:
+        assert index.update(data_dir, workers=1) == 4
+
+    # A new connection, as for the next run of checkForDuplicates
+    with DuplicateIndex.DuplicateIndex(filename) as index:
+        assert index.update(data_dir, workers=1) == 0
+
+        shutil.copy(OTHER, os.path.join(data_dir, 'b.dat'))
+        assert index.update(data_dir, workers=1) == 1
+        assert index.exactDuplicates() == [sorted(os.path.join(data_dir, x) for x in ('b.dat', 'd.dat'))]
+
+        # Same size, new modification time
+        stat = os.stat(os.path.join(data_dir, 'a.dat'))
+        os.utime(os.path.join(data_dir, 'a.dat'), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert index.update(data_dir, workers=1) == 1
+
+        os.remove(os.path.join(data_dir, 'c.dat'))
+        assert index.update(data_dir, workers=1) == 0
+        assert len(index) == 3
+        assert index.numericDuplicates() == [sorted(os.path.join(data_dir, x) for x in ('b.dat', 'd.dat'))]
+
+
+def test_directories_are_kept_apart(data_dir, tmp_path):
+    sub_dir = os.path.join(data_dir, 'sub')
+    with DuplicateIndex.DuplicateIndex(str(tmp_path / 'index.sqlite')) as index:
+        assert index.update([data_dir, sub_dir], workers=1) == 5
+        assert index.exactDuplicates() == [sorted([os.path.join(data_dir, 'a.dat'), os.path.join(data_dir, 'b.dat'),
+                                                   os.path.join(sub_dir, 'e.dat')])]
+        assert index.exactDuplicates(sub_dir) == []
+
+        # Updating the parent alone doesn't drop the subdirectory's files
+        assert index.update(data_dir, workers=1) == 0
+        assert len(index) == 5
+
+
+def test_unreadable_files_have_no_content_hash(tmp_path):
+    directory = tmp_path / 'data'
+    directory.mkdir()
+    (directory / 'notes.txt').write_text("not a data file\n")
+    (directory / 'notes copy.txt').write_text("not a data file\n")
+    with DuplicateIndex.DuplicateIndex(str(tmp_path / 'index.sqlite')) as index:
+        index.update(str(directory), workers=1)
+        assert len(index.exactDuplicates()) == 1
+        assert index.numericDuplicates() == []
+        with pytest.raises(ValueError):
+            index.duplicates('size')
+
+
+def test_sparc_copies(tmp_path):
+    sparc = os.path.dirname(os.path.normpath(SPARC_DIR))
+    directories = [os.path.join(sparc, x) for x in ('Rotmod_LTG', 'SparcSubset135', 'TrainingSet')]
+    exact, numeric = DuplicateIndex.findDuplicates(directories, str(tmp_path / 'index.sqlite'), workers=1)
+    expected = [os.path.join(directories[0], 'CamB_rotmod.dat'),
+                os.path.join(directories[1], 'CamB_rotmod-Copy1.dat'),
+                os.path.join(directories[2], 'CamB_rotmod.dat')]
+    assert [os.path.normpath(x) for x in expected] in exact
+    assert all(group in numeric or any(set(group) <= set(x) for x in numeric) for group in exact)
@@ -0,0 +1,81 @@
+# fit_catalog with a FitCache only fits what it hasn't fit before
+
+import numpy as np
+import pytest
+
+import DataAid
+import DataReader
+import FitCache
+import Neros
+import Trace
+from conftest import MILKY_WAY_FILE, SPARC_DIR
+
+GALAXIES = ['CamB_rotmod', 'D631-7_rotmod', 'DDO064_rotmod']
+
+
+@pytest.fixture(scope='module')
+def milky_way():
+    return DataReader.readValues(MILKY_WAY_FILE)[:, :2]
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    galaxies = DataAid.GetGalaxyData(SPARC_DIR)
+    return {name: np.array(galaxies[name]) for name in GALAXIES}
+
+
+def fitWithCache(catalog, milky_way, cache_file, **options):
+    """The results, and the names of the galaxies that were actually fit"""
+
+    trace = Trace.Tracer()
+    df = Neros.fit_catalog(catalog, milky_way, workers=1, cache=cache_file, trace=trace, **options)
+    return df, sorted(x['Galaxy'] for x in trace.records)
+
+
+def test_second_run_reads_the_cache(catalog, milky_way, tmp_path):
+    cache_file = str(tmp_path / 'fits.sqlite')
+    first, fitted = fitWithCache(catalog, milky_way, cache_file)
+    assert fitted == sorted(GALAXIES)
+
+    second, fitted = fitWithCache(catalog, milky_way, cache_file)
+    assert fitted == []
+    columns = ['Galaxy', 'chi_squared', 'alpha', 'disk_scale', 'bulge_scale', 'phi_zero', 'nfev']
+    assert second[columns].equals(first[columns])
+
+
+def test_changes_force_a_refit(catalog, milky_way, tmp_path):
+    cache_file = str(tmp_path / 'fits.sqlite')
+    fitWithCache(catalog, milky_way, cache_file)
+
+    # One galaxy's data changes
+    changed = dict(catalog)
+    changed['CamB_rotmod'] = catalog['CamB_rotmod'].copy()
+    changed['CamB_rotmod'][0, 1] += 0.5
+    _, fitted = fitWithCache(changed, milky_way, cache_file)
+    assert fitted == ['CamB_rotmod']
+
+    # The same data under another name is already there
+    _, fitted = fitWithCache({'renamed': catalog['DDO064_rotmod']}, milky_way, cache_file)
+    assert fitted == []
+
+    # A different Milky Way, or different options, refit everything
+    other_milky_way = milky_way.copy()
+    other_milky_way[:, 1] *= 1.01
+    _, fitted = fitWithCache(catalog, other_milky_way, cache_file)
+    assert fitted == sorted(GALAXIES)
+    _, fitted = fitWithCache(catalog, milky_way, cache_file, v1='cosh')
+    assert fitted == sorted(GALAXIES)
+
+
+def test_failures_are_not_cached(catalog, milky_way, tmp_path):
+    cache_file = str(tmp_path / 'fits.sqlite')
+    bad = dict(catalog, two_columns=np.ones((10, 2)))
+    df, _ = fitWithCache(bad, milky_way, cache_file)
+    assert df['error'].notna().sum() == 1
+
+    df, fitted = fitWithCache(bad, milky_way, cache_file)
+    assert fitted == ['two_columns']
+    assert df['error'].notna().sum() == 1
+    cache = FitCache.FitCache(cache_file)
+    assert len(cache) == len(GALAXIES)
+    cache.close()
@@ -0,0 +1,141 @@
+# FitWorkspace gives the same numbers, bit for bit, as the step by step reference
+
+import numpy as np
+import pytest
+
+import DataAid
+import DataReader
+import Neros
+from conftest import MILKY_WAY_FILE, SPARC_DIR
+
+# (alpha, disk_scale, bulge_scale), including zero scales and a large alpha
+# that makes vNeros^2 negative for some galaxies (NaN in both)
+POINTS = [(1.0, 1.0, 1.0), (0.35, 0.7, 1.4), (2.0, 0.5, 0.0), (0.8, 0.0, 0.0), (40.0, 1.2, 0.9)]
+
+
+@pytest.fixture(scope='module')
+def milky_way():
+    return DataReader.readValues(MILKY_WAY_FILE)[:, :2]
+
+
+@pytest.fixture(scope='module')
+def galaxies():
+    return [Neros.galaxy_columns(x) for x in DataAid.GetGalaxyData(SPARC_DIR).values()]
+
+
+def assertSame(actual, expected):
+    np.testing.assert_array_equal(actual, expected, strict=True)
+
+
+@pytest.mark.parametrize('integration', Neros.INTEGRATION_RULES)
+@pytest.mark.parametrize('v2', sorted(Neros.V2_KERNELS))
+@pytest.mark.parametrize('v1', sorted(Neros.V1_KERNELS))
+def test_matches_reference(milky_way, galaxies, v1, v2, integration):
+    neros = Neros.Neros(milky_way, v1=v1, v2=v2, integration=integration)
+    for galaxy in galaxies:
+        problem = neros.prepare(*galaxy)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for point in POINTS:
+                assertSame(problem.vNeros(*point), problem.reference_vNeros(*point))
+                assertSame(problem.jacobian(*point), problem.reference_jacobian(*point))
+
+
+def test_call_orders(milky_way, galaxies):
+    """The cached values are only reused for the same scales and kernels"""
+
+    problem = Neros.Neros(milky_way).prepare(*galaxies[0])
+    # The Jacobian without vNeros first, then vNeros at the same scales with
+    # a new alpha, then scales the workspace has seen before
+    sequence = [('jacobian', POINTS[0]), ('vNeros', (0.5,) + POINTS[0][1:]), ('jacobian', POINTS[1]),
+                ('vNeros', POINTS[1]), ('vNeros', POINTS[0]), ('jacobian', (3.0,) + POINTS[1][1:])]
+    for method, point in sequence:
+        assertSame(getattr(problem, method)(*point), getattr(problem, 'reference_' + method)(*point))
+
+
+def test_results_stay_valid(milky_way, galaxies):
+    problem = Neros.Neros(milky_way).prepare(*galaxies[1])
+    vNeros = problem.vNeros(*POINTS[0])
+    jacobian = problem.jacobian(*POINTS[0])
+    problem.vNeros(*POINTS[1])
+    problem.jacobian(*POINTS[1])
+    assertSame(vNeros, problem.reference_vNeros(*POINTS[0]))
+    assertSame(jacobian, problem.reference_jacobian(*POINTS[0]))
+
+
+def test_fit_matches_reference(milky_way, galaxies):
+    """curve_fit takes the same steps with the workspace as with the reference methods"""
+
+    class ReferenceProblem(Neros.FitProblem):
+        vNeros = Neros.FitProblem.reference_vNeros
+        jacobian = Neros.FitProblem.reference_jacobian
+
+    neros = Neros.Neros(milky_way)
+    for galaxy in galaxies[:10]:
+        problem = neros.prepare(*galaxy)
+        reference = ReferenceProblem(neros, *galaxy)
+        try:
+            expected = reference.fit()
+        except RuntimeError:
+            with pytest.raises(RuntimeError):
+                problem.fit()
+            continue
+        for actual, wanted in zip(problem.fit(), expected):
+            assertSame(actual, wanted)
+
+
+# eTsi - 1 values over the range fits reach, from the etc -> -1 limit
+# (eTsi -> 0) to large ones
+ETC = np.concatenate([[-0.999, -0.5, -1e-8, 0.0, 1e-12, 1e-6], np.geomspace(1e-4, 50, 40)])
+
+
+def test_every_kernel_has_its_in_place_twin():
+    assert set(Neros.V1_KERNELS_INTO) <= set(Neros.V1_KERNELS)
+    assert set(Neros.V2_KERNELS_INTO) <= set(Neros.V2_KERNELS)
+    # A kernel without a twin still works (see test_kernel_without_a_twin),
+    # but is slower, so every kernel that ships has one
+    assert set(Neros.V1_KERNELS_INTO) == set(Neros.V1_KERNELS)
+    assert set(Neros.V2_KERNELS_INTO) == set(Neros.V2_KERNELS)
+
+
+@pytest.mark.parametrize('name', sorted(Neros.V1_KERNELS_INTO))
+def test_v1_in_place_matches(name):
+    value, derivative = Neros.V1_KERNELS[name]
+    value_into, derivative_into = Neros.V1_KERNELS_INTO[name]
+    out, scratch = np.empty_like(ETC), np.empty_like(ETC)
+
+    value_into(ETC, ETC + 1, out, scratch)
+    assertSame(out, value(ETC))
+    derivative_into(ETC, ETC + 1, out, scratch)
+    assertSame(out, derivative(ETC))
+
+
+@pytest.mark.parametrize('name', sorted(Neros.V2_KERNELS_INTO))
+def test_v2_in_place_matches(name):
+    value, derivative = Neros.V2_KERNELS[name]
+    value_into, derivative_into = Neros.V2_KERNELS_INTO[name]
+    etFlat, etCurve = np.meshgrid(ETC, ETC)
+    etFlat, etCurve = etFlat.ravel(), etCurve.ravel()
+    out, out_flat, out_curve = (np.empty_like(etFlat) for _ in range(3))
+    state = [np.empty_like(etFlat) for _ in range(3)]
+
+    value_into(etFlat + 1, etCurve + 1, out, state)
+    assertSame(out, value(etFlat, etCurve))
+    # The derivative takes the state as the value left it
+    derivative_into(etFlat + 1, etCurve + 1, out_flat, out_curve, state)
+    flat, curve = derivative(etFlat, etCurve)
+    assertSame(out_flat, flat)
+    assertSame(out_curve, curve)
+
+
+def test_kernel_without_a_twin(milky_way, galaxies, monkeypatch):
+    def v1(etc):
+        return (etc + 1)**0.5
+
+    def dv1(etc):
+        return 0.5 / (etc + 1)**0.5
+
+    monkeypatch.setitem(Neros.V1_KERNELS, 'sqrt', (v1, dv1))
+    problem = Neros.Neros(milky_way, v1='sqrt').prepare(*galaxies[0])
+    for point in POINTS[:3]:
+        assertSame(problem.vNeros(*point), problem.reference_vNeros(*point))
+        assertSame(problem.jacobian(*point), problem.reference_jacobian(*point))
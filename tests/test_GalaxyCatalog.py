@@ -0,0 +1,99 @@
+# A GalaxyCatalog holds exactly what DataAid.GetGalaxyData reads
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import CatalogFile
+import DataAid
+import DataReader
+import GalaxyCatalog
+import Neros
+from conftest import MILKY_WAY_FILE, SPARC_DIR
+
+FIT_SAMPLE = ['CamB_rotmod', 'DDO154_rotmod', 'NGC2403_rotmod']
+
+
+@pytest.fixture(scope='module')
+def reference():
+    return DataAid.GetGalaxyData(SPARC_DIR)
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    return GalaxyCatalog.fromDirectory(SPARC_DIR)
+
+
+@pytest.fixture(scope='module')
+def packed(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp('packed') / 'sparc.rcat')
+    CatalogFile.packCatalog(SPARC_DIR, filename)
+    return GalaxyCatalog.fromCatalog(CatalogFile.openCatalog(filename))
+
+
+def checkMatches(catalog, reference):
+    assert sorted(catalog.keys()) == sorted(reference)
+    assert len(catalog) == len(reference)
+    for name, values in reference.items():
+        galaxy = catalog[name]
+        assert galaxy.name == name
+        assert len(galaxy) == len(values)
+        np.testing.assert_array_equal(np.asarray(galaxy), np.asarray(values, dtype=float))
+        for column, expected in zip(galaxy.fit_columns, Neros.galaxy_columns(values)):
+            assert column.dtype == np.float64
+            np.testing.assert_array_equal(column, expected)
+
+
+def test_directory_matches_GetGalaxyData(catalog, reference):
+    assert catalog.keys() == list(reference)
+    checkMatches(catalog, reference)
+
+
+def test_packed_catalog_matches_GetGalaxyData(packed, reference):
+    checkMatches(packed, reference)
+
+
+def test_galaxies_are_views(catalog):
+    galaxy = catalog['NGC2403_rotmod']
+    assert np.shares_memory(galaxy.columns, catalog.data)
+    for column in galaxy.fit_columns:
+        assert np.shares_memory(column, catalog.data)
+
+
+def test_float32_fits_in_float64(reference):
+    catalog = GalaxyCatalog.fromDirectory(SPARC_DIR, dtype=np.float32)
+    assert catalog.data.dtype == np.float32
+    for column, expected in zip(catalog['NGC2403_rotmod'].fit_columns,
+                                Neros.galaxy_columns(reference['NGC2403_rotmod'])):
+        assert column.dtype == np.float64
+        np.testing.assert_allclose(column, expected, rtol=1e-6)
+
+
+def test_subset_keeps_the_order_given(catalog, reference):
+    names = ['NGC2403_rotmod', 'CamB_rotmod']
+    subset = catalog.subset(names)
+    assert subset.keys() == names
+    checkMatches(subset, {name: reference[name] for name in names})
+
+
+def test_ragged_galaxies_are_padded():
+    catalog = GalaxyCatalog.fromGalaxies({'wide': np.ones((2, 6)), 'narrow': np.ones((3, 4))})
+    assert catalog.data.shape == (6, 5)
+    np.testing.assert_array_equal(catalog.lengths, [2, 3])
+    assert np.isnan(np.asarray(catalog['narrow'])[:, 4:]).all()
+
+
+def test_bad_catalogs_are_refused():
+    with pytest.raises(ValueError, match="unique"):
+        GalaxyCatalog.GalaxyCatalog(['a', 'a'], np.zeros((6, 4)), [0, 2, 4])
+    with pytest.raises(ValueError, match="offsets"):
+        GalaxyCatalog.GalaxyCatalog(['a', 'b'], np.zeros((6, 4)), [0, 2, 3])
+    with pytest.raises(ValueError, match="six columns"):
+        GalaxyCatalog.fromGalaxies({'a': np.ones((3, 4))})['a'].fit_columns
+
+
+def test_fit_catalog_matches_dictionary(catalog, reference):
+    milky_way = DataReader.readValues(MILKY_WAY_FILE)[:, :2]
+    expected = Neros.fit_catalog({name: reference[name] for name in FIT_SAMPLE}, milky_way, workers=1)
+    result = Neros.fit_catalog(catalog.subset(FIT_SAMPLE), milky_way, workers=1)
+    pd.testing.assert_frame_equal(result.drop(columns='fit_time'), expected.drop(columns='fit_time'))
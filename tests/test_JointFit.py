@@ -0,0 +1,92 @@
+# Joint fit of the alpha(L/Reff) law
+
+import os
+
+import numpy as np
+import pytest
+
+import DataAid
+import DataReader
+import JointFit
+import Neros
+from conftest import DATA_DIR, MILKY_WAY_FILE, SPARC_DIR
+
+GALAXIES = ['CamB_rotmod', 'DDO154_rotmod', 'NGC2403_rotmod']
+
+
+@pytest.fixture(scope='module')
+def milky_way():
+    return DataReader.readValues(MILKY_WAY_FILE)[:, :2]
+
+
+@pytest.fixture(scope='module')
+def galaxies():
+    catalog = DataAid.GetGalaxyData(SPARC_DIR)
+    return {name: catalog[name] for name in GALAXIES}
+
+
+@pytest.fixture(scope='module')
+def ratios():
+    return DataReader.readLuminosityRatios(os.path.join(DATA_DIR, 'L_Reff_ratio.txt'))
+
+
+@pytest.fixture(scope='module')
+def joint(milky_way, galaxies, ratios):
+    neros = Neros.Neros(milky_way)
+    problems = [neros.prepare(*Neros.galaxy_columns(galaxies[name])) for name in GALAXIES]
+    return JointFit.JointProblem(problems, [ratios[name] for name in GALAXIES])
+
+
+def finiteDifference(fn, params, step=1e-6):
+    columns = []
+    for i in range(len(params)):
+        h = step * max(1.0, abs(params[i]))
+        up, down = params.copy(), params.copy()
+        up[i] += h
+        down[i] -= h
+        columns.append((fn(up) - fn(down)) / (2*h))
+    return np.column_stack(columns)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_jacobian_matches_finite_difference(joint, seed):
+    rng = np.random.default_rng(seed)
+    params = np.concatenate([[rng.normal(), rng.normal(scale=0.5)],
+                             rng.uniform(0.5, 1.5, size=2*len(GALAXIES))])
+    jacobian = joint.jacobian(params)
+    assert jacobian.shape == (len(joint.vObs), 2 + 2*len(GALAXIES))
+    np.testing.assert_allclose(jacobian.toarray(), finiteDifference(joint.residuals, params),
+                               rtol=1e-5, atol=1e-6)
+
+
+def test_each_galaxy_only_uses_its_own_scales(joint):
+    jacobian = joint.jacobian(np.ones(2 + 2*len(GALAXIES))).toarray()
+    for i in range(len(GALAXIES)):
+        rows = slice(joint.row_offsets[i], joint.row_offsets[i + 1])
+        others = np.delete(np.arange(2, jacobian.shape[1]), [2*i, 2*i + 1])
+        assert not np.any(jacobian[rows][:, others])
+
+
+def test_skips_galaxies_that_cannot_be_fit(milky_way, galaxies, ratios):
+    catalog = dict(galaxies)
+    catalog['Short'] = galaxies['NGC2403_rotmod'][:3]
+    catalog['Zero'] = galaxies['NGC2403_rotmod']
+    catalog['Negative'] = galaxies['CamB_rotmod']
+    catalog['Undefined'] = galaxies['DDO154_rotmod']
+    catalog['Unknown'] = galaxies['CamB_rotmod']
+    luminosity_ratios = {name: ratios[name] for name in GALAXIES}
+    luminosity_ratios.update({'Short': 1.0, 'Zero': 0.0, 'Negative': -2.0,
+                              'Undefined': float('nan')})
+
+    result = JointFit.fit_joint(catalog, milky_way, luminosity_ratios)
+    assert set(result['skipped']) == {'Short', 'Zero', 'Negative', 'Undefined'}
+    assert '3 points' in result['skipped']['Short']
+    assert 'positive' in result['skipped']['Zero']
+    assert result['missing'] == ['Unknown']
+    assert list(result['galaxies']['Galaxy']) == GALAXIES
+    assert result['success']
+
+
+def test_refuses_when_nothing_can_be_fit(milky_way, galaxies):
+    with pytest.raises(ValueError, match="None of the galaxies"):
+        JointFit.fit_joint(galaxies, milky_way, {'CamB_rotmod': 0.0})
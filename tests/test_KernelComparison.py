@@ -0,0 +1,68 @@
+# Fitting under several kernels matches fitting under each one alone
+
+import numpy as np
+import pytest
+
+import DataAid
+import DataReader
+import KernelComparison
+import Neros
+from conftest import MILKY_WAY_FILE, SPARC_DIR
+
+GALAXIES = ['CamB_rotmod', 'DDO154_rotmod', 'NGC2403_rotmod', 'NGC3198_rotmod']
+KERNELS = [('sinh', 'cosh_nn'), ('cosh', 'cosh_nn'), ('sech', 'cosh_nn')]
+COLUMNS = ['chi_squared', 'alpha', 'disk_scale', 'bulge_scale', 'phi_zero', 'nfev']
+
+
+@pytest.fixture(scope='module')
+def milky_way():
+    return DataReader.readValues(MILKY_WAY_FILE)[:, :2]
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    galaxies = DataAid.GetGalaxyData(SPARC_DIR)
+    return {name: galaxies[name] for name in GALAXIES}
+
+
+def singleKernel(milky_way, galaxy, v1, v2):
+    neros = Neros.Neros(milky_way, v1=v1, v2=v2)
+    rad = Neros.galaxy_columns(galaxy)[0]
+    neros.fit(*Neros.galaxy_columns(galaxy))
+    return dict(neros.get_fit_results(rad), **neros.fit_info)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_matches_each_kernel_alone(milky_way, catalog, workers):
+    df = KernelComparison.KernelComparison(milky_way, KERNELS).fit_catalog(catalog, workers=workers)
+    assert len(df) == len(GALAXIES) * len(KERNELS)
+    assert df['error'].isna().all()
+
+    for _, row in df.iterrows():
+        expected = singleKernel(milky_way, catalog[row['Galaxy']], row['v1'], row['v2'])
+        assert row['Kernel'] == KernelComparison.kernelName(row['v1'], row['v2'])
+        for column in COLUMNS:
+            assert row[column] == expected[column], (row['Kernel'], row['Galaxy'], column)
+
+
+def test_default_kernel_matches_neros_fit(milky_way, catalog):
+    table = KernelComparison.compare_kernels(catalog, milky_way, kernels=[('sinh', 'cosh_nn')], workers=1)
+    assert list(table.index) == ['sinh/cosh_nn']
+    for name, galaxy in catalog.items():
+        assert table.loc['sinh/cosh_nn', name] == singleKernel(milky_way, galaxy, 'sinh', 'cosh_nn')['chi_squared']
+
+
+def test_vLCM_rows_match_each_kernel(milky_way, catalog):
+    comparison = KernelComparison.KernelComparison(milky_way)
+    assert comparison.kernels == KernelComparison.allKernels()
+
+    rad, vGas, vDisk, vBulge, _, _ = Neros.galaxy_columns(catalog['NGC3198_rotmod'])
+    vLum = np.sqrt(vGas**2 + vDisk**2 + vBulge**2)
+    vLCM = comparison.vLCM(rad, vLum)
+    for row, (v1, v2) in zip(vLCM, comparison.kernels):
+        np.testing.assert_allclose(row, Neros.Neros(milky_way, v1=v1, v2=v2).vLCM(rad, vLum), rtol=1e-13)
+
+
+def test_needs_a_kernel(milky_way):
+    with pytest.raises(ValueError):
+        KernelComparison.KernelComparison(milky_way, [])
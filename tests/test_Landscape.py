@@ -0,0 +1,58 @@
+# chi^2 landscapes don't depend on how the grid is chunked
+
+import numpy as np
+import pytest
+
+import DataAid
+import DataReader
+import Landscape
+import Neros
+from conftest import MILKY_WAY_FILE, SPARC_DIR
+
+ALPHAS = np.linspace(0.0, 0.05, 60)
+DISK_SCALES = np.linspace(0.2, 2.0, 5)
+BULGE_SCALES = np.linspace(0.0, 1.5, 4)
+
+
+@pytest.fixture(scope='module')
+def problem():
+    neros = Neros.Neros(DataReader.readValues(MILKY_WAY_FILE)[:, :2])
+    galaxy = DataAid.GetGalaxyData(SPARC_DIR)['NGC2403_rotmod']
+    return neros.prepare(*Neros.galaxy_columns(galaxy))
+
+
+def landscape(problem, **kwargs):
+    return Landscape.chiSquaredLandscape(problem, ALPHAS, DISK_SCALES, BULGE_SCALES,
+                                         dtype=np.float64, **kwargs)
+
+
+@pytest.fixture(scope='module')
+def unlimited(problem):
+    return landscape(problem, chunk_elements=10**12)
+
+
+@pytest.mark.parametrize('chunk_elements', [1, 500, 5000, Landscape.DEFAULT_CHUNK_ELEMENTS])
+def test_chunk_budget_gives_same_grid(problem, unlimited, chunk_elements):
+    result = landscape(problem, chunk_elements=chunk_elements)
+    np.testing.assert_allclose(result['chi_squared'], unlimited['chi_squared'], rtol=1e-12)
+    assert result['best'] == pytest.approx(unlimited['best'], rel=1e-12)
+
+
+def test_workers_give_same_grid(problem, unlimited):
+    result = landscape(problem, workers=2, chunk_elements=500)
+    np.testing.assert_allclose(result['chi_squared'], unlimited['chi_squared'], rtol=1e-12)
+
+
+def test_matches_chi_squared_at_each_point(problem, unlimited):
+    chi_squared = unlimited['chi_squared']
+    for ia, idisk, ibulge in [(0, 0, 0), (17, 2, 1), (59, 4, 3)]:
+        expected = problem.chi_squared(ALPHAS[ia], DISK_SCALES[idisk], BULGE_SCALES[ibulge])
+        assert chi_squared[ia, idisk, ibulge] == pytest.approx(expected, rel=1e-9)
+
+
+def test_best_points_are_lowest_first(unlimited):
+    best = unlimited['best']
+    assert len(best) == 10
+    values = [point['chi_squared'] for point in best]
+    assert values == sorted(values)
+    assert values[0] == np.nanmin(unlimited['chi_squared'])
@@ -0,0 +1,86 @@
+# Several Milky Way models at once give what each model gives alone
+
+import os
+
+import numpy as np
+import pytest
+from scipy.interpolate import interp1d
+
+import DataAid
+import DataReader
+import Neros
+from conftest import DATA_DIR, SPARC_DIR
+
+# XueSofue ends at 59.9 kpc and McGaugh at 152 kpc, so galaxies past 60 kpc
+# are trimmed for one model and not the other
+MILKY_WAYS = {
+    'XueSofue': 'XueSofue/MW_lum.dat',
+    'McGaugh': 'McGaugh/MW_lumMcGaugh.txt',
+    'McGaughSmallR': 'McGaugh/MW_lumMcGaughGAIA_small_r.txt',
+}
+GALAXIES = ['CamB_rotmod', 'NGC2403_rotmod', 'NGC3198_rotmod', 'UGC02953_rotmod']
+# The ensemble interpolates the Milky Way phi through the union of the
+# tables' radii, which is only the same to rounding, so poorly constrained
+# parameters (CamB's disk_scale is about 3e-6) can move a little more
+TOLERANCE = {'chi_squared': 1e-9, 'phi_zero': 1e-12, 'alpha': 1e-6, 'disk_scale': 1e-6, 'bulge_scale': 1e-6}
+
+
+@pytest.fixture(scope='module')
+def models():
+    return {name: DataReader.readValues(os.path.join(DATA_DIR, path))[:, :2]
+            for name, path in MILKY_WAYS.items()}
+
+
+@pytest.fixture(scope='module')
+def ensemble(models):
+    return Neros.MilkyWayEnsemble(models)
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    galaxies = DataAid.GetGalaxyData(SPARC_DIR)
+    return {name: galaxies[name] for name in GALAXIES}
+
+
+def test_phi_matches_interp1d(ensemble):
+    rad = np.concatenate([np.random.default_rng(0).uniform(0, 160, 1000), ensemble.table_rad])
+    phi = ensemble.mw_phi(rad)
+    for row, model in zip(phi, ensemble.models):
+        reference = interp1d(model.mw_rad, model.mw_phi, bounds_error=False, fill_value=np.nan)(rad)
+        np.testing.assert_allclose(row, reference, rtol=1e-12, atol=0)
+        np.testing.assert_array_equal(np.isnan(row), np.isnan(reference))
+
+
+def test_vLCM_matches_each_model(ensemble):
+    rad = np.linspace(0.5, 59, 50)
+    vLum = 120 * np.sqrt(rad / (2 + rad))
+    vLCM = ensemble.vLCM(rad, vLum)
+    vNeros = ensemble.vNeros(rad, vLum, [0.1, 0.2, 0.3])
+    for i, model in enumerate(ensemble.models):
+        np.testing.assert_allclose(vLCM[i], model.vLCM(rad, vLum), rtol=1e-10)
+        np.testing.assert_allclose(vNeros[i], model.vNeros(rad, vLum, 0.1*(i + 1)), rtol=1e-10)
+
+
+def test_radii_past_a_model_are_nan(ensemble):
+    rad = np.linspace(1, 100, 30)
+    vLCM = ensemble.vLCM(rad, 100 * np.ones_like(rad))
+    xue_sofue = ensemble.names.index('XueSofue')
+    past = rad > ensemble.mw_rad_max[xue_sofue]
+    assert np.isnan(vLCM[xue_sofue, past]).all()
+    assert not np.isnan(np.delete(vLCM, xue_sofue, axis=0)).any()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_fit_catalog_matches_each_model(ensemble, models, catalog, workers):
+    df = ensemble.fit_catalog(catalog, workers=workers)
+    assert len(df) == len(GALAXIES) * len(MILKY_WAYS)
+    # Only XueSofue fits everything, a galaxy starts inside the McGaugh tables
+    assert df[df['MW'] == 'XueSofue']['error'].isna().all()
+
+    for name, milky_way in models.items():
+        expected = Neros.fit_catalog(catalog, milky_way, workers=1).set_index('Galaxy')
+        rows = df[df['MW'] == name].set_index('Galaxy')
+        assert list(rows['error'].fillna('')) == list(expected.loc[rows.index, 'error'].fillna(''))
+        for column, tolerance in TOLERANCE.items():
+            np.testing.assert_allclose(rows[column], expected.loc[rows.index, column], rtol=tolerance,
+                                       err_msg=f"{name} {column}")
@@ -0,0 +1,60 @@
+# The Milky Way phi table interpolates exactly as interp1d did
+
+import os
+
+import numpy as np
+import pytest
+from scipy.interpolate import interp1d
+
+import DataReader
+import Neros
+from conftest import DATA_DIR
+
+MILKY_WAYS = ['XueSofue/MW_lum.dat', 'MW_lum-originalXueSofue.dat', 'McGaugh/MW_lumMcGaugh.txt',
+              'McGaugh/MW_lumMcGaughGAIA_small_r.txt']
+
+
+@pytest.fixture(scope='module', params=MILKY_WAYS)
+def neros(request):
+    return Neros.Neros(DataReader.readValues(os.path.join(DATA_DIR, request.param))[:, :2])
+
+
+def radii(neros, n=500, seed=0):
+    """Random radii across the table, plus every table radius and both ends"""
+    low, high = neros.mw_rad.min(), neros.mw_rad.max()
+    random = np.random.default_rng(seed).uniform(low, high, n)
+    return np.concatenate([random, neros.mw_rad, [low, high]])
+
+
+def test_matches_interp1d(neros):
+    reference = interp1d(neros.mw_rad, neros.mw_phi)
+    rad = radii(neros)
+    np.testing.assert_allclose(neros.mw_phi_interp(rad), reference(rad), rtol=1e-12, atol=0)
+
+
+def test_table_radii_are_exact(neros):
+    np.testing.assert_array_equal(neros.mw_phi_interp(neros.mw_rad), neros.mw_phi)
+
+
+def test_table_is_sorted(neros):
+    table = neros.mw_phi_interp
+    assert np.all(np.diff(table.rad) > 0)
+    np.testing.assert_array_equal(np.sort(neros.mw_rad), table.rad)
+
+
+@pytest.mark.parametrize('side', ['below', 'above'])
+def test_out_of_range_raises_like_interp1d(neros, side):
+    rad = neros.mw_rad.min() * 0.5 if side == 'below' else neros.mw_rad.max() * 1.01
+    galaxy_rad = np.array([np.median(neros.mw_rad), rad])
+    with pytest.raises(ValueError, match=side):
+        interp1d(neros.mw_rad, neros.mw_phi)(galaxy_rad)
+    with pytest.raises(ValueError, match=side):
+        neros.mw_phi_interp(galaxy_rad)
+
+
+def test_vLCM_matches_interp1d(neros):
+    rad = np.linspace(neros.mw_rad.min() * 2, neros.mw_rad.max() * 0.9, 40)
+    vLum = 100 * np.sqrt(rad / (1 + rad))
+    reference = interp1d(neros.mw_rad, neros.mw_phi)(rad)
+    expected = neros.vLCM_from_phi(reference, neros.phi(rad, vLum), vLum, reference[-1])
+    np.testing.assert_allclose(neros.vLCM(rad, vLum), expected, rtol=1e-10)
@@ -0,0 +1,75 @@
+# Multi-start fits are at least as good as the usual single start
+
+import numpy as np
+import pytest
+
+import DataAid
+import DataReader
+import MultiStart
+import Neros
+from conftest import MILKY_WAY_FILE, SPARC_DIR
+
+# UGC04305 fails from the usual starting point
+GALAXIES = ['CamB_rotmod', 'NGC3198_rotmod', 'UGC02953_rotmod', 'UGC04305_rotmod']
+
+
+@pytest.fixture(scope='module')
+def problems():
+    neros = Neros.Neros(DataReader.readValues(MILKY_WAY_FILE)[:, :2])
+    galaxies = DataAid.GetGalaxyData(SPARC_DIR)
+    return {name: neros.prepare(*Neros.galaxy_columns(galaxies[name])) for name in GALAXIES}
+
+
+def singleStart(problem):
+    try:
+        fit_vals, _ = problem.fit()
+    except RuntimeError:
+        return np.inf
+    return problem.chi_squared(*fit_vals)
+
+
+@pytest.mark.parametrize('name', GALAXIES)
+def test_at_least_as_good_as_one_start(problems, name):
+    problem = problems[name]
+    result = MultiStart.fit_multistart(problem)
+    assert np.isfinite(result['chi_squared'])
+    assert result['chi_squared'] <= singleStart(problem) * (1 + 1e-9)
+    assert result['chi_squared'] == problem.chi_squared(*result['fit_vals'])
+    assert result['starts'][0]['p0'] == MultiStart.DEFAULT_START
+
+
+def test_rescues_a_failed_fit(problems):
+    assert singleStart(problems['UGC04305_rotmod']) == np.inf
+    assert np.isfinite(MultiStart.fit_multistart(problems['UGC04305_rotmod'])['chi_squared'])
+
+
+@pytest.mark.parametrize('name', GALAXIES)
+def test_no_start_at_zero_alpha(problems, name):
+    problem = problems[name]
+    starts = MultiStart.startingPoints(problem, n_starts=8)
+    assert len(starts) == 8
+    assert len(set(starts)) == len(starts)
+    assert all(start[0] != 0 for start in starts)
+
+
+def test_workers_give_the_same_fit(problems):
+    problem = problems['NGC3198_rotmod']
+    serial = MultiStart.fit_multistart(problem, workers=1, agree=8)
+    parallel = MultiStart.fit_multistart(problem, workers=2, agree=8)
+    assert parallel['chi_squared'] == serial['chi_squared']
+
+
+@pytest.mark.parametrize('error', [RuntimeError, ValueError, np.linalg.LinAlgError])
+def test_failed_starts(problems, monkeypatch, error):
+    problem = problems['CamB_rotmod']
+    fit = type(problem).fit
+
+    def failingAtTheDefault(self, p0=MultiStart.DEFAULT_START, **kwargs):
+        if tuple(p0) == MultiStart.DEFAULT_START:
+            raise error("no fit")
+        return fit(self, p0=p0, **kwargs)
+    monkeypatch.setattr(type(problem), 'fit', failingAtTheDefault)
+
+    result = MultiStart.fit_multistart(problem)
+    assert result['starts'][0]['error'] == 'no fit'
+    assert np.isfinite(result['chi_squared'])
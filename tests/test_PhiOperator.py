@@ -0,0 +1,107 @@
+# PhiOperator weights against SciPy's cumulative integrals
+
+import os
+
+import numpy as np
+import pytest
+from scipy.integrate import cumulative_simpson, cumulative_trapezoid
+
+import DataReader
+import Neros
+from conftest import MILKY_WAY_FILE, SPARC_DIR
+
+c = Neros.c
+
+
+def scipyPhi(rad, vLum_squared, integrate, **kwargs):
+    """phi the way Neros.phi worked it out before PhiOperator, integrating from r = 0"""
+
+    y = np.concatenate([[0], vLum_squared / (rad*c*c)])
+    x = np.concatenate([[0], rad])
+    return integrate(y, x=x, **kwargs)
+
+
+@pytest.fixture
+def curve():
+    rng = np.random.default_rng(0)
+    rad = np.sort(rng.uniform(0.1, 30, 25))
+    return rad, rng.uniform(0, 200, len(rad))**2
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 4, 25])
+def test_trapezoid_matches_scipy(curve, n):
+    rad, vLum_squared = curve[0][:n], curve[1][:n]
+    phi = Neros.PhiOperator(rad)(vLum_squared)
+    # Exactly the same operations, so exactly the same numbers
+    np.testing.assert_array_equal(phi, scipyPhi(rad, vLum_squared, cumulative_trapezoid))
+
+
+@pytest.mark.parametrize('n', [2, 3, 4, 5, 25])
+def test_simpson_matches_scipy(curve, n):
+    rad, vLum_squared = curve[0][:n], curve[1][:n]
+    phi = Neros.PhiOperator(rad, 'simpson')(vLum_squared)
+    np.testing.assert_allclose(phi, scipyPhi(rad, vLum_squared, cumulative_simpson), rtol=1e-13)
+
+
+def test_simpson_single_radius_is_trapezoid(curve):
+    rad, vLum_squared = curve[0][:1], curve[1][:1]
+    np.testing.assert_array_equal(Neros.PhiOperator(rad, 'simpson')(vLum_squared),
+                                  Neros.PhiOperator(rad)(vLum_squared))
+
+
+def test_simpson_is_exact_for_quadratics():
+    rad = np.array([0.5, 1.0, 2.5, 3.0, 4.5, 7.0])
+    # vLum^2/(r c^2) = r^2 integrates to r^3/3
+    phi = Neros.PhiOperator(rad, 'simpson')(rad**3 * c*c)
+    np.testing.assert_allclose(phi, rad**3 / 3, rtol=1e-12)
+
+
+def test_simpson_repeated_radii():
+    # Stencils with a repeated radius fall back to the trapezoid rule
+    rad = np.array([1.0, 2.0, 2.0, 3.0, 4.0, 5.0])
+    vLum_squared = rad**2 * c*c
+    phi = Neros.PhiOperator(rad, 'simpson')(vLum_squared)
+    assert np.isfinite(phi).all()
+    assert phi[2] == phi[1]
+    np.testing.assert_allclose(phi, Neros.PhiOperator(rad)(vLum_squared), rtol=0.1)
+
+
+def test_simpson_milky_way():
+    milky_way = DataReader.readValues(MILKY_WAY_FILE)
+    milky_way = milky_way[np.argsort(milky_way[:, 0])]
+    rad, vLum_squared = milky_way[:, 0], milky_way[:, 1]**2
+    phi = Neros.PhiOperator(rad, 'simpson')(vLum_squared)
+    np.testing.assert_allclose(phi, scipyPhi(rad, vLum_squared, cumulative_simpson), rtol=1e-12)
+
+
+@pytest.mark.parametrize('rule', Neros.INTEGRATION_RULES)
+def test_rows_and_matrix(curve, rule):
+    rad, vLum_squared = curve
+    operator = Neros.PhiOperator(rad, rule)
+    rows = np.stack([vLum_squared, 2*vLum_squared, np.zeros_like(vLum_squared)])
+
+    phi = operator(rows)
+    for row, row_phi in zip(rows, phi):
+        np.testing.assert_array_equal(row_phi, operator(row))
+    np.testing.assert_allclose(operator.matrix @ vLum_squared, phi[0], rtol=1e-12)
+
+
+@pytest.mark.parametrize('rule', Neros.INTEGRATION_RULES)
+def test_a_set_of_radii_per_row(curve, rule):
+    rad, vLum_squared = curve
+    rads = np.stack([rad, 1.5*rad])
+    phi = Neros.PhiOperator(rads, rule)(np.stack([vLum_squared, vLum_squared]))
+    np.testing.assert_allclose(phi[0], Neros.PhiOperator(rad, rule)(vLum_squared), rtol=1e-14)
+    np.testing.assert_allclose(phi[1], Neros.PhiOperator(1.5*rad, rule)(vLum_squared), rtol=1e-14)
+
+
+def test_neros_phi_of_a_galaxy():
+    galaxy = DataReader.readValues(os.path.join(SPARC_DIR, 'NGC3198_rotmod.dat'))
+    rad, vGas = galaxy[:, 0], galaxy[:, 3]
+    neros = Neros.Neros(DataReader.readValues(MILKY_WAY_FILE)[:, :2])
+    np.testing.assert_array_equal(neros.phi(rad, vGas), scipyPhi(rad, vGas**2, cumulative_trapezoid))
+
+
+def test_unknown_rule():
+    with pytest.raises(ValueError):
+        Neros.PhiOperator([1.0, 2.0], 'midpoint')
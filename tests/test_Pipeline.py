@@ -0,0 +1,97 @@
+# Streaming fits of several catalogs
+
+import csv
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import CatalogFile
+import DataAid
+import DataReader
+import GalaxyCatalog
+import Pipeline
+import ResultsStore
+from conftest import DATA_DIR, MILKY_WAY_FILE, SPARC_DIR
+
+GALAXIES = ['CamB_rotmod.dat', 'D631-7_rotmod.dat', 'DDO064_rotmod.dat']
+
+
+@pytest.fixture(scope='module')
+def milky_way():
+    return DataReader.readValues(MILKY_WAY_FILE)[:, :2]
+
+
+@pytest.fixture
+def catalogs(tmp_path):
+    """Two small catalog directories, the second with a file that can't be parsed"""
+
+    first = tmp_path / 'first'
+    second = tmp_path / 'second'
+    for directory, names in ((first, GALAXIES[:2]), (second, GALAXIES[2:])):
+        directory.mkdir()
+        for name in names:
+            shutil.copy(os.path.join(SPARC_DIR, name), directory)
+    (second / 'Broken_rotmod.dat').write_text('# Rad\tVobs\n1.0 foo\n')
+    return str(first) + os.sep, str(second) + os.sep
+
+
+def readRows(filename):
+    with open(filename, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run(milky_way, catalogs, tmp_path, workers):
+    out = str(tmp_path / 'results.csv')
+    count, failed = Pipeline.run(list(catalogs), milky_way, out, workers=workers, threads=2, prefetch=2)
+
+    rows = readRows(out)
+    assert (count, failed) == (4, 1)
+    assert len(rows) == 4
+    assert list(rows[0]) == Pipeline.RESULT_COLUMNS
+    by_catalog = {}
+    for row in rows:
+        by_catalog.setdefault(row['Catalog'], []).append(row['Galaxy'])
+    assert sorted(by_catalog['first']) == ['CamB_rotmod', 'D631-7_rotmod']
+    assert sorted(by_catalog['second']) == ['Broken_rotmod', 'DDO064_rotmod']
+
+    errors = {row['Galaxy']: row['error'] for row in rows}
+    assert errors['Broken_rotmod'].startswith('ValueError')
+    assert all(not errors[x] for x in errors if x != 'Broken_rotmod')
+
+
+def test_packed_catalog_and_store(milky_way, catalogs, tmp_path):
+    packed = str(tmp_path / 'first.rcat')
+    CatalogFile.packCatalog(catalogs[0], packed)
+    store_file = str(tmp_path / 'results.sqlite')
+    count, failed = Pipeline.run([packed, catalogs[1]], milky_way, str(tmp_path / 'results.csv'),
+                                 workers=1, store=store_file, mw_name='XueSofue')
+
+    assert (count, failed) == (4, 1)
+    with ResultsStore.ResultsStore(store_file) as store:
+        assert store.galaxies('XueSofue') == ['Broken_rotmod', 'CamB_rotmod', 'D631-7_rotmod', 'DDO064_rotmod']
+        assert np.isfinite(store.get('XueSofue', 'CamB_rotmod')['alpha'])
+
+
+def test_store_refuses_shared_names(milky_way, catalogs, tmp_path):
+    copy = tmp_path / 'copy'
+    shutil.copytree(catalogs[0], copy)
+    with pytest.raises(ValueError, match='CamB_rotmod'):
+        Pipeline.run([catalogs[0], str(copy) + os.sep], milky_way, str(tmp_path / 'results.csv'),
+                     store=str(tmp_path / 'results.sqlite'), mw_name='XueSofue')
+    assert not os.path.exists(tmp_path / 'results.sqlite')
+
+
+def test_galaxyNames_match_loadGalaxies(catalogs):
+    for catalog in catalogs:
+        loaded = [name for _, name, _ in Pipeline.loadGalaxies(catalog)]
+        assert loaded == Pipeline.galaxyNames(catalog)
+
+
+def test_names_match_GetGalaxyData():
+    directory = os.path.join(DATA_DIR, 'LCMFits', 'data', '')
+    expected = sorted(DataAid.GetGalaxyData(directory))
+    assert sorted(Pipeline.galaxyNames(directory)) == expected
+    assert sorted(GalaxyCatalog.fromDirectory(directory).keys()) == expected
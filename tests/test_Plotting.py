@@ -0,0 +1,71 @@
+# Rotation curve plots render from fit results
+
+import os
+import re
+
+import numpy as np
+import pytest
+
+import DataAid
+import DataReader
+import Neros
+import Plotting
+from conftest import MILKY_WAY_FILE, SPARC_DIR
+
+GALAXIES = ['CamB_rotmod', 'DDO154_rotmod', 'NGC2403_rotmod']
+
+
+@pytest.fixture(scope='module')
+def milky_way():
+    return DataReader.readValues(MILKY_WAY_FILE)[:, :2]
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    galaxies = DataAid.GetGalaxyData(SPARC_DIR)
+    catalog = {name: galaxies[name] for name in GALAXIES}
+    catalog['Broken'] = np.ones((5, 2))
+    return catalog
+
+
+@pytest.fixture(scope='module')
+def curves(catalog, milky_way):
+    results = Neros.fit_catalog(catalog, milky_way, workers=1)
+    return Plotting.curves_from_results(catalog, milky_way, results)
+
+
+def test_curves_match_a_fit(catalog, milky_way, curves):
+    assert [curve['Galaxy'] for curve in curves] == GALAXIES
+    neros = Neros.Neros(milky_way)
+    for curve in curves:
+        neros.fit(*Neros.galaxy_columns(catalog[curve['Galaxy']]))
+        expected = Plotting.galaxy_curves(neros, curve['Galaxy'])
+        assert curve['chi_squared'] == pytest.approx(expected['chi_squared'], rel=1e-9)
+        for key in ('rad', 'vNeros', 'vLum', 'vObs', 'vObsError'):
+            np.testing.assert_allclose(curve[key], expected[key], rtol=1e-9, err_msg=key)
+
+
+def isImage(filename, magic):
+    with open(filename, 'rb') as f:
+        return os.path.getsize(filename) > 1000 and f.read(len(magic)) == magic
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_render_galaxies(curves, tmp_path, workers):
+    files = Plotting.render_galaxies(curves, out_dir=str(tmp_path / 'graphs'), mw_name='MW_lum',
+                                     workers=workers, dpi=50)
+    assert sorted(os.path.basename(x) for x in files) == [f"{name}_MW_lum.png" for name in GALAXIES]
+    for filename in files:
+        assert isImage(filename, b'\x89PNG')
+
+
+def test_render_pdf(curves, tmp_path):
+    filename = str(tmp_path / 'curves.pdf')
+    Plotting.render_pdf(curves, filename)
+    assert isImage(filename, b'%PDF')
+    with open(filename, 'rb') as f:
+        assert len(re.findall(rb'/Type\s*/Page\b(?!s)', f.read())) == len(GALAXIES)
+
+
+def test_nothing_to_render(tmp_path):
+    assert Plotting.render_galaxies([], out_dir=str(tmp_path / 'empty'), workers=2) == []
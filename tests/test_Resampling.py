@@ -0,0 +1,101 @@
+# Bootstrap and jackknife resampling
+
+import numpy as np
+import pytest
+
+import DataAid
+import DataReader
+import Neros
+import Resampling
+from conftest import MILKY_WAY_FILE, SPARC_DIR
+
+GALAXY = 'NGC3198_rotmod'
+
+
+@pytest.fixture(scope='module')
+def neros():
+    return Neros.Neros(DataReader.readValues(MILKY_WAY_FILE)[:, :2])
+
+
+@pytest.fixture(scope='module')
+def galaxy():
+    return DataAid.GetGalaxyData(SPARC_DIR)[GALAXY]
+
+
+@pytest.fixture(scope='module')
+def problem(neros, galaxy):
+    return neros.prepare(*Neros.galaxy_columns(galaxy))
+
+
+def test_jackknife_leaves_out_one_point():
+    weights = Resampling.jackknifeWeights(7)
+    assert weights.shape == (7, 7)
+    assert np.all(np.isin(weights, [0, 1]))
+    np.testing.assert_array_equal(np.flatnonzero(weights == 0), np.arange(7) * 8)
+
+
+def test_bootstrap_draws_every_sample_in_full():
+    weights = Resampling.bootstrapWeights(9, 50, np.random.default_rng(1))
+    assert weights.shape == (50, 9)
+    assert np.all(weights.sum(axis=1) == 9)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_same_seed_same_intervals(problem, workers):
+    reference = Resampling.bootstrap(problem, n_replicas=40, seed=3, workers=1, batch=40)
+    result = Resampling.bootstrap(problem, n_replicas=40, seed=3, workers=workers, batch=10)
+    np.testing.assert_array_equal(result['replicas'], reference['replicas'])
+    assert result['intervals'] == reference['intervals']
+    assert result['n_failed'] == reference['n_failed']
+
+
+def test_different_seed_different_replicas(problem):
+    first = Resampling.bootstrap(problem, n_replicas=20, seed=3)
+    second = Resampling.bootstrap(problem, n_replicas=20, seed=4)
+    assert not np.array_equal(first['replicas'], second['replicas'], equal_nan=True)
+
+
+def test_catalog_intervals_do_not_depend_on_workers(neros, galaxy):
+    catalog = {GALAXY: galaxy, 'CamB_rotmod': DataAid.GetGalaxyData(SPARC_DIR)['CamB_rotmod']}
+    milky_way = DataReader.readValues(MILKY_WAY_FILE)[:, :2]
+    serial = Resampling.bootstrap_catalog(catalog, milky_way, n_replicas=20, workers=1, batch=5)
+    parallel = Resampling.bootstrap_catalog(catalog, milky_way, n_replicas=20, workers=2, batch=5)
+    assert serial.drop(columns='error').equals(parallel.drop(columns='error'))
+
+
+def test_all_replicas_failing_gives_nan(problem, monkeypatch):
+    p0, _ = problem.fit()
+
+    def fail(self, *args, **kwargs):
+        raise RuntimeError("Optimal parameters not found")
+
+    monkeypatch.setattr(Neros.FitProblem, 'fit', fail)
+    result = Resampling.bootstrap(problem, n_replicas=10, p0=p0)
+    assert result['n_failed'] == 10
+    assert np.all(np.isnan(result['replicas']))
+    for low, high in result['intervals'].values():
+        assert np.isnan(low) and np.isnan(high)
+
+    result = Resampling.jackknife(problem, p0=p0)
+    assert result['n_failed'] == len(problem.rad)
+    assert all(np.isnan(value) for value in result['std_error'].values())
+
+
+def test_too_few_points_left_gives_nan(neros, galaxy):
+    # Leaving one of three points out leaves fewer points than parameters
+    problem = neros.prepare(*Neros.galaxy_columns(galaxy[:3]))
+    p0, _ = problem.fit()
+    result = Resampling.jackknife(problem, p0=p0)
+    assert result['n_failed'] == 3
+    assert all(np.isnan(value) for value in result['bias'].values())
+
+
+def test_other_errors_are_not_hidden(problem, monkeypatch):
+    p0, _ = problem.fit()
+
+    def broken(self, *args, **kwargs):
+        raise TypeError("unexpected keyword argument")
+
+    monkeypatch.setattr(Neros.FitProblem, 'fit', broken)
+    with pytest.raises(TypeError):
+        Resampling.bootstrap(problem, n_replicas=5, p0=p0)
@@ -0,0 +1,74 @@
+# Results go in and come back out of a ResultsStore unchanged
+
+import numpy as np
+import pytest
+
+import ResultsStore
+
+
+def fitRow(galaxy, alpha, error=None):
+    return {'Galaxy': galaxy, 'chi_squared': 1.5, 'alpha': alpha, 'disk_scale': 0.8,
+            'bulge_scale': 0.0, 'phi_zero': 1e-6, 'nfev': 12, 'fit_time': 0.01, 'error': error}
+
+
+def someCurves(n=5, scale=1.0):
+    rad = np.arange(1.0, n + 1)
+    return {'rad': rad, 'vNeros': scale*rad, 'vLum': 0.5*rad, 'vObs': rad + 1, 'vObsError': np.ones(n)}
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / 'results.sqlite')
+    covariance = np.arange(9.0).reshape(3, 3)
+    with ResultsStore.ResultsStore(filename) as store:
+        store.add('XueSofue', fitRow('a', 0.5), covariance=covariance, curves=someCurves())
+        store.add('XueSofue', fitRow('b', np.nan, error='RuntimeError: maxfev'))
+        store.add('McGaugh', fitRow('a', 0.7))
+
+    assert ResultsStore.isResultsStore(filename)
+    with ResultsStore.ResultsStore(filename) as store:
+        assert store.mw_models() == ['McGaugh', 'XueSofue']
+        assert store.galaxies('XueSofue') == ['a', 'b']
+        assert store.get('XueSofue', 'a')['alpha'] == 0.5
+        assert store.get('XueSofue', 'b')['error'] == 'RuntimeError: maxfev'
+        assert store.get('XueSofue', 'b')['alpha'] is None
+        np.testing.assert_array_equal(store.covariance('XueSofue', 'a'), covariance)
+        assert store.covariance('McGaugh', 'a') is None
+        np.testing.assert_array_equal(store.curves('XueSofue', 'a')['vObs'], someCurves()['vObs'])
+        assert list(store.results()['MW']) == ['McGaugh', 'XueSofue', 'XueSofue']
+        with pytest.raises(KeyError):
+            store.get('XueSofue', 'c')
+
+
+@pytest.mark.parametrize('batch_size', [1, 500])
+def test_refit_without_curves_drops_old_curves(tmp_path, batch_size):
+    with ResultsStore.ResultsStore(str(tmp_path / 'results.sqlite'), batch_size) as store:
+        store.add('XueSofue', fitRow('a', 0.5), curves=someCurves())
+        store.add('XueSofue', fitRow('other', 0.5), curves=someCurves())
+        store.flush()
+        store.add('XueSofue', fitRow('a', np.nan, error='RuntimeError: maxfev'))
+
+        assert store.get('XueSofue', 'a')['error'] == 'RuntimeError: maxfev'
+        with pytest.raises(KeyError):
+            store.curves('XueSofue', 'a')
+        # Other galaxies keep theirs
+        store.curves('XueSofue', 'other')
+
+
+def test_last_add_in_a_batch_wins(tmp_path):
+    with ResultsStore.ResultsStore(str(tmp_path / 'results.sqlite')) as store:
+        store.add('XueSofue', fitRow('a', 0.5))
+        store.add('XueSofue', fitRow('a', 0.6), curves=someCurves(scale=2.0))
+        np.testing.assert_array_equal(store.curves('XueSofue', 'a')['vNeros'], someCurves(scale=2.0)['vNeros'])
+
+        store.add('XueSofue', fitRow('a', 0.7), curves=someCurves())
+        store.add('XueSofue', fitRow('a', 0.8))
+        assert store.get('XueSofue', 'a')['alpha'] == 0.8
+        with pytest.raises(KeyError):
+            store.curves('XueSofue', 'a')
+
+
+def test_not_a_store(tmp_path):
+    path = tmp_path / 'results.csv'
+    path.write_text('Galaxy,alpha\na,0.5\n')
+    assert not ResultsStore.isResultsStore(str(path))
+    assert not ResultsStore.isResultsStore(str(tmp_path / 'missing.sqlite'))
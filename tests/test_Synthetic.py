@@ -0,0 +1,91 @@
+# Fits of a low noise synthetic catalog get back the parameters it was made with
+
+import os
+
+import numpy as np
+import pytest
+
+import CatalogFile
+import DataAid
+import DataReader
+import Neros
+import Synthetic
+from conftest import MILKY_WAY_FILE
+
+N_GALAXIES = 30
+SEED = 2
+
+# Relative error allowed on each fit parameter
+TOLERANCE = {'alpha': 0.02, 'disk_scale': 1e-3, 'bulge_scale': 1e-3}
+
+
+@pytest.fixture(scope='module')
+def milky_way():
+    return DataReader.readValues(MILKY_WAY_FILE)[:, :2]
+
+
+@pytest.fixture(scope='module')
+def synthetic(milky_way):
+    return Synthetic.syntheticCatalog(N_GALAXIES, milky_way, seed=SEED, noise=1e-4, error_floor=1e-3)
+
+
+def checkWithinTolerance(recovery):
+    assert recovery['error'].isna().all()
+    for name, tolerance in TOLERANCE.items():
+        worst = recovery[name + '_rel_error'].abs().max()
+        assert worst < tolerance, name
+
+
+def test_multistart_recovers_every_galaxy(milky_way, synthetic):
+    catalog, truth = synthetic
+    results = Neros.fit_catalog(catalog, milky_way, workers=2, multistart=True)
+    recovery = Synthetic.checkRecovery(truth, results)
+    assert len(recovery) == N_GALAXIES
+    checkWithinTolerance(recovery)
+
+
+def test_good_single_start_fits_recover_the_truth(milky_way, synthetic):
+    # A single start can end up in a local minimum, which shows as a large chi^2
+    catalog, truth = synthetic
+    results = Neros.fit_catalog(catalog, milky_way, workers=1)
+    recovery = Synthetic.checkRecovery(truth, results)
+    good = recovery[recovery['chi_squared'] < 3]
+    assert len(good) >= 0.9 * N_GALAXIES
+    checkWithinTolerance(good)
+
+
+def test_same_seed_same_catalog(milky_way, synthetic):
+    catalog, truth = synthetic
+    again, again_truth = Synthetic.syntheticCatalog(N_GALAXIES, milky_way, seed=SEED, noise=1e-4, error_floor=1e-3)
+    np.testing.assert_array_equal(again.data, catalog.data)
+    assert again_truth.equals(truth)
+
+    _, other_truth = Synthetic.syntheticCatalog(N_GALAXIES, milky_way, seed=SEED + 1)
+    assert not np.array_equal(other_truth['alpha'], truth['alpha'])
+
+
+def test_curves_are_in_range(milky_way, synthetic):
+    catalog, truth = synthetic
+    np.testing.assert_array_equal(catalog.lengths, truth['n_points'])
+    assert np.all(catalog.data[Synthetic.SPARC_COLUMNS.index('Vobs')] > 0)
+    assert catalog.data[0].max() <= milky_way[:, 0].max()
+    no_bulge = truth['bulge_a'].isna().to_numpy()
+    for name in np.asarray(truth['Galaxy'])[no_bulge]:
+        assert not catalog[name].vBulge.any()
+
+
+def test_written_files_read_back(synthetic, tmp_path):
+    catalog, truth = synthetic
+    directory = str(tmp_path / 'synthetic') + os.sep
+    Synthetic.writeDirectory(catalog, truth, directory)
+    galaxies = DataAid.GetGalaxyData(directory)
+    assert sorted(galaxies) == catalog.keys()
+    for name, values in galaxies.items():
+        np.testing.assert_allclose(values, np.asarray(catalog[name]), rtol=1e-5)
+
+    filename = str(tmp_path / 'synthetic.rcat')
+    Synthetic.writeCatalogFile(catalog, truth, filename)
+    packed = CatalogFile.openCatalog(filename)
+    assert packed.keys() == catalog.keys()
+    for name in catalog.keys():
+        np.testing.assert_array_equal(packed[name], np.asarray(catalog[name]))
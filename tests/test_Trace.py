@@ -0,0 +1,62 @@
+# Every traced fit gets a record, including the ones that fail
+
+import json
+
+import numpy as np
+import pytest
+
+import DataAid
+import DataReader
+import Neros
+import Trace
+from conftest import MILKY_WAY_FILE, SPARC_DIR
+
+GALAXIES = ['CamB_rotmod', 'D631-7_rotmod', 'DDO064_rotmod']
+
+
+@pytest.fixture(scope='module')
+def milky_way():
+    return DataReader.readValues(MILKY_WAY_FILE)[:, :2]
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    galaxies = DataAid.GetGalaxyData(SPARC_DIR)
+    return {name: galaxies[name] for name in GALAXIES}
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_a_record_per_galaxy(milky_way, catalog, workers, tmp_path):
+    trace = Trace.Tracer()
+    df = Neros.fit_catalog(catalog, milky_way, workers=workers, trace=trace)
+
+    records = {x['Galaxy']: x for x in trace.records}
+    assert sorted(records) == sorted(GALAXIES)
+    for row in df.to_dict('records'):
+        record = records[row['Galaxy']]
+        assert record['status'] == 'converged'
+        assert record['nfev'] == row['nfev']
+        assert set(record['stages']) == {'prepare', 'fit', 'results'}
+        assert record['residual_norm'] > 0
+
+    trace.write(str(tmp_path / 'trace.jsonl'))
+    with open(tmp_path / 'trace.jsonl') as f:
+        assert len([json.loads(line) for line in f]) == len(GALAXIES)
+    trace.writeChromeTrace(str(tmp_path / 'trace.json'))
+
+
+@pytest.mark.parametrize('error', [RuntimeError, ValueError, np.linalg.LinAlgError])
+@pytest.mark.parametrize('multistart', [False, True])
+def test_failed_fits_are_recorded(milky_way, catalog, monkeypatch, error, multistart):
+    def failingFit(self, *args, **kwargs):
+        raise error("no fit")
+    monkeypatch.setattr(Neros.FitProblem, 'fit', failingFit)
+
+    trace = Trace.Tracer()
+    df = Neros.fit_catalog(catalog, milky_way, workers=1, trace=trace, multistart=multistart)
+
+    assert df['error'].notna().all()
+    assert len(trace.records) == len(GALAXIES)
+    for record in trace.records:
+        assert record['status'] == 'failed'
+        assert record['message'] == f"{error.__name__}: no fit"
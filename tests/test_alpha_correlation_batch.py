@@ -0,0 +1,97 @@
+# The batch alpha(L/Reff) fits agree with alpha_correlation_plots.py
+
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import linregress
+
+import DataAid
+import DataReader
+import Neros
+import ResultsStore
+from conftest import DATA_DIR, MILKY_WAY_FILE, SPARC_DIR, loadScript
+
+batch = loadScript('fit-analysis/alpha_correlation_batch.py')
+plots = loadScript('fit-analysis/alpha_correlation_plots.py')
+
+RATIOS = os.path.join(DATA_DIR, 'L_Reff_ratio.txt')
+N_GALAXIES = 25
+
+
+@pytest.fixture(scope='module')
+def fits(tmp_path_factory):
+    """A CSV of successful fits of some galaxies in the L/Reff table"""
+    ratios = DataReader.readLuminosityRatios(RATIOS)
+    galaxies = DataAid.GetGalaxyData(SPARC_DIR)
+    names = [name for name in galaxies if name in ratios][:N_GALAXIES]
+    df = Neros.fit_catalog({name: galaxies[name] for name in names},
+                           DataReader.readValues(MILKY_WAY_FILE)[:, :2], workers=1)
+    df = df[df['error'].isna()]
+    filename = tmp_path_factory.mktemp('fits') / 'MW_lum.csv'
+    df.to_csv(filename, index=False)
+    return str(filename)
+
+
+def test_matches_the_plot_script(fits, tmp_path, capsys):
+    plots.make_alpha_correlation_plots(fits, RATIOS, 'fits', str(tmp_path / 'plot.png'))
+    printed = dict(re.findall(r'^(\S+) .*= (\S+)$', capsys.readouterr().out, re.MULTILINE))
+
+    table = batch.alpha_correlations([fits], RATIOS, n_replicas=0)
+    assert len(table) == 1
+    row = table.iloc[0]
+    assert row['MW'] == 'MW_lum'
+    assert row['k'] == pytest.approx(float(printed['k']), rel=1e-10)
+    assert row['A'] == pytest.approx(float(printed['A']), rel=1e-10)
+    assert row['r_squared'] == pytest.approx(float(printed['R^2']), rel=1e-10)
+    assert np.isnan(row['k_low'])
+
+
+def test_matches_linregress(fits):
+    merged = pd.read_csv(RATIOS, sep='\t', skiprows=1).merge(pd.read_csv(fits), on='Galaxy')
+    expected = linregress(np.log(merged['L/R sof']), np.log(merged['alpha']))
+
+    row = batch.alpha_correlations([fits], RATIOS, n_replicas=0).iloc[0]
+    assert row['n'] == len(merged)
+    assert row['k'] == pytest.approx(expected.slope, rel=1e-10)
+    assert row['A'] == pytest.approx(np.exp(expected.intercept), rel=1e-10)
+    assert row['r_squared'] == pytest.approx(expected.rvalue**2, rel=1e-10)
+    assert row['k_stderr'] == pytest.approx(expected.stderr, rel=1e-10)
+
+
+def test_every_set_fit_at_once(fits, tmp_path):
+    # The same fits under two Milky Way names, one with the alphas doubled
+    df = pd.read_csv(fits)
+    with ResultsStore.ResultsStore(str(tmp_path / 'sets.sqlite')) as store:
+        store.add_many('first', df)
+        store.add_many('doubled', df.assign(alpha=2*df['alpha']))
+
+    table = batch.alpha_correlations([str(tmp_path / 'sets.sqlite'), fits], RATIOS, n_replicas=0)
+    table = table.set_index('MW')
+    assert sorted(table.index) == ['MW_lum', 'doubled', 'first']
+    assert table.loc['first', 'k'] == pytest.approx(table.loc['MW_lum', 'k'], rel=1e-12)
+    assert table.loc['doubled', 'k'] == pytest.approx(table.loc['first', 'k'], rel=1e-10)
+    assert table.loc['doubled', 'A'] == pytest.approx(2*table.loc['first', 'A'], rel=1e-10)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_bootstrap_intervals(fits, tmp_path, workers):
+    df = pd.read_csv(fits)
+    with ResultsStore.ResultsStore(str(tmp_path / 'sets.sqlite')) as store:
+        store.add_many('first', df)
+        store.add_many('doubled', df.assign(alpha=2*df['alpha']))
+
+    serial = batch.alpha_correlations([str(tmp_path / 'sets.sqlite')], RATIOS, n_replicas=200, workers=1)
+    table = batch.alpha_correlations([str(tmp_path / 'sets.sqlite')], RATIOS, n_replicas=200, workers=workers)
+    pd.testing.assert_frame_equal(table, serial)
+    for _, row in table.iterrows():
+        assert row['k_low'] < row['k'] < row['k_high']
+        assert row['A_low'] < row['A'] < row['A_high']
+
+
+def test_copies_are_matched_to_their_galaxy():
+    index = batch.RatioIndex({'CamB_rotmod': 1.0, 'DDO154_rotmod': 2.0})
+    np.testing.assert_array_equal(index.positions(['DDO154_rotmod-Copy1', 'CamB_rotmod', 'Unknown']),
+                                  [1, 0, -1])
@@ -0,0 +1,34 @@
+# Reading the fits to plot alpha against L/Reff
+
+import pytest
+
+import ResultsStore
+from conftest import loadScript
+
+plots = loadScript('fit-analysis/alpha_correlation_plots.py')
+
+
+def storeWith(path, models):
+    with ResultsStore.ResultsStore(str(path)) as store:
+        for mw, alpha in models.items():
+            store.add(mw, {'Galaxy': 'CamB_rotmod', 'alpha': alpha})
+            store.add(mw, {'Galaxy': 'D631-7_rotmod', 'alpha': 2*alpha})
+    return str(path)
+
+
+def test_one_model(tmp_path):
+    filename = storeWith(tmp_path / 'one.sqlite', {'XueSofue': 0.5})
+    assert list(plots.read_fit_results(filename)['alpha']) == [0.5, 1.0]
+
+
+def test_several_models_need_mw(tmp_path):
+    filename = storeWith(tmp_path / 'two.sqlite', {'XueSofue': 0.5, 'McGaugh': 0.25})
+    with pytest.raises(ValueError, match='McGaugh, XueSofue'):
+        plots.read_fit_results(filename)
+    assert list(plots.read_fit_results(filename, mw='McGaugh')['alpha']) == [0.25, 0.5]
+
+
+def test_csv(tmp_path):
+    path = tmp_path / 'fits.csv'
+    path.write_text('Galaxy,alpha\nCamB_rotmod,0.5\n')
+    assert list(plots.read_fit_results(str(path))['Galaxy']) == ['CamB_rotmod']
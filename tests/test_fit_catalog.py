@@ -0,0 +1,57 @@
+# Neros.fit_catalog gives the same rows as fitting each galaxy with Neros.fit
+
+import numpy as np
+import pytest
+
+import DataAid
+import DataReader
+import Neros
+from conftest import MILKY_WAY_FILE, SPARC_DIR
+
+GALAXIES = ['CamB_rotmod', 'D631-7_rotmod', 'DDO064_rotmod', 'NGC3198_rotmod', 'UGC02953_rotmod']
+RESULTS = ['chi_squared', 'alpha', 'disk_scale', 'bulge_scale', 'phi_zero', 'nfev']
+
+
+@pytest.fixture(scope='module')
+def milky_way():
+    return DataReader.readValues(MILKY_WAY_FILE)[:, :2]
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    galaxies = DataAid.GetGalaxyData(SPARC_DIR)
+    return {name: galaxies[name] for name in GALAXIES}
+
+
+def serialFit(milky_way, galaxy):
+    neros = Neros.Neros(milky_way)
+    rad, vGas, vDisk, vBulge, vObs, vObsError = Neros.galaxy_columns(galaxy)
+    neros.fit(rad, vGas, vDisk, vBulge, vObs, vObsError)
+    return dict(neros.get_fit_results(rad), nfev=neros.fit_info['nfev'])
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_matches_serial_fits(milky_way, catalog, workers):
+    df = Neros.fit_catalog(catalog, milky_way, workers=workers, chunksize=1)
+
+    assert list(df.columns) == Neros.FIT_RESULT_COLUMNS
+    assert list(df['Galaxy']) == GALAXIES
+    assert df['error'].isna().all()
+    for row in df.to_dict('records'):
+        expected = serialFit(milky_way, catalog[row['Galaxy']])
+        for column in RESULTS:
+            assert row[column] == expected[column], (row['Galaxy'], column)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_bad_galaxy_gives_an_error_row(milky_way, catalog, workers):
+    bad = dict(catalog)
+    bad['two_columns'] = np.ones((10, 2))
+    bad['not_numbers'] = [['a', 'b', 'c', 'd', 'e', 'f']]
+    df = Neros.fit_catalog(bad, milky_way, workers=workers)
+
+    errors = dict(zip(df['Galaxy'], df['error']))
+    assert errors['two_columns'].startswith('ValueError')
+    assert errors['not_numbers'].startswith('ValueError')
+    assert df.set_index('Galaxy').loc[GALAXIES, 'error'].isna().all()
+    assert df.set_index('Galaxy').loc[['two_columns', 'not_numbers'], 'alpha'].isna().all()
@@ -0,0 +1,77 @@
+# The command line runner
+
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import rcfm
+from conftest import MILKY_WAY_FILE, SPARC_DIR
+
+GALAXIES = ['CamB_rotmod', 'DDO154_rotmod', 'NGC2403_rotmod', 'NGC3198_rotmod', 'UGC02953_rotmod']
+
+
+@pytest.fixture(scope='module')
+def catalog_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('catalog')
+    for galaxy in GALAXIES:
+        shutil.copy(os.path.join(SPARC_DIR, galaxy + '.dat'), directory)
+    return str(directory)
+
+
+def fit(catalog_dir, out, *options):
+    rcfm.main(['fit', '--catalog', catalog_dir, '--mw', MILKY_WAY_FILE, '--workers', '1',
+               '--out', str(out), *options])
+
+
+@pytest.fixture(scope='module')
+def unsharded(catalog_dir, tmp_path_factory):
+    out = tmp_path_factory.mktemp('results')
+    fit(catalog_dir, out)
+    return pd.read_csv(out / f"{os.path.basename(catalog_dir)}_MW_lum.csv")
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 7])
+def test_shards_cover_the_catalog_once(catalog_dir, unsharded, tmp_path, count):
+    shards = []
+    for index in range(count):
+        fit(catalog_dir, tmp_path, '--shard', f"{index}/{count}")
+        shards.append(pd.read_csv(tmp_path / f"{os.path.basename(catalog_dir)}_MW_lum_shard{index}of{count}.csv"))
+
+    names = [name for df in shards for name in df['Galaxy']]
+    assert len(names) == len(set(names))
+    assert sorted(names) == sorted(GALAXIES)
+
+    combined = pd.concat(shards).set_index('Galaxy').loc[unsharded['Galaxy']].reset_index()
+    pd.testing.assert_frame_equal(combined.drop(columns='fit_time'), unsharded.drop(columns='fit_time'),
+                                  check_dtype=False)
+
+
+def test_shard_takes_every_nth_galaxy():
+    catalog = {name: None for name in GALAXIES}
+    part, suffix = rcfm.shard(catalog, (1, 2))
+    assert list(part) == GALAXIES[1::2]
+    assert suffix == "_shard1of2"
+    assert rcfm.shard(catalog, None) == (catalog, "")
+
+
+@pytest.mark.parametrize('spec', ['3/3', '-1/2', 'a/b', '1', '1/2/3'])
+def test_bad_shard_is_a_usage_error(catalog_dir, tmp_path, spec, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        fit(catalog_dir, tmp_path, '--shard', spec)
+    assert exit_info.value.code == 2
+    assert '--shard' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('option', ['--v1', '--v2'])
+def test_unknown_kernel_is_refused_before_loading(tmp_path, option):
+    # The catalog doesn't exist, so the kernel has to be checked first
+    with pytest.raises(SystemExit, match=f"argument {option}: invalid choice: 'bogus'"):
+        fit(str(tmp_path / 'missing'), tmp_path, option, 'bogus')
+    assert not os.listdir(tmp_path)
+
+
+def test_missing_catalog(tmp_path):
+    with pytest.raises(SystemExit, match="No catalog at"):
+        fit(str(tmp_path / 'missing'), tmp_path)
@@ -1,18 +1,17 @@
 ### this file checks for duplicate files
-### to run:
-### python3 checkForDuplicates.py
-### Note that DataAid.py does not load duplicate files, so dupes
-### within a single directory are fine
+### to run (from the top of the repo):
+### python3 utils/checkForDuplicates.py
+### Note that DataAid.getFiles(dir, unique=True) doesn't list duplicate
+### files, so dupes within a single directory can be skipped there
+###
+### The hashes are kept in duplicateIndex.sqlite (see DuplicateIndex.py),
+### so only new or changed files are read again on later runs
 
-from os import listdir
-from os.path import join
-from itertools import chain
-from collections import Counter, defaultdict
+import sys
+from os.path import abspath, dirname, join
 
-# Helper functions from DataAid.py and DataImport.py
-# I specifically want hashFile
-import DataAid
-import DataImporter
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+import DuplicateIndex
 
 # These are the directories used in the analysis,
 # Model_MarcusPaz_10_2_23.ipynb
@@ -25,34 +24,22 @@ directoryList.append("data/LCMFits/data/")
 directoryList.append("data/XueSofue/")
 directoryList.append("data/McGaugh/")
 
-# get a list of all the files in all the directories
-fileList = []
-for directory in directoryList:
-    thisFileList = [join(directory,x) for x in listdir(directory) if x[0] != '.']
-    fileList.append(thisFileList)
-
-# flatten fileList
-# and then get the hash of each file in the fileList
-fileList = list(chain.from_iterable(fileList))
-hashList = [DataAid.hashFile(x) for x in fileList]
-
-def duplicates(lst):
-    cnt= Counter(lst)
-    return [key for key in cnt.keys() if cnt[key]> 1]
-
-# returns a default dict that looks like
-# {hash1: [index0, index1], hash2: [index2, index3, index4], ...}
-def duplicates_indices(lst):
-    dup, ind= duplicates(lst), defaultdict(list)
-    for i, v in enumerate(lst):
-        if v in dup: ind[v].append(i)
-    return ind
-
-duplicatesDict = duplicates_indices(hashList)
-
-for _, duplicatesIndexList in duplicatesDict.items():
-    print("The following files are duplicates:")
-    for index in duplicatesIndexList:
-        print(fileList[index])
-    
-    print("\n")
\ No newline at end of file
+indexFile = join(dirname(abspath(__file__)), "duplicateIndex.sqlite")
+
+if __name__ == '__main__':
+    exact, numeric = DuplicateIndex.findDuplicates(directoryList, indexFile)
+
+    for files in exact:
+        print("The following files are duplicates:")
+        for fileName in files:
+            print(fileName)
+        print("\n")
+
+    # Files with the same numbers, that aren't already all the same file
+    exactGroups = {tuple(x) for x in exact}
+    for files in numeric:
+        if tuple(files) not in exactGroups:
+            print("The following files have the same data:")
+            for fileName in files:
+                print(fileName)
+            print("\n")